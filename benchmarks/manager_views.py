@@ -0,0 +1,177 @@
+"""Time the data manager and the main pages against a synthetic tree of working data
+
+Builds a tree of datasets, samples, reconstructions, and analyses (see ``synthetic.py``),
+then times the manager operations behind each page and the pages themselves, rendered
+through the Flask test client. Each operation is timed once after the metadata index is
+cleared ("cold") and then several more times ("warm").
+
+Results are written as JSON, so runs at different sizes or commits can be compared.
+Run with ``python benchmarks/manager_views.py --output results.json``.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import nucapt
+from nucapt import manager
+from nucapt.index import metadata_index
+from nucapt.manager import APTDataDirectory, APTSampleDirectory, APTReconstruction, APTAnalysisDirectory
+from nucapt.preview import preview_generator
+
+from synthetic import make_tree
+
+
+def time_operation(fn, repeats):
+    """Time an operation with a cold and then a warm metadata index
+
+    :param fn: function to be timed, takes no arguments
+    :param repeats: int, number of warm runs
+    :return: dict, times in seconds: cold, and the min, median, and max of the warm runs"""
+
+    metadata_index.clear()
+    start = time.time()
+    fn()
+    cold = time.time() - start
+
+    warm = []
+    for _ in range(repeats):
+        start = time.time()
+        fn()
+        warm.append(time.time() - start)
+    warm.sort()
+    return {'cold': cold, 'min': warm[0], 'median': warm[len(warm) // 2], 'max': warm[-1], 'repeats': repeats}
+
+
+def get_page(client, url):
+    """Make a function that fetches a page, and fails if it is not served
+
+    :param client: FlaskClient, client used to fetch the page
+    :param url: str, path to the page
+    :return: function"""
+
+    def fetch():
+        rv = client.get(url)
+        if rv.status_code != 200:
+            raise ValueError('%s returned status %d' % (url, rv.status_code))
+    return fetch
+
+
+def run_benchmarks(path, repeats):
+    """Time the operations against the tree at a certain path
+
+    :param path: str, path to the tree
+    :param repeats: int, number of warm runs of each operation
+    :return: list of dict, results for each operation"""
+
+    # Names of the first directory at each level, which the single-directory operations use
+    dataset_name, sample_name, recon_name, analysis_name = 'Author_dataset0', 'Sample0', 'Recon0', 'Analysis0'
+    dataset = APTDataDirectory.load_dataset_by_name(dataset_name)
+    sample = APTSampleDirectory.load_dataset_by_name(dataset_name, sample_name)
+    recon = APTReconstruction.load_dataset_by_name(dataset_name, sample_name, recon_name)
+    analysis = APTAnalysisDirectory.load_dataset_by_name(dataset_name, sample_name, recon_name, analysis_name)
+
+    # Make the preview shown on the reconstruction page first, so it is not made while timing
+    preview_generator.request(recon.get_pos_file())
+    preview_generator.join()
+
+    client = nucapt.app.test_client()
+    with client.session_transaction() as sess:
+        sess.update({'is_authenticated': True, 'name': 'Benchmark User', 'email': 'benchmark@test.edu'})
+
+    recon_url = '/dataset/%s/sample/%s/recon/%s' % (dataset_name, sample_name, recon_name)
+    operations = [
+        ('manager', 'get_all_datasets', lambda: APTDataDirectory.get_all_datasets(path)),
+        ('manager', 'query_datasets', lambda: APTDataDirectory.query_datasets()),
+        ('manager', 'list_samples', dataset.list_samples),
+        ('manager', 'list_reconstructions', sample.list_reconstructions),
+        ('manager', 'get_analyses', recon.get_analyses),
+        ('manager', 'get_files', analysis.get_files),
+        ('view', '/datasets', get_page(client, '/datasets')),
+        ('view', '/dataset/<dataset_name>', get_page(client, '/dataset/%s' % dataset_name)),
+        ('view', '/dataset/<dataset_name>/sample/<sample_name>',
+         get_page(client, '/dataset/%s/sample/%s' % (dataset_name, sample_name))),
+        ('view', '/dataset/<dataset_name>/sample/<sample_name>/recon/<recon_name>', get_page(client, recon_url)),
+        ('view', '/dataset/<dataset_name>/sample/<sample_name>/recon/<recon_name>/analysis/<analysis_name>',
+         get_page(client, '%s/analysis/%s' % (recon_url, analysis_name))),
+    ]
+
+    results = []
+    for group, name, fn in operations:
+        result = {'group': group, 'name': name}
+        result.update(time_operation(fn, repeats))
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--datasets', type=int, default=100, help='Number of datasets')
+    parser.add_argument('--samples', type=int, default=4, help='Samples per dataset')
+    parser.add_argument('--recons', type=int, default=3, help='Reconstructions per sample')
+    parser.add_argument('--analyses', type=int, default=3, help='Analyses per reconstruction')
+    parser.add_argument('--atoms', type=int, default=10000, help='Atoms in each POS file')
+    parser.add_argument('--repeats', type=int, default=5, help='Number of warm runs of each operation')
+    parser.add_argument('--catalog', action='store_true', help='Also time each operation with the catalog enabled')
+    parser.add_argument('--output', help='Path to write the results. Default is to print them')
+    args = parser.parse_args(argv)
+    for name in ['datasets', 'samples', 'recons', 'analyses']:
+        if getattr(args, name) < 1:
+            parser.error('--%s must be at least 1' % name)
+
+    path = tempfile.mkdtemp()
+    config = dict(nucapt.app.config)
+    old_data_path, old_testing = manager.data_path, nucapt.app.testing
+    try:
+        # Serve the synthetic tree, without requiring a login
+        data_path = os.path.join(path, 'working-data')
+        os.mkdir(data_path)
+        manager.data_path = data_path
+        nucapt.app.config.update(WORKING_PATH=data_path, DEBUG_SKIP_AUTH=True, CATALOG_PATH=None)
+        nucapt.app.testing = True
+
+        start = time.time()
+        files = make_tree(data_path, args.datasets, args.samples, args.recons, args.analyses, args.atoms)
+        print('Built a tree with %d metadata files in %.1f s' % (len(files), time.time() - start), file=sys.stderr)
+
+        output = {
+            'tree': {'datasets': args.datasets, 'samples': args.samples, 'recons': args.recons,
+                     'analyses': args.analyses, 'atoms': args.atoms, 'metadata_files': len(files)},
+            'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                            'scan_workers': nucapt.app.config.get('SCAN_WORKERS'),
+                            'metadata_sidecar': nucapt.app.config.get('METADATA_SIDECAR')},
+            'results': []
+        }
+        modes = [('disk', None)]
+        if args.catalog:
+            modes.append(('catalog', os.path.join(path, 'catalog.db')))
+        for mode, catalog_path in modes:
+            nucapt.app.config['CATALOG_PATH'] = catalog_path
+            if catalog_path is not None:
+                manager.rebuild_catalog()
+            for result in run_benchmarks(data_path, args.repeats):
+                result['mode'] = mode
+                output['results'].append(result)
+                print('%-8s %-88s cold %8.4f s  median %8.4f s' % (mode, result['name'], result['cold'],
+                                                                   result['median']), file=sys.stderr)
+
+        if args.output is None:
+            print(json.dumps(output, indent=2))
+        else:
+            with open(args.output, 'w') as fp:
+                json.dump(output, fp, indent=2)
+    finally:
+        manager.data_path, nucapt.app.testing = old_data_path, old_testing
+        nucapt.app.config.update(config)
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
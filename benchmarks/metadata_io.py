@@ -0,0 +1,75 @@
+"""Compare the speed of reading metadata files with each available parser
+
+Builds a tree of datasets, samples, and reconstructions with realistic metadata, then
+times reading every metadata file with the pure-Python YAML loader, the LibYAML loader,
+and the JSON sidecar files. Run with ``python benchmarks/metadata_io.py``.
+"""
+
+from __future__ import print_function
+
+import argparse
+import shutil
+import tempfile
+import time
+
+import yaml
+
+import nucapt
+from nucapt import metadata
+from nucapt.metadata import MetadataHolder
+
+from synthetic import make_tree
+
+
+def time_reads(files, reader, repeats):
+    """Get the best time to read all files
+
+    :return: float, time in seconds"""
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        for path in files:
+            reader(path)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--datasets', type=int, default=200, help='Number of datasets')
+    parser.add_argument('--samples', type=int, default=3, help='Samples per dataset')
+    parser.add_argument('--recons', type=int, default=2, help='Reconstructions per sample')
+    parser.add_argument('--repeats', type=int, default=3, help='Number of times to read the tree')
+    args = parser.parse_args(argv)
+
+    path = tempfile.mkdtemp()
+    config = dict(nucapt.app.config)
+    try:
+        nucapt.app.config['METADATA_SIDECAR'] = 'json'
+        files = make_tree(path, args.datasets, args.samples, args.recons)
+        print('Reading %d metadata files, best of %d' % (len(files), args.repeats))
+
+        def read_with(loader):
+            def reader(file_path):
+                with open(file_path) as fp:
+                    return yaml.load(fp, Loader=loader)
+            return reader
+
+        results = [('YAML, pure Python', time_reads(files, read_with(yaml.SafeLoader), args.repeats))]
+        if metadata.SafeLoader is not yaml.SafeLoader:
+            results.append(('YAML, LibYAML', time_reads(files, read_with(metadata.SafeLoader), args.repeats)))
+        else:
+            print('PyYAML was built without LibYAML')
+        results.append(('JSON sidecar', time_reads(files, MetadataHolder.from_yaml, args.repeats)))
+
+        baseline = results[0][1]
+        for name, elapsed in results:
+            print('%-20s %8.3f s  %6.1fx' % (name, elapsed, baseline / elapsed))
+    finally:
+        nucapt.app.config.update(config)
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Build synthetic trees of working data for the benchmarks
+
+The tree has the same layout as the working data: datasets holding samples, which hold
+reconstructions, which hold analyses. Each directory has realistic metadata, and each
+reconstruction has a POS file of dummy atoms and a short RRNG file.
+"""
+
+import os
+
+import numpy as np
+
+from nucapt.metadata import MetadataHolder
+from nucapt.pos import pos_dtype
+
+rrng_content = """[Ions]
+Number=2
+Ion1=Al
+Ion2=Sc
+[Ranges]
+Number=2
+Range1=26.9000 27.1000 Vol:0.01661 Al:1 Color:33FFFF
+Range2=44.9000 45.1000 Vol:0.02500 Sc:1 Color:FF00FF
+"""
+
+
+def write_pos_file(path, n_atoms, seed=0):
+    """Write a POS file of atoms at random positions, with m/z values near the ranges of `rrng_content`
+
+    :param path: str, path to the file
+    :param n_atoms: int, number of atoms
+    :param seed: int, seed for the random number generator"""
+
+    rng = np.random.RandomState(seed)
+    atoms = np.zeros((n_atoms,), dtype=pos_dtype)
+    for axis in ('x', 'y', 'z'):
+        atoms[axis] = rng.uniform(-20, 20, n_atoms)
+    atoms['mz'] = rng.choice([13.5, 27.0, 45.0, 60.0], n_atoms) + rng.normal(0, 0.05, n_atoms)
+    atoms.tofile(path)
+
+
+def make_tree(path, n_datasets, samples_per_dataset, recons_per_sample, analyses_per_recon=0,
+              atoms_per_recon=None, files_per_analysis=3):
+    """Create a tree of working data
+
+    :param path: str, path to the top of the tree
+    :param n_datasets: int, number of datasets
+    :param samples_per_dataset: int, number of samples in each dataset
+    :param recons_per_sample: int, number of reconstructions in each sample
+    :param analyses_per_recon: int, number of analyses of each reconstruction
+    :param atoms_per_recon: int, number of atoms in the POS file of each reconstruction.
+        If `None`, no POS or RRNG files are written
+    :param files_per_analysis: int, number of data files in each analysis
+    :return: list of str, paths to the metadata files"""
+
+    files = []
+    for d in range(n_datasets):
+        dataset_path = os.path.join(path, 'Author_dataset%d' % d)
+        os.makedirs(dataset_path)
+        files.append(os.path.join(dataset_path, 'GeneralMetadata.yaml'))
+        MetadataHolder(
+            title='Precipitation in aged Al-Sc alloy, set %d' % d,
+            abstract='Atom probe study of precipitate evolution. ' * 10,
+            authors=[{'first_name': 'First%d' % a, 'last_name': 'Last%d' % a, 'affiliation': 'Northwestern'}
+                     for a in range(3)],
+            dates={'creation_date': '01Jan18'}
+        ).to_yaml(files[-1])
+        for s in range(samples_per_dataset):
+            sample_path = os.path.join(dataset_path, 'Sample%d' % s)
+            os.makedirs(sample_path)
+            for name, content in [
+                ('SampleInformation.yaml', {'sample_title': 'Sample %d' % s, 'sample_abstract': 'Aged 2 hours',
+                                            'metadata': [{'key': 'Aging time', 'value': '%d hours' % s}]}),
+                ('CollectionMethod.yaml', {'leap_model': 'LEAP 4000X Si', 'evaporation_mode': 'laser',
+                                           'laser_pulse_energy': 30.0, 'base_temperature': 30.0,
+                                           'detection_rate': 0.01}),
+                ('SamplePreparation.yaml', {'preparation_method': 'electropolish',
+                                            'electropolish': [{'solution': '10% perchloric acid',
+                                                               'temperature': 20, 'voltage': 15}]})]:
+                files.append(os.path.join(sample_path, name))
+                MetadataHolder(**content).to_yaml(files[-1])
+            for r in range(recons_per_sample):
+                recon_path = os.path.join(sample_path, 'Recon%d' % r)
+                os.makedirs(recon_path)
+                files.append(os.path.join(recon_path, 'ReconstructionMetadata.yaml'))
+                MetadataHolder(title='Reconstruction %d' % r, description='Voltage-based reconstruction',
+                               tip_radius=50.0, evaporation_field=19.0, image_compression=1.65,
+                               metadata=[{'key': 'Software', 'value': 'IVAS 3.6'}]).to_yaml(files[-1])
+                if atoms_per_recon is not None:
+                    write_pos_file(os.path.join(recon_path, 'recon.pos'), atoms_per_recon, seed=r)
+                    with open(os.path.join(recon_path, 'recon.rrng'), 'w') as fp:
+                        fp.write(rrng_content)
+                for a in range(analyses_per_recon):
+                    analysis_path = os.path.join(recon_path, 'Analysis%d' % a)
+                    os.makedirs(analysis_path)
+                    files.append(os.path.join(analysis_path, 'AnalysisMetadata.yaml'))
+                    MetadataHolder(title='Cluster analysis %d' % a,
+                                   description='Maximum separation method, d_max = 0.5 nm').to_yaml(files[-1])
+                    for f in range(files_per_analysis):
+                        with open(os.path.join(analysis_path, 'clusters%d.csv' % f), 'w') as fp:
+                            fp.write('cluster,atoms,radius\n')
+                            fp.writelines('%d,%d,%.2f\n' % (i, 50 + i, 1.5) for i in range(100))
+    return files
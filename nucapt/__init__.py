@@ -19,3 +19,7 @@ app.config.update({
 })
 
 from nucapt import views
+
+# Measure the time spent handling requests
+from nucapt.metrics import install_metrics
+install_metrics(app)
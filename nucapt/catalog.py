@@ -0,0 +1,254 @@
+"""Optional SQLite catalog that mirrors the metadata and files of the working data directory"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+
+import nucapt
+from nucapt.exceptions import DatasetParseException
+from nucapt.index import metadata_index
+from nucapt.metadata import MetadataHolder
+
+_schema = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    errors TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent, kind);
+CREATE TABLE IF NOT EXISTS files (
+    entry TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    modified REAL NOT NULL,
+    PRIMARY KEY (entry, name)
+);
+CREATE TABLE IF NOT EXISTS datasets (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    title TEXT NOT NULL,
+    authors TEXT NOT NULL,
+    creation_date TEXT NOT NULL,
+    created TEXT NOT NULL,
+    published INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS datasets_name ON datasets (parent, name);
+CREATE INDEX IF NOT EXISTS datasets_title ON datasets (parent, title);
+CREATE INDEX IF NOT EXISTS datasets_created ON datasets (parent, created);
+"""
+
+_dataset_columns = ('path', 'name', 'title', 'authors', 'creation_date', 'created', 'published')
+dataset_sort_keys = ('name', 'title', 'created')
+
+
+def summarize_dataset(path, metadata):
+    """Get the fields used to sort and filter datasets
+
+    :param path: str, path to the dataset
+    :param metadata: dict, contents of the metadata files of the dataset
+    :return: dict, summary of the dataset"""
+
+    general = metadata.get('GeneralMetadata.yaml') or {}
+    creation_date = str((general.get('dates') or {}).get('creation_date', ''))
+    try:
+        created = datetime.strptime(creation_date, '%d%b%y').strftime('%Y-%m-%d')
+    except ValueError:
+        created = ''
+    return {
+        'path': path,
+        'name': os.path.basename(path),
+        'title': general.get('title') or '',
+        'authors': '; '.join(' '.join(filter(None, [a.get('first_name'), a.get('last_name')]))
+                             for a in general.get('authors') or []),
+        'creation_date': creation_date,
+        'created': created,
+        'published': 'PublicationData.yaml' in metadata
+    }
+
+
+def _escape_like(text):
+    """Escape a string for use as a substring in an SQL LIKE pattern"""
+    for c in '\\%_':
+        text = text.replace(c, '\\' + c)
+    return '%' + text + '%'
+
+
+class Catalog:
+    """Database holding the metadata and file inventory of each data directory
+
+    Each directory is stored under its absolute path, along with the type of data
+    it holds ("dataset", "sample", "reconstruction", or "analysis"), the contents of each of
+    its metadata files, and the name, size, and modification time of each file it contains.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: str, path to the SQLite database
+        """
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.executescript(_schema)
+
+    def _connect(self):
+        """Open a connection to the database
+
+        :return: Connection, usable as a context manager that commits on exit"""
+        return sqlite3.connect(self.path, timeout=30)
+
+    def record(self, path, kind, metadata_files):
+        """Store the current state of a directory
+
+        :param path: str, path to the directory
+        :param kind: str, type of data held in the directory
+        :param metadata_files: list of str, names of metadata files that describe the directory
+        """
+
+        path = os.path.abspath(path)
+
+        # Read in the metadata
+        metadata = dict()
+        errors = []
+        for name in metadata_files:
+            file_path = os.path.join(path, name)
+            if not os.path.isfile(file_path):
+                continue
+            try:
+                metadata[name] = metadata_index.load(MetadataHolder, file_path).metadata
+            except DatasetParseException as exc:
+                metadata[name] = None
+                errors.extend(exc.errors)
+
+        # Get the file inventory
+        files = []
+        for name in os.listdir(path):
+            file_path = os.path.join(path, name)
+            if os.path.isfile(file_path):
+                stat = os.stat(file_path)
+                files.append((path, name, stat.st_size, stat.st_mtime))
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                         (path, os.path.dirname(path), kind, json.dumps(metadata, default=str),
+                          json.dumps(errors), time.time()))
+            conn.execute('DELETE FROM files WHERE entry = ?', (path,))
+            conn.executemany('INSERT INTO files VALUES (?, ?, ?, ?)', files)
+            if kind == 'dataset' and metadata.get(metadata_files[0]) is None:
+                # Datasets without valid metadata are left out of the listing, as when scanning the disk
+                conn.execute('DELETE FROM datasets WHERE path = ?', (path,))
+            elif kind == 'dataset':
+                summary = summarize_dataset(path, metadata)
+                conn.execute('INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (path, os.path.dirname(path), summary['name'], summary['title'], summary['authors'],
+                              summary['creation_date'], summary['created'], summary['published']))
+
+    def remove(self, path):
+        """Remove a directory, and everything below it, from the catalog
+
+        :param path: str, path to the directory"""
+
+        path = os.path.abspath(path)
+        prefix = os.path.join(path, '')
+        with closing(self._connect()) as conn, conn:
+            for table, column in [('entries', 'path'), ('files', 'entry'), ('datasets', 'path')]:
+                conn.execute('DELETE FROM {0} WHERE {1} = ? OR substr({1}, 1, ?) = ?'.format(table, column),
+                             (path, len(prefix), prefix))
+
+    def list_children(self, path, kind):
+        """List the directories of a certain type directly inside of a directory
+
+        :param path: str, path to the parent directory
+        :param kind: str, type of data
+        :return: list of tuples, sorted by path
+            - str, path to the directory
+            - dict, contents of each metadata file (`None` for files that could not be parsed)
+            - list of str, errors found when reading the metadata"""
+
+        with closing(self._connect()) as conn:
+            rows = conn.execute('SELECT path, metadata, errors FROM entries WHERE parent = ? AND kind = ? '
+                                'ORDER BY path', (os.path.abspath(path), kind)).fetchall()
+        return [(p, json.loads(m), json.loads(e)) for p, m, e in rows]
+
+    def list_files(self, path):
+        """List the files in a directory
+
+        :param path: str, path to the directory
+        :return: list of tuples (name, size in bytes, modification time), sorted by name"""
+
+        with closing(self._connect()) as conn:
+            return conn.execute('SELECT name, size, modified FROM files WHERE entry = ? ORDER BY name',
+                                (os.path.abspath(path),)).fetchall()
+
+    def query_datasets(self, path, sort='name', descending=False, author=None, title=None, published=None,
+                       offset=0, limit=None):
+        """Get summaries of the datasets in a directory
+
+        :param path: str, path to the directory holding the datasets
+        :param sort: str, field to sort by. One of `dataset_sort_keys`
+        :param descending: bool, whether to sort in descending order
+        :param author: str, only include datasets with an author whose name contains this text
+        :param title: str, only include datasets whose title contains this text
+        :param published: bool, only include datasets that are (or are not) published
+        :param offset: int, number of matching datasets to skip
+        :param limit: int, maximum number of datasets to return
+        :return:
+            - list of dict, summaries of the datasets (see `summarize_dataset`)
+            - int, total number of matching datasets"""
+
+        if sort not in dataset_sort_keys:
+            raise ValueError('Cannot sort by: ' + sort)
+
+        # Assemble the filters
+        conditions = ['parent = ?']
+        params = [os.path.abspath(path)]
+        for column, text in [('authors', author), ('title', title)]:
+            if text:
+                conditions.append("%s LIKE ? ESCAPE '\\'" % column)
+                params.append(_escape_like(text))
+        if published is not None:
+            conditions.append('published = ?')
+            params.append(bool(published))
+        where = ' AND '.join(conditions)
+
+        with closing(self._connect()) as conn:
+            total = conn.execute('SELECT COUNT(*) FROM datasets WHERE ' + where, params).fetchone()[0]
+            rows = conn.execute('SELECT %s FROM datasets WHERE %s ORDER BY %s %s, name LIMIT ? OFFSET ?' %
+                                (', '.join(_dataset_columns), where, sort, 'DESC' if descending else 'ASC'),
+                                params + [-1 if limit is None else limit, offset]).fetchall()
+        output = [dict(zip(_dataset_columns, row)) for row in rows]
+        for summary in output:
+            summary['published'] = bool(summary['published'])
+        return output, total
+
+    def clear(self):
+        """Remove all entries from the catalog"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM entries')
+            conn.execute('DELETE FROM files')
+            conn.execute('DELETE FROM datasets')
+
+
+_catalogs = dict()
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog():
+    """Get the catalog for this server
+
+    :return: Catalog, or `None` if the `CATALOG_PATH` setting is not set"""
+
+    path = nucapt.app.config.get('CATALOG_PATH')
+    if not path:
+        return None
+    path = os.path.abspath(path)
+    with _catalogs_lock:
+        if path not in _catalogs:
+            _catalogs[path] = Catalog(path)
+        return _catalogs[path]
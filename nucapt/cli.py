@@ -0,0 +1,142 @@
+"""Command-line tools for administering a NUCAPT server"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+
+from nucapt import manager
+from nucapt.exceptions import DatasetParseException
+from nucapt.export import iter_json_lines, parse_time
+from nucapt.importer import import_samples as run_import
+from nucapt.pos import POSFile
+from nucapt.server import run_server
+from nucapt.uploads import remove_abandoned_uploads as remove_uploads
+
+
+def rebuild_catalog(args):
+    """Re-derive the catalog from the data on disk"""
+    count = manager.rebuild_catalog()
+    print('Recorded %d directories in the catalog' % count)
+
+
+def rebuild_usage(args):
+    """Measure the disk space used by every dataset, sample, reconstruction, and analysis"""
+    total = manager.rebuild_usage()
+    print('Measured %d files using %d bytes' % (total['files'], total['size']))
+
+
+def rebuild_sidecars(args):
+    """Make the sidecar copy of each metadata file that was changed outside of this service"""
+    count = manager.rebuild_sidecars()
+    print('Wrote %d sidecar files' % count)
+
+
+def remove_abandoned_uploads(args):
+    """Delete the chunked uploads that have not received data within UPLOAD_EXPIRY seconds"""
+    count = remove_uploads(max_age=args.max_age)
+    print('Removed %d abandoned uploads' % count)
+
+
+def export(args):
+    """Write the metadata of every dataset, sample, reconstruction, and analysis as JSON Lines"""
+    try:
+        lines = iter_json_lines(args.dataset, args.modified_since)
+    except DatasetParseException as exc:
+        print('\n'.join(exc.errors), file=sys.stderr)
+        return 1
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        for line in lines:
+            output.write(line)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+def import_samples(args):
+    """Create the samples and reconstructions listed in a manifest, placing their data files in a dataset"""
+    try:
+        report = run_import(args.dataset, args.manifest, dry_run=args.dry_run, allow_any_path=args.allow_any_path)
+    except DatasetParseException as exc:
+        print('\n'.join(exc.errors), file=sys.stderr)
+        return 1
+    for entry in report['files']:
+        print('%s -> %s%s' % (entry['source'], entry['destination'],
+                              '' if entry['method'] is None else ' (%s)' % entry['method']))
+    print('%s %d samples and %d reconstructions in %s' % ('Would create' if args.dry_run else 'Created',
+                                                          len(report['samples']), len(report['reconstructions']),
+                                                          report['dataset']))
+
+
+def pos_info(args):
+    """Print the number of atoms, bounding box, and m/z range of a POS file"""
+    summary = POSFile(args.path).summarize()
+    print('Atoms: %d' % summary['atom_count'])
+    if summary['atom_count'] > 0:
+        for field in ['x', 'y', 'z']:
+            print('%s: %.4f to %.4f nm' % ((field,) + summary['bounding_box'][field]))
+        print('m/z: %.4f to %.4f Da' % summary['mz_range'])
+
+
+def serve(args):
+    """Run the production server"""
+    run_server(args.role, bind=args.bind, workers=args.workers, threads=args.threads, timeout=args.timeout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Administer the NUCAPT publication manager')
+    subparsers = parser.add_subparsers(dest='command')
+
+    subparser = subparsers.add_parser('rebuild-catalog', help=rebuild_catalog.__doc__)
+    subparser.set_defaults(func=rebuild_catalog)
+
+    subparser = subparsers.add_parser('rebuild-usage', help=rebuild_usage.__doc__)
+    subparser.set_defaults(func=rebuild_usage)
+
+    subparser = subparsers.add_parser('rebuild-sidecars', help=rebuild_sidecars.__doc__)
+    subparser.set_defaults(func=rebuild_sidecars)
+
+    subparser = subparsers.add_parser('remove-abandoned-uploads', help=remove_abandoned_uploads.__doc__)
+    subparser.add_argument('--max-age', type=float, help='Seconds without data after which an upload is removed')
+    subparser.set_defaults(func=remove_abandoned_uploads)
+
+    subparser = subparsers.add_parser('export', help=export.__doc__)
+    subparser.add_argument('--dataset', help='Only export this dataset')
+    subparser.add_argument('--modified-since', type=parse_time,
+                           help='Only export directories changed after this time (UNIX timestamp or ISO 8601, in UTC)')
+    subparser.add_argument('--output', default='-', help='Path to the output file. Default: standard output')
+    subparser.set_defaults(func=export)
+
+    subparser = subparsers.add_parser('import-samples', help=import_samples.__doc__)
+    subparser.add_argument('dataset', help='Name of the dataset')
+    subparser.add_argument('manifest', help='YAML or CSV file listing the samples, reconstructions, and data files')
+    subparser.add_argument('--dry-run', action='store_true', help='Only check the manifest and list what would be done')
+    subparser.add_argument('--allow-any-path', action='store_true',
+                           help='Import data files from anywhere on the server, not only from STAGING_PATHS')
+    subparser.set_defaults(func=import_samples)
+
+    subparser = subparsers.add_parser('pos-info', help=pos_info.__doc__)
+    subparser.add_argument('path', help='Path to the POS file')
+    subparser.set_defaults(func=pos_info)
+
+    subparser = subparsers.add_parser('serve', help=serve.__doc__,
+                                      description='Run the service with gunicorn. Settings default to the '
+                                                  'SERVER_* (or UPLOAD_SERVER_*) values in nucapt.conf')
+    subparser.add_argument('--role', choices=['web', 'upload'], default='web',
+                           help='Serve web pages, or only long-running uploads')
+    subparser.add_argument('--bind', help='Address to listen on (e.g., 0.0.0.0:5000)')
+    subparser.add_argument('--workers', type=int, help='Number of worker processes')
+    subparser.add_argument('--threads', type=int, help='Number of threads per worker')
+    subparser.add_argument('--timeout', type=int, help='Seconds before a silent worker is restarted')
+    subparser.set_defaults(func=serve)
+
+    args = parser.parse_args(argv)
+    if getattr(args, 'func', None) is None:
+        parser.print_help()
+        return 1
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
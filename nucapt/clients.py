@@ -0,0 +1,144 @@
+"""Long-lived clients for Globus services"""
+
+import threading
+from collections import OrderedDict
+
+import globus_sdk
+import requests
+from flask import current_app, session
+from globus_nexus_client import NexusClient
+from globus_sdk.authorizers.refresh_token import RefreshTokenAuthorizer
+from globus_sdk.transfer.client import TransferClient
+from mdf_toolbox.toolbox import DataPublicationClient
+from requests.adapters import HTTPAdapter
+from six.moves.http_cookiejar import DefaultCookiePolicy
+
+import nucapt
+from nucapt.metrics import record_http_response
+
+# Client class for each service, and the resource server that issues its tokens
+_services = {
+    'transfer': (TransferClient, 'transfer.api.globus.org'),
+    'publish': (DataPublicationClient, 'publish.api.globus.org'),
+    'nexus': (NexusClient, 'nexus.api.globus.org'),
+}
+
+
+class ClientPool:
+    """Holds Globus clients so they can be reused between requests
+
+    The portal's own auth client is created once. Clients that act on behalf of a user are kept,
+    along with their authorizers, in a least-recently-used cache keyed by the user's refresh token.
+    So, access tokens are only refreshed once they expire. All clients send their requests
+    through a single HTTP session, which keeps connections to Globus open between calls.
+
+    The address of each service can be changed with the `GLOBUS_BASE_URLS` setting
+    (e.g., to point to a local stand-in while testing)
+    """
+
+    def __init__(self, max_size=256, pool_size=10):
+        """
+        :param max_size: int, maximum number of user clients to hold
+        :param pool_size: int, maximum number of open connections per host
+        """
+        self.max_size = max_size
+        self._clients = OrderedDict()
+        self._portal_client = None
+        self._lock = threading.Lock()
+
+        # Make the shared HTTP session. Never store cookies, as it is shared between users
+        self.http_session = requests.Session()
+        self.http_session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http_session.mount('https://', adapter)
+        self.http_session.mount('http://', adapter)
+        self.http_session.hooks['response'].append(record_http_response)
+
+    def _make_client(self, cls, service, *args, **kwargs):
+        """Create a client that uses the shared HTTP session
+
+        :param cls: type of client
+        :param service: str, name of service in the `GLOBUS_BASE_URLS` setting
+        :return: client"""
+
+        base_url = current_app.config.get('GLOBUS_BASE_URLS', {}).get(service)
+        if base_url is not None:
+            kwargs['base_url'] = base_url
+        client = cls(*args, **kwargs)
+
+        # globus_sdk 1.x has no public way to give a client a session, but sends all requests through the
+        #  requests.Session it keeps in `_session`. The version is pinned in setup.py, and tests.test_utils
+        #  checks that requests still go through the shared session
+        if isinstance(getattr(client, '_session', None), requests.Session):
+            client._session = self.http_session
+        else:
+            current_app.logger.warning('This version of globus_sdk does not keep its HTTP session in _session. '
+                                       'Connections to Globus will not be reused between requests')
+        return client
+
+    def create_portal_client(self):
+        """Create a new AuthClient for the portal
+
+        Use this instead of `get_portal_client` when the client will hold per-request state,
+        such as an OAuth2 flow
+
+        :return: ConfidentialAppAuthClient"""
+        return self._make_client(globus_sdk.ConfidentialAppAuthClient, 'auth',
+                                 current_app.config['PORTAL_CLIENT_ID'],
+                                 current_app.config['PORTAL_CLIENT_SECRET'])
+
+    def get_portal_client(self):
+        """Get the AuthClient for the portal, which is shared between requests
+
+        :return: ConfidentialAppAuthClient"""
+
+        config = current_app.config
+        key = (config['PORTAL_CLIENT_ID'], config['PORTAL_CLIENT_SECRET'],
+               config.get('GLOBUS_BASE_URLS', {}).get('auth'))
+        with self._lock:
+            if self._portal_client is None or self._portal_client[0] != key:
+                self._portal_client = (key, self.create_portal_client())
+            return self._portal_client[1]
+
+    def get_client(self, service, tokens=None):
+        """Get a client that acts on behalf of a user
+
+        :param service: str, name of the service ('transfer', 'publish', or 'nexus')
+        :param tokens: dict, tokens of the user by resource server. Defaults to those of the logged-in user
+        :return: client for that service"""
+
+        cls, resource_server = _services[service]
+        if tokens is None:
+            tokens = session['tokens']
+        tokens = tokens[resource_server]
+        key = (service, tokens['refresh_token'])
+
+        with self._lock:
+            client = self._clients.pop(key, None)
+            if client is not None:
+                self._clients[key] = client  # Mark as most-recently used
+                return client
+
+        # Start from the access token in the session, to avoid refreshing it needlessly
+        authorizer = RefreshTokenAuthorizer(tokens['refresh_token'], self.get_portal_client(),
+                                            access_token=tokens.get('access_token'),
+                                            expires_at=tokens.get('expires_at_seconds'))
+        client = self._make_client(cls, service, authorizer=authorizer)
+        with self._lock:
+            self._clients[key] = client
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+        return client
+
+    def forget_user(self):
+        """Discard the clients for the logged-in user"""
+        refresh_tokens = set(t.get('refresh_token') for t in session.get('tokens', {}).values())
+        with self._lock:
+            for key in list(self._clients.keys()):
+                if key[1] in refresh_tokens:
+                    del self._clients[key]
+
+
+# Clients shared by all threads in this process
+client_pool = ClientPool(nucapt.app.config.get('GLOBUS_CLIENT_CACHE_SIZE', 256),
+                         nucapt.app.config.get('GLOBUS_HTTP_POOL_SIZE', 10))
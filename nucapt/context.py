@@ -0,0 +1,30 @@
+"""Sharing the data directories loaded while handling a request
+
+Decorators, views, and templates often need the same dataset, sample, or reconstruction.
+Loading them through `load_directory` creates each one only once per request.
+"""
+
+from flask import g, has_request_context
+
+
+def load_directory(cls, *names):
+    """Load a data directory by name, reusing the copy loaded earlier in this request
+
+    Directories that fail to load are not stored, so a directory created later in the request can be loaded.
+
+    :param cls: DataDirectory subclass, type of directory
+    :param names: str, names passed to `cls.load_dataset_by_name` (e.g., dataset name, then sample name)
+    :return: cls, the directory"""
+
+    if not has_request_context():
+        return cls.load_dataset_by_name(*names)
+
+    directories = g.get('data_directories')
+    if directories is None:
+        directories = g.data_directories = dict()
+    key = (cls, names)
+    directory = directories.get(key)
+    if directory is None:
+        directory = directories[key] = cls.load_dataset_by_name(*names)
+    return directory
+
@@ -5,8 +5,10 @@ from flask.globals import current_app
 from flask.helpers import flash
 from flask.templating import render_template
 
+from nucapt.context import load_directory
 from nucapt.exceptions import DatasetParseException
 from nucapt.manager import APTDataDirectory
+from nucapt.publication import get_job
 from nucapt.utils import is_group_member
 
 
@@ -40,7 +42,7 @@ def check_if_published(fn):
         # Handle failures
         dataset_name = kwargs['dataset_name']
         try:
-            data = APTDataDirectory.load_dataset_by_name(dataset_name)
+            data = load_directory(APTDataDirectory, dataset_name)
         except DatasetParseException as exc:
             return redirect("/dataset/%s" % dataset_name)
 
@@ -48,6 +50,11 @@ def check_if_published(fn):
             flash('Dataset has already been published!', 'warning')
             return redirect("/dataset/%s" % dataset_name)
 
+        job = get_job(data)
+        if job is not None and job.is_active():
+            flash('Dataset is being published!', 'warning')
+            return redirect("/dataset/%s/publish/status" % dataset_name)
+
         # Pass it along
         return fn(*args, **kwargs)
     return decorated_function
\ No newline at end of file
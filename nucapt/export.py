@@ -0,0 +1,139 @@
+"""Exporting the metadata of the whole archive as JSON Lines
+
+Each dataset, sample, reconstruction, and analysis is written as one JSON object per line,
+each followed by the directories inside it. Records are produced one at a time while walking
+the data directories, so memory use does not grow with the size of the archive.
+"""
+
+import calendar
+import json
+import os
+from datetime import datetime
+
+from nucapt import manager
+from nucapt.exceptions import DatasetParseException
+from nucapt.index import metadata_index
+from nucapt.inventory import file_inventory
+from nucapt.metadata import MetadataHolder
+from nucapt.usage import load_usage
+
+_name_fields = {
+    'dataset': ('name',),
+    'sample': ('dataset_name', 'sample_name'),
+    'reconstruction': ('dataset_name', 'sample_name', 'recon_name'),
+    'analysis': ('dataset_name', 'sample_name', 'recon_name', 'analysis_dir'),
+}
+"""Attributes holding the names of a directory and of those above it, for each kind of directory"""
+
+_time_formats = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
+
+def parse_time(text):
+    """Read a time given as a UNIX timestamp or an ISO 8601 date and time, in UTC
+
+    :param text: str, time to parse (e.g., "1514764800", "2018-01-01", or "2018-01-01T12:00:00Z")
+    :return: float, UNIX timestamp"""
+
+    text = text.strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    if text.endswith('Z'):
+        text = text[:-1]
+    for time_format in _time_formats:
+        try:
+            parsed = datetime.strptime(text, time_format)
+        except ValueError:
+            continue
+        return calendar.timegm(parsed.timetuple()) + parsed.microsecond / 1e6
+    raise ValueError('Time must be a UNIX timestamp or an ISO 8601 date and time: %s' % text)
+
+
+def format_time(timestamp):
+    """Write a UNIX timestamp as an ISO 8601 date and time, in UTC
+
+    :param timestamp: float, UNIX timestamp
+    :return: str, formatted time"""
+    return datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def describe_directory(directory):
+    """Describe a data directory, its metadata, and the files it holds
+
+    :param directory: DataDirectory, directory to describe
+    :return: dict, with keys
+        - kind: str, type of data in the directory ('dataset', 'sample', 'reconstruction', or 'analysis')
+        - path: str, path to the directory, relative to the working data directory
+        - dataset, sample, reconstruction, analysis: str, names of the directory and those above it
+        - modified: float, last time its metadata or the files it holds changed, including when files
+            or directories inside it were added, renamed, or deleted
+        - metadata: dict, contents of each metadata file present, keyed by file name
+        - errors: list of str, problems reading the metadata
+        - files: list of dict, 'name', 'size', and 'modified' time of each file
+        - usage: dict, size and number of files used by the directory and all inside it. `None` if not measured
+    """
+
+    kind = directory.catalog_kind
+    record = {'kind': kind, 'path': os.path.relpath(directory.path, manager.data_path)}
+    for key, attr in zip(['dataset', 'sample', 'reconstruction', 'analysis'], _name_fields[kind]):
+        record[key] = getattr(directory, attr)
+    modified = os.stat(directory.path).st_mtime  # Changes when its entries do
+
+    # Read the metadata, without holding it in memory for the rest of the request
+    record['metadata'] = dict()
+    record['errors'] = []
+    for name in directory.metadata_files:
+        path = os.path.join(directory.path, name)
+        if not os.path.isfile(path):
+            continue
+        modified = max(modified, os.stat(path).st_mtime)
+        try:
+            record['metadata'][name] = metadata_index.load(MetadataHolder, path, request_scope=False).metadata
+        except DatasetParseException as exc:
+            record['metadata'][name] = None
+            record['errors'].extend(exc.errors)
+
+    # List the files
+    record['files'] = []
+    for name, size, mtime in file_inventory.list_files(directory.path):
+        record['files'].append({'name': name, 'size': size, 'modified': format_time(mtime)})
+        modified = max(modified, mtime)
+
+    usage = load_usage(directory.path, request_scope=False)
+    record['usage'] = usage['total'] if usage is not None else None
+    record['modified'] = modified
+    return record
+
+
+def iter_records(dataset_name=None, modified_since=None):
+    """Describe every data directory in the archive, one at a time
+
+    :param dataset_name: str, only describe this dataset and the directories inside it
+    :param modified_since: float, only describe directories changed after this UNIX timestamp.
+        Directories inside an unchanged one are still described if they have changed
+    :return: iterator of dict, records from `describe_directory`, each followed by those of the directories inside it
+    :raises DatasetParseException: if `dataset_name` is not a dataset"""
+
+    directories = manager.iter_directories(dataset_name)
+
+    def generate():
+        for directory in directories:
+            record = describe_directory(directory)
+            if modified_since is not None and record['modified'] <= modified_since:
+                continue
+            record['modified'] = format_time(record['modified'])
+            yield record
+    return generate()
+
+
+def iter_json_lines(dataset_name=None, modified_since=None):
+    """Write the records of every data directory as JSON Lines
+
+    :param dataset_name: str, only export this dataset
+    :param modified_since: float, only export directories changed after this UNIX timestamp
+    :return: iterator of str, each one JSON object followed by a newline
+    :raises DatasetParseException: if `dataset_name` is not a dataset"""
+
+    records = iter_records(dataset_name, modified_since)
+    return (json.dumps(record, default=str, sort_keys=True) + '\n' for record in records)
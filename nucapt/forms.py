@@ -118,6 +118,8 @@ class APTSampleForm(Form):
     collection_form = FormField(APTCollectionMethodForm, description="Metadata for data collection method")
     preparation_form = FormField(APTSamplePreparationForm, description="Metadata for sample preparation")
     rhit_file = FileField('RHIT file', validators=[Optional()])
+    rhit_path = StringField('RHIT file on server', validators=[Optional()],
+                            description='Path to a RHIT file in the staging area, instead of uploading one')
 
 
 class APTReconstructionForm(Form):
@@ -140,6 +142,10 @@ class APTReconstructionForm(Form):
                          description='Structured metadata about reconstruction. Use to make indexing easier')
     pos_file = FileField('POS File', render_kw={'accept': '.pos,.POS'})
     rrng_file = FileField('RRNG File', render_kw={'accept': '.rrng,.RRNG'})
+    pos_path = StringField('POS File on Server', validators=[Optional()],
+                           description='Path to a POS file in the staging area, instead of uploading one')
+    rrng_path = StringField('RRNG File on Server', validators=[Optional()],
+                            description='Path to a RRNG file in the staging area, instead of uploading one')
 
 
 class AddAPTReconstructionForm(APTReconstructionForm):
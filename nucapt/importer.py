@@ -0,0 +1,388 @@
+"""Creating many samples and reconstructions at once, from data files already on the server
+
+The samples to import are listed in a manifest, either a YAML file::
+
+    samples:
+      - sample_name: Tip1
+        rhit_file: Tip1.RHIT
+        sample_form: {sample_title: Steel, sample_description: As-received}
+        collection_form: {leap_model: 4000X HR, evaporation_mode: laser}
+        preparation_form: {preparation_method: fib_lift_out}
+        reconstructions:
+          - name: Recon1
+            pos_file: Tip1_R1.pos
+            rrng_file: Tip1.rrng
+            title: Default reconstruction
+
+or a CSV file with one row per reconstruction. Its columns are the names of the fields of the sample
+creation form (e.g., ``sample_name``, ``rhit_file``, ``sample_form-sample_title``), and of the reconstruction
+form prefixed with ``recon-`` (e.g., ``recon-name``, ``recon-pos_file``, ``recon-title``). Rows for the same
+sample share its metadata, which is taken from the first of them. Relative paths to data files are relative
+to the manifest.
+
+The metadata is checked with the same forms as the web pages. Every sample is checked before any is made,
+and nothing is left behind if the import fails part of the way through.
+"""
+
+import csv
+import os
+import re
+import shutil
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import six
+import yaml
+from werkzeug.datastructures import MultiDict
+from werkzeug.utils import secure_filename
+
+import nucapt
+from nucapt.exceptions import DatasetParseException
+from nucapt.forms import APTSampleForm, AddAPTReconstructionForm
+from nucapt.manager import APTDataDirectory, APTSampleDirectory, APTReconstruction
+from nucapt.placement import place_file, is_within
+from nucapt.preview import preview_generator
+from nucapt.state import remove_state
+
+_sample_files = {'rhit_file': 'rhit'}
+_recon_files = {'pos_file': 'pos', 'rrng_file': 'rrng'}
+"""Fields holding the data files of samples and reconstructions, and the extension of each file"""
+
+_recon_prefix = 'recon-'
+"""Prefix of the columns holding reconstruction fields, in CSV manifests"""
+
+
+def _flatten(data, prefix=''):
+    """Convert nested metadata into the field names and values a web form would submit
+
+    :param data: dict, list, or value
+    :param prefix: str, name of the field holding `data`, followed by '-'
+    :return: list of tuples, (field name, value as a string)"""
+
+    if isinstance(data, dict):
+        items = data.items()
+    elif isinstance(data, list):
+        items = enumerate(data)
+    elif data is None:
+        return []
+    else:
+        return [(prefix[:-1], six.text_type(data))]
+    output = []
+    for key, value in items:
+        output.extend(_flatten(value, '%s%s-' % (prefix, key)))
+    return output
+
+
+def _make_entry(fields, file_fields, base_path):
+    """Separate the data files from the metadata fields of a sample or reconstruction
+
+    :param fields: list of tuples, name and value of each field
+    :param file_fields: list of str, names of the fields holding paths to data files
+    :param base_path: str, directory that relative paths are relative to
+    :return: dict, 'fields' (OrderedDict of metadata fields) and the path of each data file"""
+
+    entry = {'fields': OrderedDict()}
+    for key, value in fields:
+        if key in file_fields:
+            entry[key] = os.path.abspath(os.path.join(base_path, value)) if value else None
+        elif value != '':
+            entry['fields'][key] = value
+    for key in file_fields:
+        entry.setdefault(key, None)
+    return entry
+
+
+def parse_samples(samples, base_path='.'):
+    """Read the list of samples in a YAML manifest
+
+    :param samples: list of dict, samples to import (see module documentation)
+    :param base_path: str, directory that relative paths are relative to
+    :return: list of dict, 'fields', path to each data file, and 'reconstructions' (each with 'fields' and files)"""
+
+    if not isinstance(samples, list) or not all(isinstance(s, dict) for s in samples):
+        raise DatasetParseException('Manifest must contain a list of samples')
+    output = []
+    for sample in samples:
+        sample = dict(sample)
+        recons = sample.pop('reconstructions', None) or []
+        entry = _make_entry(_flatten(sample), _sample_files, base_path)
+        entry['reconstructions'] = [_make_entry(_flatten(r), _recon_files, base_path) for r in recons]
+        output.append(entry)
+    return output
+
+
+def _parse_csv(fp, base_path):
+    """Read the list of samples in a CSV manifest
+
+    :param fp: file object, CSV file
+    :param base_path: str, directory that relative paths are relative to
+    :return: list of dict, samples (see `parse_samples`)"""
+
+    samples = OrderedDict()
+    for row in csv.DictReader(fp):
+        sample_fields = [(k, v.strip()) for k, v in row.items() if k and not k.startswith(_recon_prefix) and v]
+        recon_fields = [(k[len(_recon_prefix):], v.strip()) for k, v in row.items()
+                        if k and k.startswith(_recon_prefix) and v]
+        name = row.get('sample_name', '')
+        if name not in samples:
+            samples[name] = _make_entry(sample_fields, _sample_files, base_path)
+            samples[name]['reconstructions'] = []
+        if len(recon_fields) > 0:
+            samples[name]['reconstructions'].append(_make_entry(recon_fields, _recon_files, base_path))
+    return list(samples.values())
+
+
+def load_import_manifest(path):
+    """Read the samples to import from a manifest
+
+    :param path: str, path to a YAML (.yaml, .yml) or CSV (.csv) file
+    :return: list of dict, samples (see `parse_samples`)"""
+
+    base_path = os.path.dirname(os.path.abspath(path))
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        if extension == '.csv':
+            with open(path, 'r') as fp:
+                return _parse_csv(fp, base_path)
+        elif extension in ('.yaml', '.yml'):
+            with open(path, 'r') as fp:
+                data = yaml.safe_load(fp)
+            return parse_samples((data or {}).get('samples') if isinstance(data, dict) else None, base_path)
+    except (IOError, OSError, yaml.YAMLError, csv.Error) as exc:
+        raise DatasetParseException('Could not read manifest: %s' % exc)
+    raise DatasetParseException('Manifest must be a YAML or CSV file')
+
+
+def _form_errors(errors, prefix=''):
+    """List the errors of a form, with the name of the field that caused each
+
+    :param errors: dict, errors of the form (``form.errors``)
+    :param prefix: str, text put before each error
+    :return: list of str, errors"""
+
+    output = []
+    for key, value in sorted(errors.items(), key=lambda x: str(x[0])):
+        if isinstance(value, dict):
+            output.extend(_form_errors(value, '%s%s-' % (prefix, key)))
+        elif isinstance(value, list) and len(value) > 0 and isinstance(value[0], dict):
+            for i, entry in enumerate(value):
+                output.extend(_form_errors(entry, '%s%s-%d-' % (prefix, key, i)))
+        else:
+            for message in value:
+                output.append('%s%s: %s' % (prefix, key, message))
+    return output
+
+
+def _check_name(name, kind, errors):
+    """Make sure a name can be used as the name of a directory
+
+    :param name: str, name to check
+    :param kind: str, what is being named
+    :param errors: list of str, where to add any problem"""
+    if not name or not re.match(r'^\w+$', name):
+        errors.append('%s name can only contain word characters: A-Z, a-z, 0-9, and _ (got "%s")' % (kind, name))
+
+
+def _check_files(entry, file_fields, label, errors, allowed_paths):
+    """Make sure the data files of a sample or reconstruction can be imported
+
+    :param entry: dict, sample or reconstruction
+    :param file_fields: dict, extension of the file held in each field
+    :param label: str, name of the sample or reconstruction, put before each error
+    :param errors: list of str, where to add any problems
+    :param allowed_paths: list of str, directories that files must be in. `None` to allow any path"""
+
+    for key, extension in file_fields.items():
+        path = entry[key]
+        if path is None:
+            continue
+        if not path.lower().endswith('.' + extension):
+            errors.append('%s: %s must have the extension ".%s"' % (label, key, extension))
+        elif not os.path.isfile(path):
+            errors.append('%s: No such file: %s' % (label, path))
+        elif allowed_paths is not None and not any(is_within(path, p) for p in allowed_paths):
+            errors.append('%s: Files can only be imported from the staging area: %s' % (label, path))
+
+
+def _place_files(placements, workers):
+    """Place many data files at once, on a pool of threads used only for this import
+
+    Copies of large files can take minutes, so they are kept off of the pool used to scan the data directories
+
+    :param placements: list of tuples, (source, destination) of each file
+    :param workers: int, number of files to place at the same time
+    :return: list of tuples, (method used, exception) for each file. Exactly one of the two is `None`"""
+
+    def place(placement):
+        try:
+            return place_file(*placement), None
+        except Exception as exc:
+            return None, exc
+
+    if workers <= 1 or len(placements) <= 1:
+        return [place(p) for p in placements]
+    pool = ThreadPool(min(workers, len(placements)))
+    try:
+        return pool.map(place, placements)
+    finally:
+        pool.close()
+
+
+class BulkImport:
+    """Creates many samples and reconstructions in a dataset, then places their data files in parallel"""
+
+    def __init__(self, dataset_name, samples, allowed_paths=None):
+        """
+        :param dataset_name: str, name of the dataset receiving the samples
+        :param samples: list of dict, samples to import (see `parse_samples`)
+        :param allowed_paths: list of str, directories that data files must be in. `None` to allow any path
+        """
+        self.dataset_name = dataset_name
+        self.samples = samples
+        self.allowed_paths = allowed_paths
+
+    def _make_forms(self, sample):
+        """Fill in the web forms for a sample and its reconstructions
+
+        :param sample: dict, sample to import
+        :return: APTSampleForm, and a list of AddAPTReconstructionForm"""
+        return APTSampleForm(MultiDict(sample['fields'])), \
+            [AddAPTReconstructionForm(MultiDict(r['fields'])) for r in sample['reconstructions']]
+
+    def validate(self):
+        """Check the whole import before anything is created
+
+        :return: list of str, problems found. Empty if the import can go ahead"""
+
+        try:
+            dataset = APTDataDirectory.load_dataset_by_name(self.dataset_name)
+        except DatasetParseException as exc:
+            return exc.errors
+        if dataset.is_published():
+            return ['Dataset %s has been published and cannot be changed' % self.dataset_name]
+        if len(self.samples) == 0:
+            return ['No samples to import']
+
+        errors = []
+        seen = set()
+        for sample in self.samples:
+            sample_form, recon_forms = self._make_forms(sample)
+            name = sample_form.sample_name.data
+            _check_name(name, 'Sample', errors)
+            if name in seen:
+                errors.append('Sample %s is listed more than once' % name)
+            elif os.path.exists(os.path.join(dataset.path, name or '')):
+                errors.append('Sample %s already exists for dataset %s' % (name, self.dataset_name))
+            seen.add(name)
+            if not sample_form.validate():
+                errors.extend(_form_errors(sample_form.errors, '%s: ' % name))
+            _check_files(sample, _sample_files, name, errors, self.allowed_paths)
+
+            recon_names = set()
+            for recon, form in zip(sample['reconstructions'], recon_forms):
+                label = '%s/%s' % (name, form.data['name'])
+                _check_name(form.data['name'], 'Reconstruction', errors)
+                if form.data['name'] in recon_names:
+                    errors.append('Reconstruction %s is listed more than once' % label)
+                recon_names.add(form.data['name'])
+                if not form.validate():
+                    errors.extend(_form_errors(form.errors, '%s: ' % label))
+                for key in _recon_files:
+                    if recon[key] is None:
+                        errors.append('%s: %s is required' % (label, key))
+                _check_files(recon, _recon_files, label, errors, self.allowed_paths)
+        return errors
+
+    def _plan_files(self, entry, file_fields, path):
+        """List the data files to place in a directory
+
+        :param entry: dict, sample or reconstruction
+        :param file_fields: dict, names of fields holding data files
+        :param path: str, path to the directory
+        :return: list of tuples, (source, destination)"""
+        return [(entry[k], os.path.join(path, secure_filename(os.path.basename(entry[k]))))
+                for k in sorted(file_fields) if entry[k] is not None]
+
+    def run(self, dry_run=False):
+        """Create the samples and reconstructions, and place their data files
+
+        :param dry_run: bool, only check the import and report what would be done
+        :return: dict, with keys
+            - dataset: str, name of the dataset
+            - samples: list of str, names of the samples
+            - reconstructions: list of str, sample and reconstruction names (e.g., "Tip1/Recon1")
+            - files: list of dict, 'source' and 'destination' of each data file, and the 'method' used to place it
+            - dry_run: bool, whether nothing was changed
+        :raises DatasetParseException: if the import is not valid, or fails"""
+
+        errors = self.validate()
+        if len(errors) > 0:
+            raise DatasetParseException(errors)
+
+        dataset = APTDataDirectory.load_dataset_by_name(self.dataset_name)
+        report = {'dataset': self.dataset_name, 'samples': [], 'reconstructions': [], 'files': [],
+                  'dry_run': dry_run}
+        directories = []  # Directories that receive files
+        placements = []
+        created = []
+        try:
+            for sample in self.samples:
+                sample_form, recon_forms = self._make_forms(sample)
+                sample_name = sample_form.sample_name.data
+                sample_path = os.path.join(dataset.path, sample_name)
+                if not dry_run:
+                    APTSampleDirectory.create_sample(self.dataset_name, sample_form)
+                    created.append(APTSampleDirectory.load_dataset_by_name(self.dataset_name, sample_name))
+                    directories.append(created[-1])
+                report['samples'].append(sample_name)
+                placements.extend(self._plan_files(sample, _sample_files, sample_path))
+
+                for recon, form in zip(sample['reconstructions'], recon_forms):
+                    recon_name = form.data['name']
+                    if not dry_run:
+                        APTReconstruction.create_reconstruction(form, self.dataset_name, sample_name, None)
+                        directories.append(APTReconstruction.load_dataset_by_name(self.dataset_name, sample_name,
+                                                                                  recon_name))
+                    report['reconstructions'].append('%s/%s' % (sample_name, recon_name))
+                    placements.extend(self._plan_files(recon, _recon_files, os.path.join(sample_path, recon_name)))
+
+            # Place all of the files at once
+            if dry_run:
+                methods = [None] * len(placements)
+            else:
+                results = _place_files(placements, nucapt.app.config.get('IMPORT_WORKERS', 4))
+                failures = [exc for _, exc in results if exc is not None]
+                if len(failures) > 0:
+                    raise DatasetParseException([e for exc in failures for e in getattr(exc, 'errors', [str(exc)])])
+                methods = [method for method, _ in results]
+        except Exception:
+            # Remove everything made by this import
+            for sample in created:
+                shutil.rmtree(sample.path, ignore_errors=True)
+                sample.record_changes()
+                remove_state(sample.path)
+            raise
+
+        for (source, destination), method in zip(placements, methods):
+            report['files'].append({'source': source, 'destination': os.path.relpath(destination, dataset.path),
+                                    'method': method})
+        if not dry_run:
+            for directory in directories:
+                directory.record_changes()
+            for source, destination in placements:
+                if destination.lower().endswith('.pos'):
+                    preview_generator.request(destination)
+        return report
+
+
+def import_samples(dataset_name, manifest_path, dry_run=False, allow_any_path=False):
+    """Import the samples listed in a manifest into a dataset
+
+    :param dataset_name: str, name of the dataset
+    :param manifest_path: str, path to the manifest (see module documentation)
+    :param dry_run: bool, only check the import and report what would be done
+    :param allow_any_path: bool, whether to import data files from anywhere on the server,
+        rather than only from the directories in the `STAGING_PATHS` setting
+    :return: dict, report of the import (see `BulkImport.run`)"""
+    allowed_paths = None if allow_any_path else nucapt.app.config.get('STAGING_PATHS') or []
+    return BulkImport(dataset_name, load_import_manifest(manifest_path), allowed_paths=allowed_paths).run(dry_run)
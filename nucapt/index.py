@@ -0,0 +1,130 @@
+"""In-process index of parsed metadata files"""
+
+import copy
+import os
+import threading
+from collections import OrderedDict
+
+from flask import g, has_request_context
+
+import nucapt
+
+
+class MetadataIndex:
+    """Least-recently-used cache of parsed metadata files
+
+    Entries are keyed by the absolute path of the metadata file, and are only served
+    while the modification time and size of that file match those recorded when it was parsed.
+    While handling a web request, each file is only checked once: later reads in the same
+    request are served from memory, unless the file is rewritten during that request.
+    """
+
+    def __init__(self, max_size=4096):
+        """
+        :param max_size: int, maximum number of metadata files to hold in memory
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_stamp(path):
+        """Get the values used to detect whether a file has changed
+
+        :param path: str, path to file
+        :return: tuple, (modification time, size). `None` if the file does not exist"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def _get_request_entries(self):
+        """Get the files already read while handling the current request
+
+        :return: dict, metadata of each file, keyed by path. `None` if not handling a request"""
+        if not has_request_context():
+            return None
+        entries = g.get('metadata_index_entries')
+        if entries is None:
+            entries = g.metadata_index_entries = dict()
+        return entries.setdefault(id(self), dict())
+
+    def load(self, cls, path, request_scope=True):
+        """Load a metadata file, parsing it only if it has changed since last read
+
+        :param cls: MetadataHolder subclass used to parse the file
+        :param path: str, path to metadata file
+        :param request_scope: bool, whether to keep the file in memory for the rest of the current request.
+            Set to False when reading many files in one request, so that memory use does not grow with each file
+        :return: cls, metadata. Changes to this object do not affect the index"""
+
+        path = os.path.abspath(path)
+        request_entries = self._get_request_entries() if request_scope else None
+        if request_entries is not None:
+            data = request_entries.get(path)
+            if data is not None:
+                with self._lock:
+                    self.hits += 1
+                return cls(**copy.deepcopy(data))
+
+        metadata = self._load(cls, path)
+        if request_entries is not None:
+            request_entries[path] = copy.deepcopy(metadata.metadata)
+        return metadata
+
+    def _load(self, cls, path):
+        """Load a metadata file, checking whether the file has changed
+
+        :param cls: MetadataHolder subclass used to parse the file
+        :param path: str, absolute path to metadata file
+        :return: cls, metadata"""
+
+        stamp = self._get_stamp(path)
+        if stamp is None:
+            self.invalidate(path)
+            return cls.from_yaml(path)  # Raises the usual "file not found" error
+
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None and entry[0] == stamp:
+                self._entries[path] = entry  # Mark as most-recently used
+                self.hits += 1
+                return cls(**copy.deepcopy(entry[1]))
+
+        # Parse outside of the lock, so slow reads do not block other threads
+        metadata = cls.from_yaml(path)
+        with self._lock:
+            self.misses += 1
+            self._entries[path] = (stamp, copy.deepcopy(metadata.metadata))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return metadata
+
+    def invalidate(self, path):
+        """Remove a file from the index
+
+        :param path: str, path to metadata file"""
+        path = os.path.abspath(path)
+        with self._lock:
+            self._entries.pop(path, None)
+        request_entries = self._get_request_entries()
+        if request_entries is not None:
+            request_entries.pop(path, None)
+
+    def clear(self):
+        """Remove all entries from the index"""
+        with self._lock:
+            self._entries.clear()
+        request_entries = self._get_request_entries()
+        if request_entries is not None:
+            request_entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Index shared by all threads in this process
+metadata_index = MetadataIndex(nucapt.app.config.get('METADATA_CACHE_SIZE', 4096))
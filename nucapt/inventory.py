@@ -0,0 +1,98 @@
+"""In-process cache of the files held in each data directory"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import nucapt
+from nucapt.scanner import scandir
+
+sort_keys = {
+    'name': lambda f: f[0].lower(),
+    'size': lambda f: f[1],
+    'modified': lambda f: f[2],
+}
+"""Functions giving the sort key of a (name, size, modification time) file entry, by the name of the field"""
+
+
+class FileInventory:
+    """Least-recently-used cache of the files in directories
+
+    Each directory is listed with a single pass of ``scandir``, and the listing is reused while the
+    modification time of the directory is unchanged. Creating, deleting, or renaming a file changes
+    that time, but rewriting a file in place does not: call `invalidate` after overwriting a file.
+    """
+
+    racy_period = 2.0
+    """Directories modified less than this many seconds ago are listed again on every request,
+    as changes within the resolution of their modification time could go unnoticed"""
+
+    def __init__(self, max_size=256):
+        """
+        :param max_size: int, maximum number of directories to hold in memory
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _scan(path):
+        """List the files in a directory, skipping hidden files and subdirectories
+
+        :param path: str, path to the directory
+        :return: list of tuples, (name, size in bytes, modification time) of each file, sorted by name"""
+        files = []
+        for entry in scandir(path):
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            stat = entry.stat()
+            files.append((entry.name, stat.st_size, stat.st_mtime))
+        files.sort()
+        return files
+
+    def list_files(self, path):
+        """Get the files in a directory, listing it only if it has changed since last read
+
+        :param path: str, path to the directory
+        :return: list of tuples, (name, size in bytes, modification time) of each file, sorted by name.
+            Do not modify this list"""
+
+        path = os.path.abspath(path)
+        stamp = os.stat(path).st_mtime
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None and entry[0] == stamp:
+                self._entries[path] = entry  # Mark as most-recently used
+                self.hits += 1
+                return entry[1]
+
+        files = self._scan(path)
+        with self._lock:
+            self.misses += 1
+            if time.time() - stamp > self.racy_period:
+                self._entries[path] = (stamp, files)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return files
+
+    def invalidate(self, path):
+        """Remove a directory from the cache
+
+        :param path: str, path to the directory"""
+        with self._lock:
+            self._entries.pop(os.path.abspath(path), None)
+
+    def clear(self):
+        """Remove all directories from the cache"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Inventory shared by all threads in this process
+file_inventory = FileInventory(nucapt.app.config.get('FILE_INVENTORY_SIZE', 256))
@@ -0,0 +1,124 @@
+"""Crash-safe file writes, and locks that coordinate changes between threads and server processes"""
+
+import os
+import threading
+import uuid
+import weakref
+from contextlib import contextmanager
+
+from nucapt.state import get_state_path
+
+try:
+    import fcntl
+except ImportError:  # Windows, where the server runs as a single process
+    fcntl = None
+
+lock_name = '.lock'
+"""Name of the lock file of each locked directory, kept with its other records (see `nucapt.state`)"""
+
+_process_locks = weakref.WeakValueDictionary()
+"""Lock in memory for each lock file. Kept only while a thread holds or waits for it"""
+_process_locks_lock = threading.Lock()
+_held = threading.local()
+
+
+def _replace(source, destination):
+    """Rename a file, replacing any file at the destination"""
+    if hasattr(os, 'replace'):
+        os.replace(source, destination)
+    else:
+        if os.name == 'nt' and os.path.exists(destination):
+            os.unlink(destination)  # Python 2 on Windows cannot rename over a file
+        os.rename(source, destination)
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """Open a file such that readers see either its old or its new contents, never a partial write
+
+    Data is written to a temporary file in the same directory, which is flushed to disk and then
+    renamed to the destination once the ``with`` block completes. If the block raises an exception,
+    the destination is left untouched.
+
+    :param path: str, path to the file
+    :param mode: str, 'w' for text or 'wb' for binary
+    :return: file object to write to"""
+
+    directory = os.path.dirname(os.path.abspath(path))
+    temp_path = os.path.join(directory, '.tmp-%s' % uuid.uuid4().hex)  # Not named like the destination
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        with os.fdopen(fd, mode) as fp:
+            yield fp
+            fp.flush()
+            os.fsync(fp.fileno())
+        _replace(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+    # Make sure the rename itself survives a crash
+    if os.name == 'posix':
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass  # Not supported by all file systems
+        finally:
+            os.close(dir_fd)
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on a lock file
+
+    The lock is held with an advisory lock (``flock``) on the file, which excludes other processes, including
+    those on other hosts of a shared file system that supports locking, and with a lock in memory, which excludes
+    other threads. A thread that already holds the lock may take it again.
+
+    :param path: str, path to the lock file, which is made if it does not exist"""
+
+    path = os.path.abspath(path)
+    held = getattr(_held, 'paths', None)
+    if held is None:
+        held = _held.paths = dict()
+
+    # Re-entering the lock
+    if path in held:
+        held[path] += 1
+        try:
+            yield
+        finally:
+            held[path] -= 1
+        return
+
+    with _process_locks_lock:
+        thread_lock = _process_locks.get(path)
+        if thread_lock is None:
+            thread_lock = _process_locks[path] = threading.Lock()
+    with thread_lock:
+        fp = open(path, 'a')
+        try:
+            if fcntl is not None:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+            held[path] = 1
+            try:
+                yield
+            finally:
+                del held[path]
+        finally:
+            fp.close()  # Also releases the flock
+
+
+@contextmanager
+def directory_lock(path):
+    """Hold the exclusive lock for a directory
+
+    Use around read-modify-write changes to the files in a directory. The lock is held on a file kept with
+    the records about the directory (see `file_lock`).
+
+    :param path: str, path to the directory"""
+
+    with file_lock(get_state_path(path, lock_name)):
+        yield
@@ -1,18 +1,29 @@
 """Operations relating to managing data folders on NUCAPT servers"""
 
+import errno
 import os
 import re
 from abc import abstractmethod, ABCMeta
 from datetime import date
-from glob import glob
 
 import six
-import yaml
 
 import nucapt
+from nucapt.catalog import get_catalog, summarize_dataset, dataset_sort_keys
 from nucapt.exceptions import DatasetParseException
+from nucapt.index import metadata_index
+from nucapt.inventory import file_inventory, sort_keys as inventory_sort_keys
+from nucapt.locking import directory_lock
+from nucapt.manifest import load_manifest, update_manifest
 from nucapt.metadata import APTDataCollectionMetadata, GeneralMetadata, APTSampleGeneralMetadata, \
-    APTReconstructionMetadata, APTSamplePreparationMetadata, APTAnalysisMetadata
+    APTReconstructionMetadata, APTSamplePreparationMetadata, APTAnalysisMetadata, MetadataHolder, update_sidecar
+from nucapt.metrics import timed
+from nucapt.pos import POSFile
+from nucapt.preview import load_preview, preview_generator
+from nucapt.rrng import RangeFile
+from nucapt.scanner import list_subdirectories, prefetch_metadata, scan_tree
+from nucapt.state import get_state_path
+from nucapt.usage import load_usage, update_usage, compute_usage
 import time
 
 # Key variables
@@ -24,6 +35,16 @@ data_path = nucapt.app.config['WORKING_PATH']
 @six.add_metaclass(ABCMeta)
 class DataDirectory:
     """Class to represent a set of data stored on this server"""
+
+    catalog_kind = None
+    """Name for this type of data in the catalog"""
+
+    metadata_files = ()
+    """Names of the metadata files describing this directory. The first is always present"""
+
+    upload_extensions = ()
+    """Extensions of data files that can be uploaded to this directory. Only one of each is allowed"""
+
     def __init__(self, name, path):
         if not os.path.isdir(path):
             raise DatasetParseException('No such path: ' + path)
@@ -42,12 +63,14 @@ class DataDirectory:
     def _find_file(self, file_type, allow_none=False):
         """File a file with a certain extension in this directory
 
+        Hidden files (e.g., partial uploads and temporary copies) are ignored
+
         :param file_type: str, extension of target file
         :param allow_none: bool, whether to return None if no file found
             rather than raising an exception
         :return: Path to target file"""
-        r = re.compile(r'\.%s' % file_type, re.IGNORECASE)
-        file = [f for f in os.listdir(self.path) if r.search(f)]
+        r = re.compile(r'\.%s$' % file_type, re.IGNORECASE)
+        file = [f for f in os.listdir(self.path) if not f.startswith('.') and r.search(f)]
         if len(file) == 0:
             if allow_none:
                 return None
@@ -57,10 +80,73 @@ class DataDirectory:
             raise DatasetParseException('More than 1 %s file! Should be exactly one' % file_type)
         return os.path.join(self.path, file[0])
 
+    def lock(self):
+        """Get the lock for changes to this directory
+
+        Hold it around any change that reads and then rewrites a file in this directory
+
+        :return: context manager holding the lock (see `nucapt.locking.directory_lock`)"""
+        return directory_lock(self.path)
+
+    def record_changes(self):
+        """Record a change to the files in this directory
+
+        Refreshes the cached list of its files, the record of its disk usage (and those of the
+        directories above it), and its entry in the catalog, if enabled. Removes the directory from the
+        catalog if it no longer exists. Call after any change to the files in this directory"""
+
+        file_inventory.invalidate(self.path)
+        self.update_usage()
+        catalog = get_catalog()
+        if catalog is None:
+            return
+        if os.path.isdir(self.path):
+            catalog.record(self.path, self.catalog_kind, self.metadata_files)
+        else:
+            catalog.remove(self.path)
+
+    def update_usage(self):
+        """Measure the disk space used by this directory again, and update the totals of the directories above it"""
+        update_usage(self.path, [c.metadata_files[0] for c in hierarchy], hierarchy.index(type(self)))
+
+    def get_usage(self):
+        """Get the disk space used by this directory
+
+        :return: dict, with keys
+            - own: dict, 'size' (bytes) and number of 'files' held by this directory itself
+            - children: dict, total usage of each data directory inside it, keyed by name
+            - total: dict, size and number of files of this directory and all directories inside it
+            - updated: float, time the record was last changed
+            `None` if the usage has not been recorded (see `rebuild_usage`)"""
+        return load_usage(self.path)
+
+    @classmethod
+    def _list_paths(cls, path, use_catalog=True, prefetch=True):
+        """List the directories holding this type of data inside of a certain directory
+
+        :param path: str, path to the parent directory
+        :param use_catalog: bool, whether to read from the catalog (if enabled) rather than scanning the disk
+        :param prefetch: bool, whether to read the metadata of each directory found on disk into the
+            metadata index, using the scanning thread pool
+        :return: list of str, paths to the directories"""
+
+        catalog = get_catalog() if use_catalog else None
+        if catalog is not None:
+            with timed('nucapt_scan_seconds', kind=cls.catalog_kind, source='catalog'):
+                return [p for p, _, _ in catalog.list_children(path, cls.catalog_kind)]
+        with timed('nucapt_scan_seconds', kind=cls.catalog_kind, source='disk'):
+            paths = list_subdirectories(path, cls.metadata_files[0])
+            if prefetch:
+                prefetch_metadata(paths, cls.metadata_files)
+            return paths
+
 
 class APTDataDirectory(DataDirectory):
     """Class that represents a NUCAPT dataset"""
 
+    catalog_kind = 'dataset'
+    metadata_files = ('GeneralMetadata.yaml', 'PublicationData.yaml')
+
     def __init__(self, name, path):
         """Please use `load_dataset` instead
 
@@ -103,14 +189,17 @@ class APTDataDirectory(DataDirectory):
         index = 0
         while True:
             my_name = '%s_%s_%d' % (date.today().strftime("%d%b%y"), first_author, index)
-            if not os.path.exists(os.path.join(data_path, my_name)):
+            my_path = os.path.abspath(os.path.join(data_path, my_name))
+
+            # Make a new directory for this dataset. Fails if another process took the name first
+            try:
+                os.makedirs(my_path)
                 break
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
             index += 1
 
-        # Make a new directory for this dataset
-        my_path = os.path.abspath(os.path.join(data_path, my_name))
-        os.makedirs(my_path)
-
         # Initialize this dataset
         dataset = cls(my_name, my_path)
 
@@ -120,6 +209,7 @@ class APTDataDirectory(DataDirectory):
         # Write to disk
         metadata_path = dataset._get_metadata_path()
         metadata.to_yaml(metadata_path)
+        dataset.record_changes()
 
         return dataset
 
@@ -133,18 +223,82 @@ class APTDataDirectory(DataDirectory):
             value: `APTDataDirectory` if metadata file is valid, `DatasetParseException` otherwise"""
 
         output = dict()
-        for sub_path in glob(os.path.join(path, "*", "GeneralMetadata.yaml")):
-            sub_path = os.path.dirname(sub_path)
-
-            # Get "name" of directory
+        for sub_path in cls._list_paths(path):
+            # Get "name" of directory, and make sure the metadata is readable
             try:
                 output[sub_path] = cls.load_dataset_by_path(sub_path)
+                output[sub_path].get_metadata()
             except DatasetParseException as err:
                 output[sub_path] = err
             except:
                 continue
         return output
 
+    @classmethod
+    def get_all_usage(cls, path=None):
+        """Get the disk space used by each dataset, from the stored records
+
+        :param path: str, path to investigate. Defaults to the working data path
+        :return: dict, usage record of each dataset (see `get_usage`) keyed by name. `None` if not yet measured"""
+
+        if path is None:
+            path = data_path
+        return dict((os.path.basename(p), load_usage(p)) for p in cls._list_paths(path, prefetch=False))
+
+    @classmethod
+    def query_datasets(cls, sort='name', descending=False, author=None, title=None, published=None,
+                       page=1, per_page=25, path=None):
+        """Get a page of summaries of the datasets with valid metadata
+
+        Uses the catalog if it is enabled, which only reads the requested page.
+        Otherwise, all datasets are summarized using the metadata index.
+
+        :param sort: str, field to sort by: 'name', 'title', or 'created'
+        :param descending: bool, whether to sort in descending order
+        :param author: str, only include datasets with an author whose name contains this text
+        :param title: str, only include datasets whose title contains this text
+        :param published: bool, only include datasets that are (or are not) published. `None` to include all
+        :param page: int, page number, starting from 1
+        :param per_page: int, number of datasets per page
+        :param path: str, path to investigate. Defaults to the working data path
+        :return:
+            - list of dict, summaries of the datasets on this page.
+                Keys: path, name, title, authors, creation_date, created (ISO format), published
+            - int, total number of matching datasets"""
+
+        if path is None:
+            path = data_path
+        offset = (page - 1) * per_page
+
+        catalog = get_catalog()
+        if catalog is not None:
+            return catalog.query_datasets(path, sort=sort, descending=descending, author=author, title=title,
+                                          published=published, offset=offset, limit=per_page)
+
+        if sort not in dataset_sort_keys:
+            raise ValueError('Cannot sort by: ' + sort)
+
+        # Summarize every valid dataset
+        summaries = []
+        for dataset in cls.get_all_datasets(path).values():
+            if not isinstance(dataset, APTDataDirectory):
+                continue
+            metadata = {'GeneralMetadata.yaml': dataset.get_metadata().metadata}
+            if dataset.is_published():
+                metadata['PublicationData.yaml'] = None
+            summaries.append(summarize_dataset(dataset.path, metadata))
+
+        # Filter and sort them
+        if author:
+            summaries = [s for s in summaries if author.lower() in s['authors'].lower()]
+        if title:
+            summaries = [s for s in summaries if title.lower() in s['title'].lower()]
+        if published is not None:
+            summaries = [s for s in summaries if s['published'] == bool(published)]
+        summaries.sort(key=lambda x: x['name'])
+        summaries.sort(key=lambda x: x[sort], reverse=descending)
+        return summaries[offset:offset + per_page], len(summaries)
+
     def _get_metadata_path(self):
         """Get the path to the generaml metadata about this dataset
 
@@ -159,17 +313,19 @@ class APTDataDirectory(DataDirectory):
         :return: GeneralMetadata, metadata for this dataset
         """
 
-        return GeneralMetadata.from_yaml(self._get_metadata_path())
+        return metadata_index.load(GeneralMetadata, self._get_metadata_path())
 
     def update_metadata(self, form):
         """Update the metadata for this dataset
 
         :param form: CreateForm, Form to generate"""
 
-        current_metadata = self.get_metadata()
-        new_metadata = GeneralMetadata.from_form(form)
-        current_metadata.metadata.update(new_metadata.metadata)
-        current_metadata.to_yaml(self._get_metadata_path())
+        with self.lock():
+            current_metadata = self.get_metadata()
+            new_metadata = GeneralMetadata.from_form(form)
+            current_metadata.metadata.update(new_metadata.metadata)
+            current_metadata.to_yaml(self._get_metadata_path())
+        self.record_changes()
 
     def list_samples(self):
         """Get the list of samples for this dataset
@@ -181,13 +337,88 @@ class APTDataDirectory(DataDirectory):
         # Find all subdirectories that contain "SampleInformation.yaml"
         output = []
         errors = []
-        for file in glob("%s/*/SampleInformation.yaml" % self.path):
+        for path in APTSampleDirectory._list_paths(self.path):
             try:
-                output.append(APTSampleDirectory.load_dataset_by_path(os.path.dirname(file)))
+                output.append(APTSampleDirectory.load_dataset_by_path(path))
             except DatasetParseException as exc:
                 errors.extend(exc.errors)
         return output, errors
 
+    def count_samples(self):
+        """Count the samples in this dataset, without reading their metadata
+
+        :return: int, number of samples"""
+        return len(APTSampleDirectory._list_paths(self.path, prefetch=False))
+
+    def _get_recent_path(self):
+        """Get the path to the file recording the most recently changed sample and reconstruction"""
+        return get_state_path(self.path, '.Recent.yaml')
+
+    def _load_recent(self):
+        """Read the record of the most recently changed sample and reconstruction
+
+        :return: dict, with keys 'sample' (sample name) and 'reconstruction' ([sample name, recon name]),
+            if recorded"""
+        try:
+            return metadata_index.load(MetadataHolder, self._get_recent_path()).metadata
+        except DatasetParseException:
+            return dict()
+
+    def set_recent(self, sample_name, recon_name=None):
+        """Record that a sample, or a reconstruction of it, was just created or changed
+
+        Forms for new samples and reconstructions in this dataset are pre-filled from the most recent ones
+
+        :param sample_name: str, name of the sample
+        :param recon_name: str, name of the reconstruction. If `None`, only the sample is recorded"""
+
+        with self.lock():
+            recent = self._load_recent()
+            if recon_name is None:
+                recent['sample'] = sample_name
+            else:
+                recent['reconstruction'] = [sample_name, recon_name]
+            MetadataHolder(**recent).to_yaml(self._get_recent_path())
+
+    def get_recent_sample(self):
+        """Get the sample that was most recently created or changed
+
+        If none has been recorded, or it no longer exists, uses the last sample by name
+
+        :return: APTSampleDirectory, or `None` if this dataset has no samples"""
+
+        sample_name = self._load_recent().get('sample')
+        if sample_name is not None:
+            path = os.path.join(self.path, sample_name)
+            if os.path.isfile(os.path.join(path, APTSampleDirectory.metadata_files[0])):
+                return APTSampleDirectory.load_dataset_by_path(path)
+
+        paths = APTSampleDirectory._list_paths(self.path, prefetch=False)
+        if len(paths) == 0:
+            return None
+        return APTSampleDirectory.load_dataset_by_path(max(paths, key=os.path.basename))
+
+    def get_recent_reconstruction(self):
+        """Get the reconstruction that was most recently created in this dataset
+
+        If none has been recorded, or it no longer exists, uses the last reconstruction by name
+        of the last sample by name that has any
+
+        :return: APTReconstruction, or `None` if this dataset has no reconstructions"""
+
+        recon = self._load_recent().get('reconstruction')
+        if recon is not None:
+            path = os.path.join(self.path, *recon)
+            if os.path.isfile(os.path.join(path, APTReconstruction.metadata_files[0])):
+                return APTReconstruction.load_dataset_by_path(path)
+
+        for sample_path in sorted(APTSampleDirectory._list_paths(self.path, prefetch=False),
+                                  key=os.path.basename, reverse=True):
+            paths = APTReconstruction._list_paths(sample_path, prefetch=False)
+            if len(paths) > 0:
+                return APTReconstruction.load_dataset_by_path(max(paths, key=os.path.basename))
+        return None
+
     def mark_as_published(self, publication_id):
         """Mark this dataset as in the process of submission
 
@@ -195,16 +426,43 @@ class APTDataDirectory(DataDirectory):
 
         data = {'publication_id': publication_id,
                 'submission_date': date.today().strftime("%d%b%y")}
-        yaml.dump(data, open(os.path.join(self.path, 'PublicationData.yaml'), 'w'))
+        with self.lock():
+            MetadataHolder(**data).to_yaml(os.path.join(self.path, 'PublicationData.yaml'))
+        self.record_changes()
 
     def is_published(self):
         """:return: bool, whether this dataset has been published"""
         return os.path.isfile(os.path.join(self.path, 'PublicationData.yaml'))
 
+    def update_manifest(self, directory=None):
+        """Record the size, modification time, and SHA-256 hash of each file in this dataset
+
+        Only files that changed since the last update are hashed
+
+        :param directory: DataDirectory, only check the files in this directory of the dataset
+        :return: dict, details of each file, keyed by path relative to the dataset"""
+
+        subpath = None if directory is None else os.path.relpath(directory.path, self.path)
+        with self.lock():
+            manifest = update_manifest(self.path, nucapt.app.config.get('MANIFEST_WORKERS', 4), subpath)
+            self.update_usage()
+            return manifest
+
+    def get_manifest(self):
+        """Get the last-recorded hashes of the files in this dataset
+
+        :return: dict, details of each file, keyed by path relative to the dataset"""
+
+        return load_manifest(self.path)
+
 
 class APTSampleDirectory(DataDirectory):
     """Holds data associated with a certain sample"""
 
+    catalog_kind = 'sample'
+    metadata_files = ('SampleInformation.yaml', 'CollectionMethod.yaml', 'SamplePreparation.yaml')
+    upload_extensions = ('rhit',)
+
     def __init__(self, dataset_name, sample_name, path):
         """Do not use. Use `load_dataset_by_path` or `load_dataset_by_name`"""
         super(APTSampleDirectory, self).__init__('%s_%s'%(dataset_name, sample_name), path)
@@ -262,6 +520,8 @@ class APTSampleDirectory(DataDirectory):
         general.to_yaml(sample._get_sample_information_path())
         collection.to_yaml(sample._get_collection_metadata_path())
         preparation.to_yaml(sample._get_preparation_metadata_path())
+        sample.record_changes()
+        APTDataDirectory.load_dataset_by_path(os.path.dirname(path)).set_recent(sample_name)
 
         return sample_name
 
@@ -276,6 +536,8 @@ class APTSampleDirectory(DataDirectory):
 
         metadata = cls.from_form(form)
         metadata.to_yaml(path)
+        self.record_changes()
+        APTDataDirectory.load_dataset_by_path(os.path.dirname(self.path)).set_recent(self.sample_name)
         return path
 
     def _get_sample_information_path(self):
@@ -301,7 +563,7 @@ class APTSampleDirectory(DataDirectory):
         :return: APTDataCollectionMetadata if present, else None"""
 
         if os.path.isfile(self._get_sample_information_path()):
-            return APTSampleGeneralMetadata.from_yaml(self._get_sample_information_path())
+            return metadata_index.load(APTSampleGeneralMetadata, self._get_sample_information_path())
         return None
 
     def _get_collection_metadata_path(self):
@@ -327,7 +589,7 @@ class APTSampleDirectory(DataDirectory):
         :return: APTDataCollectionMetadata if present, else None"""
 
         if os.path.isfile(self._get_collection_metadata_path()):
-            return APTDataCollectionMetadata.from_yaml(self._get_collection_metadata_path())
+            return metadata_index.load(APTDataCollectionMetadata, self._get_collection_metadata_path())
         return None
 
     def _get_preparation_metadata_path(self):
@@ -353,16 +615,15 @@ class APTSampleDirectory(DataDirectory):
 
         :return: APTSamplePreperationMetadata"""
 
-        return APTSamplePreparationMetadata.from_yaml(self._get_preparation_metadata_path())
+        return metadata_index.load(APTSamplePreparationMetadata, self._get_preparation_metadata_path())
 
     def get_preparation_metadata(self):
         """Load the sample preparation information from disk
 
         :return: dict, Preparation metadata
         """
-        return APTSamplePreparationMetadata.from_yaml(
-            self._get_preparation_metadata_path()
-        )
+        return metadata_index.load(APTSamplePreparationMetadata,
+                                   self._get_preparation_metadata_path())
 
     def get_rhit_path(self):
         """Get the path to the RHIT file
@@ -372,6 +633,12 @@ class APTSampleDirectory(DataDirectory):
         # Find the *RHIT file in this directory
         return self._find_file("RHIT", allow_none=True)
 
+    def count_reconstructions(self):
+        """Count the reconstructions of this sample, without reading their metadata
+
+        :return: int, number of reconstructions"""
+        return len(APTReconstruction._list_paths(self.path, prefetch=False))
+
     def list_reconstructions(self):
         """Get all reconstructions for this sample
 
@@ -380,17 +647,26 @@ class APTSampleDirectory(DataDirectory):
             - list of dict, metadata for each reconstruction
             - list of str, errors"""
 
-        # Find all subdirectories that contain "SampleInformation.yaml"
+        # Find all subdirectories that contain "ReconstructionMetadata.yaml"
         managers = []
         metadata = []
         errors = []
-        for file in glob("%s/*/ReconstructionMetadata.yaml" % self.path):
-            dirname = os.path.dirname(file)
+        catalog = get_catalog()
+        if catalog is not None:
+            entries = catalog.list_children(self.path, APTReconstruction.catalog_kind)
+        else:
+            entries = [(p, None, None) for p in APTReconstruction._list_paths(self.path, use_catalog=False)]
+        for dirname, recon_info, recon_errors in entries:
             recon_name = os.path.basename(dirname)
             try:
-                managers.append(APTReconstruction.load_dataset_by_path(os.path.dirname(file)))
+                managers.append(APTReconstruction.load_dataset_by_path(dirname))
                 try:
-                    metadata.append(managers[-1].load_metadata())
+                    if recon_info is None:
+                        metadata.append(managers[-1].load_metadata())
+                    elif recon_info.get('ReconstructionMetadata.yaml') is None:
+                        raise DatasetParseException(recon_errors)
+                    else:
+                        metadata.append(APTReconstructionMetadata(**recon_info['ReconstructionMetadata.yaml']))
                 except DatasetParseException as exc:
                     metadata.append({})
                     errors.extend(["%s:%s" % (recon_name, x) for x in exc.errors])
@@ -402,6 +678,10 @@ class APTSampleDirectory(DataDirectory):
 class APTReconstruction(DataDirectory):
     """Directory describing a reconstruction"""
 
+    catalog_kind = 'reconstruction'
+    metadata_files = ('ReconstructionMetadata.yaml',)
+    upload_extensions = ('pos', 'rrng')
+
     def __init__(self, dataset_name, sample_name, recon_name, path):
         """Do not use, use `load_by_name` or `load_by_path` instead"""
         super(APTReconstruction, self).__init__(self._make_name(dataset_name, sample_name, recon_name), path)
@@ -429,9 +709,8 @@ class APTReconstruction(DataDirectory):
 
         # Validate metadata
         form_data = dict(form.data)
-        del form_data['name']
-        del form_data['pos_file']
-        del form_data['rrng_file']
+        for f in ['name', 'pos_file', 'rrng_file', 'pos_path', 'rrng_path']:
+            form_data.pop(f, None)
 
         #   Remove fields with None values
         for f in ['tip_radius', 'tip_image', 'shank_angle']:
@@ -453,6 +732,8 @@ class APTReconstruction(DataDirectory):
 
         # Save the metadata
         metadata.to_yaml(recon._get_metadata_path())
+        recon.record_changes()
+        APTDataDirectory.load_dataset_by_name(dataset_name).set_recent(sample_name, recon_name)
 
         return recon_name
 
@@ -490,7 +771,7 @@ class APTReconstruction(DataDirectory):
         :return: APTReconstructionMetadata
         """
 
-        return APTReconstructionMetadata.from_yaml(self._get_metadata_path())
+        return metadata_index.load(APTReconstructionMetadata, self._get_metadata_path())
 
     def get_pos_file(self):
         """Get the POS file for this directory
@@ -499,6 +780,48 @@ class APTReconstruction(DataDirectory):
 
         return self._find_file("POS")
 
+    def load_pos_file(self):
+        """Open the POS file for this directory
+
+        :return: POSFile, memory-mapped view of the atoms"""
+
+        return POSFile(self.get_pos_file())
+
+    def get_mass_spectrum(self):
+        """Get the mass spectrum of the POS file
+
+        The spectrum is made in the background along with the preview (see `nucapt.preview.PreviewGenerator`),
+        stored in this directory, and only made again if the POS file changes
+
+        :return: MassSpectrum, or `None` if it has not yet been made for the current POS file"""
+
+        return preview_generator.load(self.get_pos_file(), 'spectrum')
+
+    def get_preview(self):
+        """Get the random sample of atoms displayed on the reconstruction page
+
+        :return: Preview, or `None` if it has not yet been made for the current POS file"""
+
+        return load_preview(self.get_pos_file())
+
+    def load_rrng_file(self):
+        """Read the RRNG file for this directory
+
+        :return: RangeFile, ranges indexed for labelling atoms"""
+
+        return RangeFile.from_rrng(self.get_rrng_file())
+
+    def get_composition(self):
+        """Get the number of atoms of each ion and element, as identified by the RRNG file
+
+        The composition is made in the background along with the preview (see `nucapt.preview.PreviewGenerator`),
+        and only made again if the POS or RRNG file changes
+
+        :return: dict, composition (see `RangeFile.compute_composition`),
+            or `None` if it has not yet been made for the current files"""
+
+        return preview_generator.load(self.get_pos_file(), 'composition', self.get_rrng_file())
+
     def get_rrng_file(self):
         """Get the RRNG file for this directory
 
@@ -511,10 +834,19 @@ class APTReconstruction(DataDirectory):
 
         # Load the results
         analyses = dict()
-        for file in glob("%s/*/AnalysisMetadata.yaml" % self.path):
-            dirname = os.path.basename(os.path.dirname(file))
+        catalog = get_catalog()
+        if catalog is not None:
+            for path, analysis_info, _ in catalog.list_children(self.path, APTAnalysisDirectory.catalog_kind):
+                metadata = analysis_info.get('AnalysisMetadata.yaml')
+                analyses[os.path.basename(path)] = metadata if metadata is not None else \
+                    {'title': '<b>Metadata file corrupted!</b>'}
+            return analyses
+
+        for path in APTAnalysisDirectory._list_paths(self.path, use_catalog=False):
+            dirname = os.path.basename(path)
             try:
-                analyses[dirname] = yaml.load(open(file))
+                analyses[dirname] = metadata_index.load(APTAnalysisMetadata,
+                                                        os.path.join(path, 'AnalysisMetadata.yaml')).metadata
             except Exception as e:
                 analyses[dirname] = {'title': '<b>Metadata file corrupted!</b>'}
         return analyses
@@ -523,6 +855,9 @@ class APTReconstruction(DataDirectory):
 class APTAnalysisDirectory(DataDirectory):
     """Directory associated with the analysis performed on reconstructed APT data"""
 
+    catalog_kind = 'analysis'
+    metadata_files = ('AnalysisMetadata.yaml',)
+
     def __init__(self, dataset_name, sample_name, recon_name, analysis_dir, path):
         """Do not use, use load by name instead"""
         super(APTAnalysisDirectory, self).__init__("_".join([dataset_name, sample_name, recon_name, analysis_dir]),
@@ -534,10 +869,10 @@ class APTAnalysisDirectory(DataDirectory):
 
     @classmethod
     def load_dataset_by_path(cls, path):
-        temp_path, recon_name = os.path.split(path)
+        temp_path, analysis_dir = os.path.split(path)
+        temp_path, recon_name = os.path.split(temp_path)
         temp_path, sample_name = os.path.split(temp_path)
         temp_path, dataset_name = os.path.split(temp_path)
-        temp_path, analysis_dir = os.path.split(temp_path)
         return cls(dataset_name, sample_name, recon_name, analysis_dir, path)
 
     @classmethod
@@ -588,8 +923,9 @@ class APTAnalysisDirectory(DataDirectory):
         if os.path.isdir(path):
             raise DatasetParseException('Analysis named %s already exists' % analysis_name)
         os.mkdir(path)
-        recon = cls.load_dataset_by_path(path)
-        metadata.to_yaml(recon._get_metadata_path())
+        analysis = cls.load_dataset_by_path(path)
+        metadata.to_yaml(analysis._get_metadata_path())
+        analysis.record_changes()
 
         return analysis_name
 
@@ -602,14 +938,34 @@ class APTAnalysisDirectory(DataDirectory):
         new_metadata = APTAnalysisMetadata.from_form(form)
 
         # Old metadata has the creation date
-        old_metadata = APTAnalysisMetadata.from_yaml(self._get_metadata_path())
-        old_metadata.metadata.update(new_metadata.metadata)
-        old_metadata.to_yaml(self._get_metadata_path())
+        with self.lock():
+            old_metadata = metadata_index.load(APTAnalysisMetadata, self._get_metadata_path())
+            old_metadata.metadata.update(new_metadata.metadata)
+            old_metadata.to_yaml(self._get_metadata_path())
+        self.record_changes()
 
     def load_metadata(self):
         """Read the metadata for this entry"""
 
-        return APTAnalysisMetadata.from_yaml(self._get_metadata_path())
+        return metadata_index.load(APTAnalysisMetadata, self._get_metadata_path())
+
+    def _list_data_files(self):
+        """:return: list of tuples, (name, size in bytes, modification time) of each data file"""
+        return [f for f in file_inventory.list_files(self.path) if f[0] != 'AnalysisMetadata.yaml']
+
+    @staticmethod
+    def _describe_file(size, mtime):
+        """Format the details of a file for display
+
+        :param size: int, size in bytes
+        :param mtime: float, modification time
+        :return: dict, with keys
+            - size: int, size in MB
+            - modified: date modified"""
+        return {
+            'size': round(size / 1024 / 1024, 2),
+            'modified': time.strftime('%d %b %Y, %I:%M %p', time.localtime(mtime))
+        }
 
     def get_files(self):
         """Get information about all of the files
@@ -619,12 +975,112 @@ class APTAnalysisDirectory(DataDirectory):
             - modified: date modified
         """
 
-        output = dict()
-        for file in os.listdir(self.path):
-            if file == 'AnalysisMetadata.yaml': continue  # Skip this file
-            path = os.path.join(self.path, file)
-            output[file] = {
-                'size': round(os.path.getsize(path) / 1024 / 1024, 2),
-                'modified': time.strftime('%d %b %Y, %I:%M %p', time.localtime(os.path.getmtime(path)))
-            }
-        return output
+        return dict((name, self._describe_file(size, mtime)) for name, size, mtime in self._list_data_files())
+
+    def list_files(self, sort='name', descending=False, page=1, per_page=100):
+        """Get a page of information about the files
+
+        :param sort: str, field to sort by: 'name', 'size', or 'modified'
+        :param descending: bool, whether to sort in descending order
+        :param page: int, page number, starting from 1
+        :param per_page: int, number of files per page
+        :return:
+            - list of dict, files on this page. Keys: name, size (MB), modified
+            - int, total number of files"""
+
+        files = sorted(self._list_data_files(), key=inventory_sort_keys[sort], reverse=descending)
+        offset = (page - 1) * per_page
+        output = []
+        for name, size, mtime in files[offset:offset + per_page]:
+            info = self._describe_file(size, mtime)
+            info['name'] = name
+            output.append(info)
+        return output, len(files)
+
+
+hierarchy = (APTDataDirectory, APTSampleDirectory, APTReconstruction, APTAnalysisDirectory)
+"""Types of data directory, from the top of the working data down"""
+
+
+def rebuild_catalog():
+    """Re-derive the catalog from the data on disk
+
+    :return: int, number of directories recorded"""
+
+    catalog = get_catalog()
+    if catalog is None:
+        raise ValueError('The catalog is not enabled. Set CATALOG_PATH in the configuration')
+    catalog.clear()
+
+    count = 0
+    for cls, paths in zip(hierarchy, scan_tree(data_path, [c.metadata_files[0] for c in hierarchy])):
+        prefetch_metadata(paths, cls.metadata_files)
+        for path in paths:
+            catalog.record(path, cls.catalog_kind, cls.metadata_files)
+            count += 1
+    return count
+
+
+def rebuild_sidecars():
+    """Make the sidecar copy of every metadata file that lacks an up-to-date one
+
+    :return: int, number of copies written"""
+
+    if not nucapt.app.config.get('METADATA_SIDECAR'):
+        raise ValueError('Sidecars are not enabled. Set METADATA_SIDECAR in the configuration')
+
+    count = 0
+    for cls, paths in zip(hierarchy, scan_tree(data_path, [c.metadata_files[0] for c in hierarchy])):
+        for path in paths:
+            for name in cls.metadata_files:
+                file_path = os.path.join(path, name)
+                if os.path.isfile(file_path) and update_sidecar(file_path):
+                    count += 1
+    return count
+
+
+def iter_directories(dataset_name=None):
+    """Walk through every data directory, one at a time
+
+    Only the paths of the directories above the current one, and of their siblings, are held in memory
+
+    :param dataset_name: str, only walk through this dataset
+    :return: iterator of DataDirectory, each followed by the directories inside it"""
+
+    if dataset_name is None:
+        paths = APTDataDirectory._list_paths(data_path, prefetch=False)
+    else:
+        path = os.path.join(data_path, dataset_name)
+        if os.path.basename(path) != dataset_name or dataset_name.startswith('.') or \
+                not os.path.isfile(os.path.join(path, APTDataDirectory.metadata_files[0])):
+            raise DatasetParseException('No such dataset: %s' % dataset_name)
+        paths = [path]
+    return _walk_directories(0, paths)
+
+
+def _walk_directories(level, paths):
+    """Generate the directories at a certain level of the hierarchy, each followed by those inside it
+
+    :param level: int, level of the directories (0 for datasets)
+    :param paths: list of str, paths to the directories
+    :return: iterator of DataDirectory"""
+
+    for path in paths:
+        yield hierarchy[level].load_dataset_by_path(path)
+        if level + 1 < len(hierarchy):
+            for directory in _walk_directories(level + 1, hierarchy[level + 1]._list_paths(path)):
+                yield directory
+
+
+def rebuild_usage():
+    """Measure the disk space used by every data directory, replacing the stored records
+
+    :return: dict, total 'size' (bytes) and number of 'files' in all datasets"""
+
+    markers = [c.metadata_files[0] for c in hierarchy]
+    total = {'size': 0, 'files': 0}
+    for path in list_subdirectories(data_path, markers[0]):
+        usage = compute_usage(path, markers[1:])['total']
+        total['size'] += usage['size']
+        total['files'] += usage['files']
+    return total
@@ -0,0 +1,119 @@
+"""Recording the SHA-256 hash of every file in a dataset"""
+
+import hashlib
+import os
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+
+from nucapt.exceptions import DatasetParseException
+from nucapt.metadata import MetadataHolder
+
+manifest_name = 'Manifest.yaml'
+"""Name of the manifest file, in the dataset directory"""
+
+_excluded_files = (manifest_name,)
+
+
+def hash_file(path, block_size=1048576):
+    """Compute the SHA-256 hash of a file, reading it one block at a time
+
+    :param path: str, path to the file
+    :param block_size: int, number of bytes read at a time
+    :return: str, hash as a hex string"""
+
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        while True:
+            block = fp.read(block_size)
+            if not block:
+                break
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _list_files(path, subpath=None):
+    """List the files in a dataset that belong in the manifest
+
+    Hidden files (e.g., uploads in progress and cached previews) and the files that record
+    the manifest and publication status are not included
+
+    :param path: str, path to the dataset
+    :param subpath: str, only list the files in this directory, relative to the dataset
+    :return: dict, (size, mtime) of each file, keyed by path relative to the dataset, with '/' separators"""
+
+    files = dict()
+    for root, dirs, names in os.walk(os.path.join(path, subpath) if subpath else path):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in names:
+            if name.startswith('.') or (root == path and name in _excluded_files):
+                continue
+            file_path = os.path.join(root, name)
+            stat = os.stat(file_path)
+            files[os.path.relpath(file_path, path).replace(os.path.sep, '/')] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+def load_manifest(path):
+    """Read the manifest of a dataset
+
+    :param path: str, path to the dataset
+    :return: dict, size, mtime, and sha256 of each file, keyed by relative path. Empty if there is no manifest"""
+
+    manifest_path = os.path.join(path, manifest_name)
+    if not os.path.isfile(manifest_path):
+        return dict()
+    try:
+        return MetadataHolder.from_yaml(manifest_path).metadata.get('files') or dict()
+    except DatasetParseException:
+        return dict()  # Will be regenerated
+
+
+def update_manifest(path, workers=4, subpath=None):
+    """Bring the manifest of a dataset up to date
+
+    Only files that are new, or whose size or modification time changed, are hashed.
+    Hashing is spread over a pool of threads, as it is limited by reading from disk.
+
+    :param path: str, path to the dataset
+    :param workers: int, number of files to hash at the same time
+    :param subpath: str, only check the files in this directory, relative to the dataset.
+        The entries of all other files are kept as they are
+    :return: dict, size, mtime, and sha256 of each file, keyed by relative path"""
+
+    old = load_manifest(path)
+    files = _list_files(path, subpath)
+
+    # Keep the entries outside of the directory being checked
+    manifest = dict()
+    if subpath:
+        prefix = subpath.replace(os.path.sep, '/').strip('/') + '/'
+        manifest.update((name, entry) for name, entry in old.items() if not name.startswith(prefix))
+
+    # Find the files that need hashing
+    to_hash = []
+    for name, (size, mtime) in files.items():
+        entry = old.get(name)
+        if entry is not None and (entry.get('size'), entry.get('mtime')) == (size, mtime):
+            manifest[name] = entry
+        else:
+            to_hash.append(name)
+
+    if len(to_hash) > 0:
+        paths = [os.path.join(path, *name.split('/')) for name in to_hash]
+        if workers > 1 and len(paths) > 1:
+            pool = ThreadPool(min(workers, len(paths)))
+            try:
+                hashes = pool.map(hash_file, paths)
+            finally:
+                pool.close()
+        else:
+            hashes = [hash_file(p) for p in paths]
+        for name, digest in zip(to_hash, hashes):
+            size, mtime = files[name]
+            manifest[name] = {'size': size, 'mtime': mtime, 'sha256': digest}
+
+    # Only write the manifest if it changed
+    if manifest != old:
+        MetadataHolder(files=manifest, updated=datetime.now().strftime('%d %b %Y, %I:%M:%S %p'))\
+            .to_yaml(os.path.join(path, manifest_name))
+    return manifest
@@ -1,13 +1,135 @@
 import json
 import os
 
+import six
 import yaml
 
+import nucapt
 from nucapt.exceptions import DatasetParseException
+from nucapt.index import metadata_index
+from nucapt.locking import atomic_write
+from nucapt.metrics import timed
+from nucapt.state import get_state_path
+
+# Use the LibYAML bindings if PyYAML was built with them
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
 
 module_dir = os.path.dirname(os.path.abspath(__file__))
 
 
+class YAMLSerializer:
+    """Reads and writes metadata as YAML, the format of the metadata files"""
+
+    @staticmethod
+    def load(fp):
+        return yaml.load(fp, Loader=SafeLoader)
+
+    @staticmethod
+    def dump(data, fp=None):
+        return yaml.dump(data, fp, Dumper=SafeDumper, allow_unicode=True)
+
+
+class JSONSerializer:
+    """Reads and writes metadata as JSON, which parses faster than YAML"""
+
+    @staticmethod
+    def load(fp):
+        return json.loads(fp) if isinstance(fp, six.string_types) else json.load(fp)
+
+    @staticmethod
+    def dump(data, fp=None):
+        return json.dumps(data) if fp is None else json.dump(data, fp)
+
+
+sidecar_serializers = {'json': JSONSerializer}
+"""Formats that can be used for sidecar copies of metadata files (see the `METADATA_SIDECAR` setting)"""
+
+
+def _get_sidecar(path):
+    """Get the format and path of the sidecar copy of a metadata file
+
+    :param path: str, path to the metadata file
+    :return: (serializer, str) for the sidecar, or (None, None) if sidecars are disabled"""
+    name = nucapt.app.config.get('METADATA_SIDECAR')
+    if not name:
+        return None, None
+    directory, filename = os.path.split(path)
+    return sidecar_serializers[name], get_state_path(directory, '.%s.%s' % (filename, name))
+
+
+def _get_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+def _write_sidecar(path, data, stamp=None):
+    """Store a sidecar copy of a metadata file, if enabled
+
+    The copy records the size and modification time of the metadata file, and is only used while they match.
+    Metadata that the sidecar format cannot represent exactly (e.g., dates in JSON) is not copied.
+
+    :param path: str, path to the metadata file
+    :param data: dict, contents of the metadata file
+    :param stamp: list, size and modification time of the metadata file when `data` was read. Default: current"""
+
+    serializer, sidecar_path = _get_sidecar(path)
+    if serializer is None:
+        return
+    try:
+        text = serializer.dump({'source': stamp or _get_stamp(path), 'metadata': data})
+        if serializer.load(text)['metadata'] != data:
+            raise ValueError('Metadata changes when converted')  # E.g., non-string keys in JSON
+        with atomic_write(sidecar_path) as fp:
+            fp.write(text)
+    except (IOError, OSError, TypeError, ValueError):
+        if os.path.isfile(sidecar_path):
+            os.unlink(sidecar_path)
+
+
+def _read_sidecar(path):
+    """Read the sidecar copy of a metadata file, if it is enabled and up to date
+
+    :param path: str, path to the metadata file
+    :return: dict, contents of the metadata file, or `None` if the copy cannot be used"""
+
+    serializer, sidecar_path = _get_sidecar(path)
+    if serializer is None or not os.path.isfile(sidecar_path):
+        return None
+    try:
+        with open(sidecar_path, 'r') as fp:
+            data = serializer.load(fp)
+        if data['source'] == _get_stamp(path):
+            return data['metadata']
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def update_sidecar(path):
+    """Make the sidecar copy of a metadata file, if enabled and not already up to date
+
+    Sidecars are only written when the metadata is saved, so use this for files that were
+    changed by other means (see `nucapt.manager.rebuild_sidecars`)
+
+    :param path: str, path to the metadata file
+    :return: bool, whether a new copy was written"""
+
+    serializer, sidecar_path = _get_sidecar(path)
+    if serializer is None or _read_sidecar(path) is not None:
+        return False
+    stamp = _get_stamp(path)
+    try:
+        with open(path, 'r') as fp:
+            data = YAMLSerializer.load(fp)
+    except (IOError, OSError, yaml.YAMLError):
+        return False
+    _write_sidecar(path, data, stamp)
+    return os.path.isfile(sidecar_path)
+
+
 class MetadataHolder:
     """General class for files that hold metadata"""
 
@@ -39,21 +161,32 @@ class MetadataHolder:
         if not os.path.isfile(path):
             raise DatasetParseException('Metadata file not found: ' + path)
 
-        with open(path, 'r') as fp:
-            try:
-                data = yaml.load(fp)
-            except:
-                raise DatasetParseException('Metadata file not valid YAML: ' + path)
+        with timed('nucapt_metadata_seconds', operation='read'):
+            # Use the sidecar copy if it is current
+            data = _read_sidecar(path)
+            if data is not None:
+                return cls(**data)
+
+            with open(path, 'r') as fp:
+                try:
+                    data = YAMLSerializer.load(fp)
+                except:
+                    raise DatasetParseException('Metadata file not valid YAML: ' + path)
             return cls(**data)
 
     def to_yaml(self, path):
         """Save metadata to a YML file"""
 
         try:
-            with open(path, 'w') as fp:
-                yaml.safe_dump(self.metadata, fp, allow_unicode=True)
-        except IOError as exc:
+            with timed('nucapt_metadata_seconds', operation='write'):
+                with atomic_write(path) as fp:
+                    YAMLSerializer.dump(self.metadata, fp)
+                _write_sidecar(path, self.metadata)
+        except (IOError, OSError) as exc:
             raise DatasetParseException('Save for YAML file failed: ' + str(exc))
+        finally:
+            # Do not rely on the modification time alone, which may be coarse on some filesystems
+            metadata_index.invalidate(path)
 
 
 class APTDataCollectionMetadata(MetadataHolder):
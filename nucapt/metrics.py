@@ -0,0 +1,320 @@
+"""Measuring where the time spent handling requests goes
+
+Records histograms of the time taken by each route and by the slow operations within them:
+scanning the data directories, reading and writing metadata files, calls to Globus, and rendering
+templates. The measurements are served in Prometheus text format at ``/metrics``, to clients that
+present the `METRICS_TOKEN` setting as a bearer token.
+
+Measurement is off unless the `METRICS_ENABLED` setting is True. When off, each instrumented
+operation only checks a flag. Each server process keeps its own measurements. If the `METRICS_PATH`
+setting names a directory, each process saves its measurements there every few seconds, and ``/metrics``
+reports the sum over all processes. Otherwise, the measurements are labelled with the ``pid`` of the
+process, and a scrape of a multi-process server sees only the process that happened to answer it.
+"""
+
+import atexit
+import bisect
+import hmac
+import json
+import os
+import threading
+import time
+
+from flask import g, request, abort, Response
+from jinja2 import Template
+
+from nucapt.locking import atomic_write
+
+default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+"""Upper bounds of the histogram buckets (seconds)"""
+
+save_interval = 5.0
+"""Time between saves of the measurements of each process, when they are shared (seconds)"""
+
+_descriptions = {
+    'nucapt_request_seconds': 'Time to handle a request, by route, method, and status code',
+    'nucapt_scan_seconds': 'Time to list the data directories of a certain kind',
+    'nucapt_metadata_seconds': 'Time to read or write a metadata file',
+    'nucapt_globus_seconds': 'Time waiting for responses from Globus services, by host',
+    'nucapt_template_seconds': 'Time to render a template',
+}
+
+
+class Histogram:
+    """Counts of observations in buckets, for each combination of label values"""
+
+    def __init__(self, name, buckets=default_buckets):
+        """
+        :param name: str, name of the metric
+        :param buckets: list of float, upper bounds of the buckets
+        """
+        self.name = name
+        self.buckets = tuple(buckets)
+        self._series = dict()  # Labels -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        """Record an observation
+
+        :param value: float, observed value
+        :param labels: tuple of (name, value) pairs"""
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def get_series(self, labels=()):
+        """Get the observations for one combination of labels
+
+        :param labels: tuple of (name, value) pairs
+        :return: tuple (list of cumulative counts for each bucket and +Inf, sum, count), or None if not observed"""
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                return None
+            counts, total, count = list(series[0]), series[1], series[2]
+        cumulative = []
+        running = 0
+        for c in counts:
+            running += c
+            cumulative.append(running)
+        return cumulative, total, count
+
+    def to_dict(self):
+        """:return: dict, observations in a form that can be written as JSON"""
+        with self._lock:
+            series = [[list(map(list, labels)), list(counts), total, count]
+                      for labels, (counts, total, count) in self._series.items()]
+        return {'buckets': list(self.buckets), 'series': series}
+
+    def add(self, data):
+        """Add the observations from another histogram with the same buckets
+
+        :param data: dict, observations from `to_dict`"""
+        if tuple(data['buckets']) != self.buckets:
+            return  # Made with different settings
+        with self._lock:
+            for labels, counts, total, count in data['series']:
+                labels = tuple(tuple(x) for x in labels)
+                series = self._series.get(labels)
+                if series is None:
+                    series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+                series[2] += count
+
+    def to_prometheus(self, extra_labels=()):
+        """Write the histogram in Prometheus text format
+
+        :param extra_labels: tuple of (name, value) pairs added to every series
+        :return: list of str, lines of the output"""
+
+        lines = ['# HELP %s %s' % (self.name, _descriptions.get(self.name, self.name)),
+                 '# TYPE %s histogram' % self.name]
+        with self._lock:
+            all_labels = sorted(self._series.keys())
+        for labels in all_labels:
+            cumulative, total, count = self.get_series(labels)
+            labels = labels + tuple(extra_labels)
+            bounds = ['%g' % b for b in self.buckets] + ['+Inf']
+            for bound, value in zip(bounds, cumulative):
+                lines.append('%s_bucket%s %d' % (self.name, _format_labels(labels + (('le', bound),)), value))
+            lines.append('%s_sum%s %.6f' % (self.name, _format_labels(labels), total))
+            lines.append('%s_count%s %d' % (self.name, _format_labels(labels), count))
+        return lines
+
+
+def _format_labels(labels):
+    """Format label values for Prometheus
+
+    :param labels: tuple of (name, value) pairs
+    :return: str, ex: '{route="/",method="GET"}'"""
+    if len(labels) == 0:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in labels]
+    return '{' + ','.join('%s="%s"' % kv for kv in escaped) + '}'
+
+
+class MetricsRegistry:
+    """Holds all of the histograms for this process"""
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None  # Directory where the measurements of all processes are saved, if shared
+        self._histograms = dict()
+        self._lock = threading.Lock()
+        self._saver_pid = None
+
+    def get_histogram(self, name):
+        """Get a histogram, creating it if needed
+
+        :param name: str, name of metric
+        :return: Histogram"""
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, Histogram(name))
+        return histogram
+
+    def observe(self, name, value, **labels):
+        """Record an observation, if measurement is enabled
+
+        :param name: str, name of metric
+        :param value: float, observed value
+        :param labels: values of labels for the observation"""
+        if self.enabled:
+            self.get_histogram(name).observe(value, tuple(sorted(labels.items())))
+            if self.path is not None and self._saver_pid != os.getpid():
+                self._start_saver()
+
+    def _start_saver(self):
+        """Start saving the measurements of this process periodically, and when it exits
+
+        Started by the first observation in each process, as threads do not survive forking the server workers"""
+        with self._lock:
+            if self._saver_pid == os.getpid():
+                return
+            self._saver_pid = os.getpid()
+
+        def _save_forever():
+            while True:
+                time.sleep(save_interval)
+                self.save()
+        thread = threading.Thread(target=_save_forever, name='metrics')
+        thread.daemon = True
+        thread.start()
+        atexit.register(self.save)
+
+    def save(self):
+        """Save the measurements of this process, so other processes can report them"""
+        if self.path is None:
+            return
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            data = dict((name, h.to_dict()) for name, h in list(self._histograms.items()))
+            with atomic_write(os.path.join(self.path, '%d.json' % os.getpid())) as fp:
+                json.dump(data, fp)
+        except (IOError, OSError):
+            pass  # Measurements are not worth failing over; the next save will try again
+
+    def collect(self):
+        """Get the measurements to report
+
+        :return: tuple (dict of name -> Histogram, tuple of labels added to every series)"""
+        if self.path is None:
+            return dict(self._histograms), (('pid', os.getpid()),)
+
+        # Sum the measurements saved by each process, including those just made by this one
+        self.save()
+        histograms = dict()
+        for name in os.listdir(self.path):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.path, name)) as fp:
+                    data = json.load(fp)
+            except (IOError, OSError, ValueError):
+                continue
+            for metric, values in data.items():
+                if metric not in histograms:
+                    histograms[metric] = Histogram(metric, values['buckets'])
+                histograms[metric].add(values)
+        return histograms, ()
+
+    def clear(self):
+        """Discard all measurements"""
+        with self._lock:
+            self._histograms.clear()
+
+    def to_prometheus(self):
+        """:return: str, all measurements in Prometheus text format"""
+        lines = []
+        histograms, extra_labels = self.collect()
+        for name in sorted(histograms.keys()):
+            lines.extend(histograms[name].to_prometheus(extra_labels))
+        return '\n'.join(lines) + '\n'
+
+
+# Measurements for this process
+registry = MetricsRegistry()
+
+
+class timed(object):
+    """Context manager that records how long its block takes, if measurement is enabled"""
+
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, **labels):
+        """
+        :param name: str, name of the metric
+        :param labels: values of labels for the observation
+        """
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        if registry.enabled:
+            self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            registry.observe(self.name, time.time() - self.start, **self.labels)
+
+
+class TimedTemplate(Template):
+    """Jinja template that records how long it takes to render"""
+
+    def render(self, *args, **kwargs):
+        with timed('nucapt_template_seconds', template=self.name):
+            return super(TimedTemplate, self).render(*args, **kwargs)
+
+
+def record_http_response(response, *args, **kwargs):
+    """Record the time taken by a request to Globus (a `requests` response hook)"""
+    if registry.enabled:
+        host = response.url.split('/')[2] if '://' in response.url else response.url
+        registry.observe('nucapt_globus_seconds', response.elapsed.total_seconds(), host=host,
+                         method=response.request.method)
+
+
+def install_metrics(app):
+    """Add measurement of the time taken by each request to an app
+
+    :param app: Flask, app to be measured"""
+
+    registry.enabled = bool(app.config.get('METRICS_ENABLED', False))
+    registry.path = app.config.get('METRICS_PATH')
+    app.jinja_env.template_class = TimedTemplate
+
+    @app.before_request
+    def _start_timer():
+        if registry.enabled:
+            g.request_start = time.time()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.get('request_start')
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            registry.observe('nucapt_request_seconds', time.time() - start, route=route,
+                             method=request.method, status=response.status_code)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        """Measurements in Prometheus text format, only served to clients that present the token
+
+        The address of the client is not checked, as all requests come from the same address behind a proxy"""
+        token = app.config.get('METRICS_TOKEN')
+        if not registry.enabled or not token or \
+                not hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'),
+                                        ('Bearer ' + token).encode('utf-8')):
+            abort(404)
+        return Response(registry.to_prometheus(), mimetype='text/plain; version=0.0.4')
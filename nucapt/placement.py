@@ -0,0 +1,112 @@
+"""Placing files that are already on the server into data directories, avoiding copies where possible"""
+
+import errno
+import os
+import shutil
+import sys
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+import nucapt
+from nucapt.exceptions import DatasetParseException
+from nucapt.locking import atomic_write
+
+_FICLONE = 0x40049409
+"""ioctl that makes a copy-on-write clone of a file on Linux (Btrfs, XFS, and others)"""
+
+placement_methods = ('reflink', 'copy')
+"""Default ways of placing a file: a copy-on-write clone, or a full copy. Files can also be given a second link
+to the same file ('hardlink'), so that changing the original also changes the data, or be moved ('move'), which
+removes them from their original location. Neither is used unless requested"""
+
+
+def _reflink(source, destination):
+    """Clone a file, sharing its data on disk until either copy changes
+
+    :param source: str, path to the file
+    :param destination: str, path to the clone, which must not exist"""
+
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported on this platform')
+    with open(source, 'rb') as src:
+        fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            fcntl.ioctl(fd, _FICLONE, src.fileno())
+        except (IOError, OSError):
+            os.close(fd)
+            os.unlink(destination)
+            raise
+        os.close(fd)
+
+
+def _copy(source, destination):
+    """Copy the contents of a file, such that a partial copy is never visible
+
+    :param source: str, path to the file
+    :param destination: str, path to the copy"""
+    with open(source, 'rb') as src, atomic_write(destination, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+_functions = {'reflink': _reflink, 'hardlink': os.link, 'copy': _copy, 'move': os.rename}
+
+
+def is_within(path, directory):
+    """Check whether a file is inside a directory, after resolving any symbolic links
+
+    :param path: str, path to the file
+    :param directory: str, path to the directory
+    :return: bool"""
+    directory = os.path.join(os.path.realpath(directory), '')
+    return os.path.realpath(path).startswith(directory)
+
+
+def place_file(source, destination, methods=None):
+    """Put a file into a data directory, using the cheapest method that works
+
+    Reflinks, hard links, and moves fail if the file system does not support them, or if the file is on
+    another file system, in which case the next method is tried. Note that a hard link shares the
+    file itself: changing the original after it is placed also changes the file in the data directory.
+
+    :param source: str, path to the file
+    :param destination: str, path of the file in the data directory, which must not exist
+    :param methods: list of str, methods to try in order ('reflink', 'hardlink', 'copy', or 'move').
+        Default: the FILE_PLACEMENT_METHODS setting
+    :return: str, name of the method used"""
+
+    if methods is None:
+        methods = nucapt.app.config.get('FILE_PLACEMENT_METHODS', placement_methods)
+    if not os.path.isfile(source):
+        raise DatasetParseException('No such file: ' + source)
+    if os.path.exists(destination):
+        raise DatasetParseException('File already exists: ' + destination)
+
+    errors = []
+    for method in methods:
+        if method not in _functions:
+            raise ValueError('Unknown placement method: %s' % method)
+        try:
+            _functions[method](source, destination)
+            return method
+        except (IOError, OSError) as exc:
+            errors.append('%s failed: %s' % (method, exc))
+    raise DatasetParseException(['Could not place %s' % source] + errors)
+
+
+def undo_placement(source, destination, method):
+    """Take back a file put into a data directory by `place_file`
+
+    Moved files are renamed back to where they came from. Only linked or copied files are deleted,
+    as the original is still in place
+
+    :param source: str, original path of the file
+    :param destination: str, path of the file in the data directory
+    :param method: str, method returned by `place_file`"""
+
+    if method == 'move':
+        os.rename(destination, source)
+    else:
+        os.unlink(destination)
@@ -0,0 +1,98 @@
+"""Reading the contents of POS files without loading them into memory
+
+POS files hold a list of atoms, each stored as four big-endian 32-bit floats:
+the x, y, z position (nm) and the mass-to-charge ratio (Da) of the ion.
+"""
+
+import os
+
+import numpy as np
+
+from nucapt.exceptions import DatasetParseException
+
+pos_dtype = np.dtype([('x', '>f4'), ('y', '>f4'), ('z', '>f4'), ('mz', '>f4')])
+"""Layout of each atom in a POS file"""
+
+
+class POSFile:
+    """Memory-mapped view of a POS file
+
+    Data is only read from disk when it is accessed, so files larger than the memory of the server
+    can be inspected. Slicing the file (e.g., ``pos[1000:2000]``) returns a view rather than a copy.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: str, path to the POS file
+        """
+        self.path = path
+
+        size = os.path.getsize(path)
+        if size % pos_dtype.itemsize != 0:
+            raise DatasetParseException('POS file size (%d bytes) is not a multiple of %d bytes' %
+                                        (size, pos_dtype.itemsize))
+        if size == 0:
+            self.atoms = np.zeros((0,), dtype=pos_dtype)  # np.memmap cannot map empty files
+        else:
+            self.atoms = np.memmap(path, dtype=pos_dtype, mode='r')
+
+    def __len__(self):
+        return len(self.atoms)
+
+    def __getitem__(self, item):
+        return self.atoms[item]
+
+    @property
+    def atom_count(self):
+        """Number of atoms in the file"""
+        return len(self.atoms)
+
+    def iter_chunks(self, chunk_size=1048576):
+        """Iterate through the atoms in blocks
+
+        :param chunk_size: int, number of atoms per block
+        :return: iterator over views of the atoms, which hold at most `chunk_size` atoms"""
+        for start in range(0, len(self.atoms), chunk_size):
+            yield self.atoms[start:start + chunk_size]
+
+    def _get_range(self, fields, chunk_size):
+        """Compute the minimum and maximum of several fields, one block at a time
+
+        :param fields: list of str, names of fields
+        :param chunk_size: int, number of atoms per block
+        :return: dict, (min, max) of each field. `None` if there are no atoms"""
+
+        ranges = dict((f, None) for f in fields)
+        for chunk in self.iter_chunks(chunk_size):
+            for f in fields:
+                low, high = float(chunk[f].min()), float(chunk[f].max())
+                if ranges[f] is not None:
+                    low, high = min(low, ranges[f][0]), max(high, ranges[f][1])
+                ranges[f] = (low, high)
+        return ranges
+
+    def get_bounding_box(self, chunk_size=1048576):
+        """Get the extent of the reconstruction
+
+        :param chunk_size: int, number of atoms read at a time
+        :return: dict, (min, max) of the 'x', 'y', and 'z' coordinates. `None` if there are no atoms"""
+        return self._get_range(['x', 'y', 'z'], chunk_size)
+
+    def get_mz_range(self, chunk_size=1048576):
+        """Get the range of mass-to-charge ratios
+
+        :param chunk_size: int, number of atoms read at a time
+        :return: tuple, (min, max) of m/z. `None` if there are no atoms"""
+        return self._get_range(['mz'], chunk_size)['mz']
+
+    def summarize(self, chunk_size=1048576):
+        """Get the number of atoms, bounding box, and m/z range in a single pass through the file
+
+        :param chunk_size: int, number of atoms read at a time
+        :return: dict with keys 'atom_count', 'bounding_box', and 'mz_range'"""
+        ranges = self._get_range(['x', 'y', 'z', 'mz'], chunk_size)
+        return {
+            'atom_count': self.atom_count,
+            'bounding_box': dict((f, ranges[f]) for f in ['x', 'y', 'z']),
+            'mz_range': ranges['mz']
+        }
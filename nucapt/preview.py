@@ -0,0 +1,309 @@
+"""Making small, random samples of the atoms in a POS file for display in the browser
+
+The mass spectrum and composition of each POS file are made along with its preview, as all read the whole file
+"""
+
+import os
+import threading
+import traceback
+
+import numpy as np
+from six.moves import queue
+
+import nucapt
+from nucapt.exceptions import DatasetParseException
+from nucapt.locking import atomic_write
+from nucapt.pos import POSFile
+from nucapt.rrng import get_composition, load_composition
+from nucapt.spectrum import get_mass_spectrum, load_mass_spectrum
+from nucapt.state import get_state_path
+
+preview_name = '.Preview.npz'
+"""Name of the file holding the preview of each reconstruction (see `nucapt.state`)"""
+
+
+def sample_atoms(pos, size, chunk_size=1048576, seed=0):
+    """Draw a random sample of atoms from a POS file, in one pass and with memory proportional to the sample size
+
+    Uses reservoir sampling with random priorities: each atom is given a random number,
+    and the atoms with the `size` smallest numbers form the sample. The reservoir is updated
+    with a whole block of atoms at a time.
+
+    :param pos: POSFile, file to sample
+    :param size: int, number of atoms in the sample
+    :param chunk_size: int, number of atoms read at a time
+    :param seed: int, seed for the random number generator
+    :return: ndarray, (N, 4) array of the x, y, z, and m/z of each sampled atom, in the order they appear in the file"""
+
+    rng = np.random.RandomState(seed)
+    keys = np.zeros((0,), dtype=np.float64)
+    index = np.zeros((0,), dtype=np.int64)
+    sample = np.zeros((0, 4), dtype=np.float32)
+
+    start = 0
+    for chunk in pos.iter_chunks(chunk_size):
+        chunk_keys = rng.random_sample(len(chunk))
+
+        # Only atoms that beat the current worst member of a full reservoir can enter it
+        if len(keys) == size:
+            candidates = np.flatnonzero(chunk_keys < keys.max())
+        else:
+            candidates = np.arange(len(chunk))
+        if len(candidates) > 0:
+            keys = np.concatenate([keys, chunk_keys[candidates]])
+            index = np.concatenate([index, candidates + start])
+            chunk_atoms = chunk[candidates]
+            sample = np.concatenate([sample, np.stack([chunk_atoms[f] for f in ['x', 'y', 'z', 'mz']],
+                                                      axis=1).astype(np.float32)])
+            if len(keys) > size:
+                keep = np.argpartition(keys, size - 1)[:size]
+                keys, index, sample = keys[keep], index[keep], sample[keep]
+        start += len(chunk)
+
+    return sample[np.argsort(index)]
+
+
+class Preview:
+    """Random sample of the atoms in a reconstruction"""
+
+    def __init__(self, atoms, atom_count, pos_size, pos_mtime):
+        """
+        :param atoms: ndarray, (N, 4) array of the x, y, z, and m/z of the sampled atoms
+        :param atom_count: int, number of atoms in the POS file
+        :param pos_size: int, size of the POS file used to make the preview
+        :param pos_mtime: float, modification time of that POS file
+        """
+        self.atoms = atoms
+        self.atom_count = atom_count
+        self.pos_size = pos_size
+        self.pos_mtime = pos_mtime
+
+    @classmethod
+    def compute(cls, pos_path, size=100000):
+        """Make a preview of a POS file
+
+        :param pos_path: str, path to the POS file
+        :param size: int, number of atoms in the preview
+        :return: Preview"""
+        stat = os.stat(pos_path)
+        pos = POSFile(pos_path)
+        return cls(sample_atoms(pos, size), pos.atom_count, stat.st_size, stat.st_mtime)
+
+    def is_current(self, pos_path):
+        """Check whether this preview was made from the current version of a POS file
+
+        :param pos_path: str, path to the POS file
+        :return: bool"""
+        stat = os.stat(pos_path)
+        return (self.pos_size, self.pos_mtime) == (stat.st_size, stat.st_mtime)
+
+    @classmethod
+    def load(cls, path):
+        """Read a preview from disk
+
+        :param path: str, path to the file
+        :return: Preview"""
+        try:
+            with np.load(path) as data:
+                return cls(data['atoms'], int(data['atom_count']), int(data['pos_size']), float(data['pos_mtime']))
+        except (IOError, ValueError, KeyError) as exc:
+            raise DatasetParseException('Could not read preview: %s' % exc)
+
+    def save(self, path):
+        """Write the preview to disk, under a temporary name that is renamed once complete
+
+        :param path: str, path to the file"""
+        with atomic_write(path, 'wb') as fp:
+            np.savez_compressed(fp, atoms=self.atoms, atom_count=self.atom_count,
+                                pos_size=self.pos_size, pos_mtime=self.pos_mtime)
+
+    def to_bytes(self):
+        """:return: bytes, x, y, z, and m/z of each atom as little-endian float32 (readable as a JS Float32Array)"""
+        return self.atoms.astype('<f4').tobytes()
+
+
+def load_preview(pos_path):
+    """Get the preview of a POS file, if one has been made for its current version
+
+    :param pos_path: str, path to the POS file
+    :return: Preview, or `None` if not yet available"""
+
+    path = get_state_path(os.path.dirname(pos_path), preview_name)
+    if not os.path.isfile(path):
+        return None
+    try:
+        preview = Preview.load(path)
+    except DatasetParseException:
+        return None
+    return preview if preview.is_current(pos_path) else None
+
+
+class PreviewGenerator:
+    """Makes previews, mass spectra, and compositions of POS files on a background thread
+
+    All are made in the same job, which is only queued once for each POS file,
+    even if they are requested many times before they are made. Compositions are only made
+    once the RRNG file used to identify the atoms has been given
+    """
+
+    kinds = ('preview', 'spectrum', 'composition')
+    """Products made for each POS file"""
+
+    stamp_name = '.%s.version'
+    """Name of the files recording which version of the POS file each product was made from (see `nucapt.state`)"""
+
+    def __init__(self, size=100000, bin_width=0.05, max_mz=500):
+        """
+        :param size: int, number of atoms in each preview
+        :param bin_width: float, width of the bins of each mass spectrum (Da)
+        :param max_mz: float, largest m/z binned in each mass spectrum (Da)
+        """
+        self.size = size
+        self.bin_width = bin_width
+        self.max_mz = max_mz
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._rrng_paths = dict()
+        self._errors = dict()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def load(self, pos_path, kind='preview', rrng_path=None):
+        """Get a product of a POS file, if it has been made for the current version of the file
+
+        :param pos_path: str, path to the POS file
+        :param kind: str, 'preview', 'spectrum', or 'composition'
+        :param rrng_path: str, path to the RRNG file. Needed for the composition
+        :return: Preview, MassSpectrum, or dict, or `None` if not yet available"""
+        if kind == 'preview':
+            return load_preview(pos_path)
+        if kind == 'composition':
+            return load_composition(pos_path, rrng_path)
+        return load_mass_spectrum(pos_path, self.bin_width, self.max_mz)
+
+    def _make(self, pos_path, kind, rrng_path):
+        """Make a product of a POS file, and store it with the other records about its directory
+
+        :param pos_path: str, path to the POS file
+        :param kind: str, 'preview', 'spectrum', or 'composition'
+        :param rrng_path: str, path to the RRNG file. Needed for the composition"""
+        if kind == 'preview':
+            Preview.compute(pos_path, self.size).save(get_state_path(os.path.dirname(pos_path), preview_name))
+        elif kind == 'composition':
+            get_composition(POSFile(pos_path), rrng_path)
+        else:
+            get_mass_spectrum(pos_path, self.bin_width, self.max_mz)
+
+    @staticmethod
+    def _get_version(pos_path, kind, rrng_path):
+        """:return: version of the files a product is made from, as their sizes and modification times"""
+        stat = os.stat(pos_path)
+        if kind == 'composition':
+            rrng_stat = os.stat(rrng_path)
+            return stat.st_size, stat.st_mtime, rrng_path, rrng_stat.st_size, rrng_stat.st_mtime
+        return stat.st_size, stat.st_mtime
+
+    def _get_stamp_path(self, pos_path, kind):
+        """:return: str, path to the file recording which version of a POS file a product was made from"""
+        return get_state_path(os.path.dirname(pos_path), self.stamp_name % kind.capitalize())
+
+    def _is_ready(self, pos_path, kind, rrng_path):
+        """Check whether a product was made from the current version of a POS file, without reading the product
+
+        :return: bool"""
+        try:
+            with open(self._get_stamp_path(pos_path, kind)) as fp:
+                return fp.read() == repr(self._get_version(pos_path, kind, rrng_path))
+        except (IOError, OSError):
+            return False
+
+    def _has_failed(self, pos_path, kind, rrng_path=None):
+        """:return: bool, whether making a product of the current version of a POS file failed. Call with the lock"""
+        error = self._errors.get((kind, pos_path))
+        if error is None:
+            return False
+        try:
+            version = self._get_version(pos_path, kind, rrng_path)
+        except OSError:
+            version = None  # The files are missing, as they were when a job failed to find them
+        return error[0] == version
+
+    def request(self, pos_path, kind='preview', rrng_path=None):
+        """Make sure the products of the current version of a POS file are made
+
+        :param pos_path: str, path to the POS file
+        :param kind: str, product whose status is returned: 'preview', 'spectrum', or 'composition'
+        :param rrng_path: str, path to the RRNG file. Needed for the composition
+        :return: str, status of that product: 'ready', 'pending', or 'failed'"""
+
+        pos_path = os.path.abspath(pos_path)
+        if rrng_path is not None:
+            rrng_path = os.path.abspath(rrng_path)
+        elif kind == 'composition':
+            raise ValueError('The RRNG file is needed to make the composition')
+        if self._is_ready(pos_path, kind, rrng_path):
+            return 'ready'
+        with self._lock:
+            if rrng_path is not None:
+                self._rrng_paths[pos_path] = rrng_path
+            if pos_path in self._pending:
+                return 'pending'
+            if self._has_failed(pos_path, kind, rrng_path):
+                return 'failed'
+            self._pending.add(pos_path)
+            self._queue.put(pos_path)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name='preview')
+                self._thread.daemon = True
+                self._thread.start()
+        return 'pending'
+
+    def get_error(self, pos_path, kind='preview'):
+        """Get the reason a product could not be made
+
+        :param pos_path: str, path to the POS file
+        :param kind: str, 'preview', 'spectrum', or 'composition'
+        :return: str, error message, or `None`"""
+        error = self._errors.get((kind, os.path.abspath(pos_path)))
+        return None if error is None else error[1]
+
+    def _work(self):
+        """Make the products of the POS files in the queue, forever"""
+        while True:
+            pos_path = self._queue.get()
+            try:
+                with self._lock:
+                    rrng_path = self._rrng_paths.pop(pos_path, None)
+                for kind in self.kinds:
+                    if kind == 'composition' and rrng_path is None:
+                        continue  # Not requested
+                    version = None
+                    try:
+                        version = self._get_version(pos_path, kind, rrng_path)
+                        with self._lock:
+                            if self._has_failed(pos_path, kind, rrng_path):
+                                continue
+                        if self.load(pos_path, kind, rrng_path) is None:
+                            self._make(pos_path, kind, rrng_path)
+                        with atomic_write(self._get_stamp_path(pos_path, kind)) as fp:
+                            fp.write(repr(version))
+                    except Exception as exc:
+                        nucapt.app.logger.warning('Making the %s of %s failed:\n%s', kind, pos_path,
+                                                  traceback.format_exc())
+                        with self._lock:
+                            message = '; '.join(exc.errors) if isinstance(exc, DatasetParseException) else str(exc)
+                            self._errors[(kind, pos_path)] = (version, message)
+            finally:
+                with self._lock:
+                    self._pending.discard(pos_path)
+                self._queue.task_done()
+
+    def join(self):
+        """Wait until all queued previews are made"""
+        self._queue.join()
+
+
+# Makes the previews for this process
+preview_generator = PreviewGenerator(nucapt.app.config.get('PREVIEW_SIZE', 100000),
+                                     nucapt.app.config.get('MASS_SPECTRUM_BIN_WIDTH', 0.05),
+                                     nucapt.app.config.get('MASS_SPECTRUM_MAX_MZ', 500))
@@ -0,0 +1,293 @@
+"""Publishing datasets to the Materials Data Facility in the background"""
+
+import errno
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from mdf_toolbox import toolbox
+from six.moves import queue
+
+import nucapt
+from nucapt.clients import client_pool
+from nucapt.exceptions import DatasetParseException
+from nucapt.metadata import MetadataHolder
+
+
+class PublicationJob:
+    """Status of the publication of a dataset
+
+    Stored outside of the dataset, so that it is not published along with the data
+    (see the `PUBLICATION_STATUS_PATH` setting). Holds:
+        - status: str, one of 'queued', 'running', 'retrying', 'failed', 'interrupted', or 'complete'
+        - completed: list of str, stages that have completed successfully
+        - stage: str, stage currently being run
+        - attempts: int, number of failed attempts of the current stage
+        - error: str, last error message
+        - updated: str, time of last update
+        - heartbeat: float, last time the process running the job reported that it is still alive
+        - metadata_hash: str, SHA-256 hash of the publication metadata submitted with the job
+        - submission_id, pub_endpoint, pub_path, transfer_id: str, output of the stages
+    """
+
+    def __init__(self, dataset, **kwargs):
+        """Please use `load` or `create` instead
+
+        :param dataset: APTDataDirectory, dataset being published"""
+        self.dataset = dataset
+        self.state = kwargs
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_path(dataset):
+        directory = nucapt.app.config.get('PUBLICATION_STATUS_PATH') or \
+            os.path.join(os.path.dirname(dataset.path), '.publication')
+        return os.path.join(directory, '%s.yaml' % dataset.name)
+
+    @classmethod
+    def load(cls, dataset):
+        """Load the publication status of a dataset
+
+        :param dataset: APTDataDirectory, dataset
+        :return: PublicationJob, or `None` if the dataset has not been submitted"""
+
+        path = cls._get_path(dataset)
+        if not os.path.isfile(path):
+            return None
+        return cls(dataset, **MetadataHolder.from_yaml(path).metadata)
+
+    @classmethod
+    def create(cls, dataset, metadata=None):
+        """Start a new job, keeping the results of any stages completed by a previous job
+
+        Stages are only skipped if the previous job was submitted with the same metadata, so that corrected
+        metadata is not left out of the publication
+
+        :param dataset: APTDataDirectory, dataset to be published
+        :param metadata: dict, publication metadata
+        :return: PublicationJob"""
+
+        metadata_hash = hashlib.sha256(json.dumps(metadata, sort_keys=True, default=str).encode()).hexdigest()
+        job = cls.load(dataset)
+        if job is None or job['metadata_hash'] != metadata_hash:
+            job = cls(dataset, completed=[])
+        job.update(status='queued', stage=None, attempts=0, error=None, metadata_hash=metadata_hash)
+        return job
+
+    def __getitem__(self, item):
+        return self.state.get(item)
+
+    def update(self, **kwargs):
+        """Update the status and save it to disk"""
+        with self._lock:
+            self.state.update(kwargs)
+            self.state['updated'] = datetime.now().strftime('%d %b %Y, %I:%M:%S %p')
+            self._save()
+
+    def beat(self):
+        """Record that the process running this job is still alive"""
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        self.state['heartbeat'] = time.time()
+        path = self._get_path(self.dataset)
+        _make_directory(os.path.dirname(path))
+        MetadataHolder(**self.state).to_yaml(path)
+
+    def is_active(self):
+        """:return: bool, whether this job is waiting to run or running"""
+        return self['status'] in ['queued', 'running', 'retrying']
+
+    def is_stale(self):
+        """:return: bool, whether the process running this job has stopped reporting that it is alive"""
+        timeout = nucapt.app.config.get('PUBLISH_HEARTBEAT_TIMEOUT', 120)
+        return time.time() - (self['heartbeat'] or 0) > timeout
+
+
+def _make_directory(path):
+    """Create a directory, if it does not already exist
+
+    :param path: str, path to the directory"""
+    try:
+        os.makedirs(path)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+
+
+def write_manifest(job, metadata, tokens):
+    """Record the hash of each file, so the published copy can be checked"""
+    job.dataset.update_manifest()
+
+
+def push_metadata(job, metadata, tokens):
+    """Create the publication record"""
+    client = client_pool.get_client('publish', tokens)
+    result = client.push_metadata(nucapt.app.config.get("PUBLISH_COLLECTION"), metadata)
+    job.update(submission_id=result["id"], pub_endpoint=result['globus.shared_endpoint.name'],
+               pub_path=os.path.join(result['globus.shared_endpoint.path'], "data") + "/")
+
+
+def transfer(job, metadata, tokens):
+    """Transfer the data to the publication endpoint and wait for it to finish"""
+    client = client_pool.get_client('transfer', tokens)
+
+    # '/' of the Globus endpoint for the working data is the working data path
+    data_path = '/%s/' % (os.path.relpath(job.dataset.path, nucapt.app.config['WORKING_PATH']))
+    transfer_id = toolbox.quick_transfer(client, nucapt.app.config["WORKING_DATA_ENDPOINT"],
+                                         job['pub_endpoint'], [(data_path, job['pub_path'])], timeout=0)
+    job.update(transfer_id=transfer_id)
+
+
+def complete_submission(job, metadata, tokens):
+    """Send the submission in for review"""
+    client = client_pool.get_client('publish', tokens)
+    client.complete_submission(job['submission_id'])
+
+
+STAGES = [('write_manifest', write_manifest), ('push_metadata', push_metadata), ('transfer', transfer),
+          ('complete_submission', complete_submission)]
+"""Steps of publishing a dataset, in order"""
+
+
+def run_job(job, metadata, tokens):
+    """Run each stage of publication that has not yet completed, retrying failures with backoff
+
+    Marks the dataset as published once all stages complete
+
+    :param job: PublicationJob, job to run
+    :param metadata: dict, publication metadata in the format expected by Globus Publish
+    :param tokens: dict, tokens of the user publishing the data"""
+
+    config = nucapt.app.config
+    max_attempts = config.get('PUBLISH_MAX_ATTEMPTS', 4)
+    delay = config.get('PUBLISH_RETRY_DELAY', 60)
+
+    for stage, function in STAGES:
+        if stage in job['completed']:
+            continue
+        attempts = 0
+        while True:
+            job.update(status='running', stage=stage, attempts=attempts)
+            try:
+                function(job, metadata, tokens)
+                break
+            except Exception as exc:
+                attempts += 1
+                nucapt.app.logger.warning('Publication stage %s failed for %s:\n%s', stage, job.dataset.name,
+                                          traceback.format_exc())
+                if attempts >= max_attempts:
+                    job.update(status='failed', attempts=attempts, error=str(exc))
+                    return
+                job.update(status='retrying', attempts=attempts, error=str(exc))
+                time.sleep(delay * 2 ** (attempts - 1))
+        job.update(completed=job['completed'] + [stage])
+
+    job.dataset.mark_as_published(job['submission_id'])
+    job.update(status='complete', stage=None, error=None)
+
+
+class PublicationRunner:
+    """Runs publication jobs on background threads
+
+    User tokens are only held in memory, so jobs that are running when the server stops
+    are reported as interrupted and must be resubmitted. Resubmitted jobs skip the stages that already completed.
+    A heartbeat is recorded for each queued or running job, so that other processes can tell whether it is still alive
+    """
+
+    def __init__(self, workers=1, heartbeat_interval=30):
+        """
+        :param workers: int, number of jobs to run at the same time
+        :param heartbeat_interval: float, time between heartbeats of each job (seconds)
+        """
+        self.workers = workers
+        self.heartbeat_interval = heartbeat_interval
+        self._queue = queue.Queue()
+        self._threads = []
+        self._active = set()
+        self._heartbeat_thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, dataset, metadata, tokens):
+        """Queue a dataset for publication
+
+        :param dataset: APTDataDirectory, dataset to be published
+        :param metadata: dict, publication metadata in the format expected by Globus Publish
+        :param tokens: dict, tokens of the user publishing the data
+        :return: PublicationJob, status of the new job"""
+
+        job = PublicationJob.create(dataset, metadata)
+        with self._lock:
+            self._active.add(job)
+        self._queue.put((job, metadata, dict(tokens)))
+        with self._lock:
+            if self._heartbeat_thread is None:
+                self._heartbeat_thread = threading.Thread(target=self._beat, name='publication-heartbeat')
+                self._heartbeat_thread.daemon = True
+                self._heartbeat_thread.start()
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name='publication-%d' % len(self._threads))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        return job
+
+    def _work(self):
+        """Run jobs from the queue, forever"""
+        while True:
+            job, metadata, tokens = self._queue.get()
+            try:
+                with nucapt.app.app_context():
+                    run_job(job, metadata, tokens)
+            except Exception as exc:
+                nucapt.app.logger.error('Publication of %s failed:\n%s', job.dataset.name, traceback.format_exc())
+                job.update(status='failed', error=str(exc))
+            finally:
+                with self._lock:
+                    self._active.discard(job)
+                self._queue.task_done()
+
+    def _beat(self):
+        """Record a heartbeat for each queued or running job, forever"""
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self._lock:
+                jobs = list(self._active)
+            for job in jobs:
+                try:
+                    job.beat()
+                except Exception:
+                    nucapt.app.logger.warning('Heartbeat of publication of %s failed:\n%s', job.dataset.name,
+                                              traceback.format_exc())
+
+    def join(self):
+        """Wait until all queued jobs are complete"""
+        self._queue.join()
+
+
+def get_job(dataset):
+    """Get the publication status of a dataset
+
+    Active jobs whose process has stopped recording heartbeats (e.g., because the server stopped)
+    are marked as interrupted
+
+    :param dataset: APTDataDirectory, dataset
+    :return: PublicationJob, or `None` if the dataset has not been submitted"""
+
+    try:
+        job = PublicationJob.load(dataset)
+    except DatasetParseException:
+        return None
+    if job is not None and job.is_active() and job.is_stale():
+        job.update(status='interrupted', error='Server stopped before publication finished')
+    return job
+
+
+# Runs jobs for this process
+publication_runner = PublicationRunner(nucapt.app.config.get('PUBLISH_WORKERS', 1),
+                                       nucapt.app.config.get('PUBLISH_HEARTBEAT_INTERVAL', 30))
@@ -0,0 +1,185 @@
+"""Reading RRNG range files, and using them to identify the atoms in a POS file"""
+
+import os
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+from nucapt.exceptions import DatasetParseException
+from nucapt.metadata import MetadataHolder
+from nucapt.state import get_state_path
+
+_non_element_keys = ('vol', 'color', 'name')
+
+composition_name = '.Composition.yaml'
+"""Name of the file holding the composition of each reconstruction (see `nucapt.state`)"""
+
+
+def _species_name(elements):
+    """Make the name of an ion from its elements
+
+    :param elements: OrderedDict, number of each element in the ion
+    :return: str, name (ex: "Al2O")"""
+    return ''.join(e if n == 1 else '%s%d' % (e, n) for e, n in elements.items())
+
+
+class RangeFile:
+    """Mass ranges from an RRNG file, indexed so that many atoms can be labelled at once
+
+    The ranges are sorted by their lower bound. As ranges may not overlap (but may touch), the range holding
+    a certain m/z is the last one that starts at or below it, if that range ends at or above it. So, finding
+    the ranges of all the atoms is a single binary search (`numpy.searchsorted`).
+    """
+
+    def __init__(self, ranges):
+        """
+        :param ranges: list of tuples (lower bound, upper bound, OrderedDict of the number of each element)
+        """
+        ranges = sorted(ranges, key=lambda x: x[0])
+        for (low, high, _), (next_low, _, _) in zip(ranges, ranges[1:]):
+            if next_low < high:
+                raise DatasetParseException('Ranges overlap: %.4f-%.4f and one starting at %.4f' %
+                                            (low, high, next_low))
+
+        # Assign a number to each ion species
+        self.species = []
+        self.elements = dict()
+        species_index = []
+        for _, _, elements in ranges:
+            name = _species_name(elements)
+            if name not in self.elements:
+                self.species.append(name)
+                self.elements[name] = elements
+            species_index.append(self.species.index(name))
+
+        self.lows = np.array([r[0] for r in ranges], dtype=np.float64)
+        self.highs = np.array([r[1] for r in ranges], dtype=np.float64)
+        self.species_index = np.array(species_index, dtype=np.int64)
+
+    @classmethod
+    def from_rrng(cls, path):
+        """Read a range file
+
+        :param path: str, path to the RRNG file
+        :return: RangeFile"""
+
+        # Get the "key=value" lines of the [Ranges] section
+        try:
+            with open(path) as fp:
+                lines = fp.readlines()
+        except (IOError, UnicodeDecodeError) as exc:
+            raise DatasetParseException('Could not read RRNG file: %s' % exc)
+        section = None
+        entries = []
+        for line in lines:
+            line = line.strip()
+            if line.startswith('[') and line.endswith(']'):
+                section = line[1:-1].strip().lower()
+            elif section == 'ranges' and '=' in line:
+                entries.append(tuple(x.strip() for x in line.split('=', 1)))
+        if len(entries) == 0:
+            raise DatasetParseException('RRNG file has no ranges')
+
+        ranges = []
+        errors = []
+        for key, value in entries:
+            if not re.match(r'range\d+$', key, re.IGNORECASE):
+                continue
+            fields = value.split()
+            try:
+                low, high = float(fields[0]), float(fields[1])
+                elements = OrderedDict()
+                for field in fields[2:]:
+                    name, count = field.split(':', 1)
+                    if name.lower() not in _non_element_keys:
+                        elements[name] = int(count)
+            except (IndexError, ValueError):
+                errors.append('Invalid range in RRNG file: %s=%s' % (key, value))
+                continue
+            if high < low:
+                errors.append('Range has upper bound below lower bound: %s=%s' % (key, value))
+            elif len(elements) == 0:
+                errors.append('Range has no elements: %s=%s' % (key, value))
+            else:
+                ranges.append((low, high, elements))
+        if len(errors) > 0:
+            raise DatasetParseException(errors)
+        return cls(ranges)
+
+    def label(self, mz):
+        """Find the ion species of many atoms
+
+        :param mz: ndarray, mass-to-charge ratio of each atom
+        :return: ndarray, index of each atom's species in `self.species`. -1 for atoms outside of any range"""
+
+        mz = np.asarray(mz, dtype=np.float64)
+        if len(self.lows) == 0:
+            return np.full(mz.shape, -1, dtype=np.int64)
+        position = np.searchsorted(self.lows, mz, side='right') - 1
+        in_range = (position >= 0) & (mz <= self.highs[np.clip(position, 0, None)])
+        return np.where(in_range, self.species_index[np.clip(position, 0, None)], -1)
+
+    def compute_composition(self, pos, chunk_size=1048576):
+        """Count the atoms of each species in a single pass through a POS file
+
+        :param pos: POSFile, atoms to be counted
+        :param chunk_size: int, number of atoms read at a time
+        :return: dict
+            - ions: dict, number of ions of each species
+            - elements: dict, number of atoms of each element, counting each atom in molecular ions
+            - unranged: int, number of ions outside of any range
+            - ranged: int, number of ions inside a range"""
+
+        counts = np.zeros((len(self.species) + 1,), dtype=np.int64)  # Position 0 is the unranged ions
+        for chunk in pos.iter_chunks(chunk_size):
+            counts += np.bincount(self.label(chunk['mz']) + 1, minlength=len(counts))
+
+        ions = dict((s, int(c)) for s, c in zip(self.species, counts[1:]))
+        elements = dict()
+        for name, count in ions.items():
+            for element, number in self.elements[name].items():
+                elements[element] = elements.get(element, 0) + number * count
+        return {'ions': ions, 'elements': elements, 'unranged': int(counts[0]), 'ranged': int(counts[1:].sum())}
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+def load_composition(pos_path, rrng_path):
+    """Get the stored composition of a reconstruction, if it was computed from the current POS and RRNG files
+
+    :param pos_path: str, path to the POS file
+    :param rrng_path: str, path to the range file
+    :return: dict, composition (see `RangeFile.compute_composition`), or `None` if not yet available"""
+
+    path = get_state_path(os.path.dirname(pos_path), composition_name)
+    if not os.path.isfile(path):
+        return None
+    try:
+        stored = MetadataHolder.from_yaml(path).metadata
+        stamps = {'pos': _file_stamp(pos_path), 'rrng': _file_stamp(rrng_path)}
+    except (DatasetParseException, OSError):
+        return None
+    return stored['composition'] if stored.get('source') == stamps else None
+
+
+def get_composition(pos, rrng_path):
+    """Get the composition of a reconstruction, using the stored copy if it is up to date
+
+    Reads the whole POS file if the composition must be computed, so call from a background thread
+    (see `nucapt.preview.PreviewGenerator`)
+
+    :param pos: POSFile, atoms of the reconstruction
+    :param rrng_path: str, path to the range file
+    :return: dict, composition (see `RangeFile.compute_composition`)"""
+
+    composition = load_composition(pos.path, rrng_path)
+    if composition is None:
+        stamps = {'pos': _file_stamp(pos.path), 'rrng': _file_stamp(rrng_path)}
+        composition = RangeFile.from_rrng(rrng_path).compute_composition(pos)
+        MetadataHolder(source=stamps, composition=composition).to_yaml(
+            get_state_path(os.path.dirname(pos.path), composition_name))
+    return composition
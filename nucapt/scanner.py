@@ -0,0 +1,120 @@
+"""Scanning the working data directory with many file system calls in flight at once
+
+Each call to a network file system waits on a round trip to the server. Listing the
+directories and reading the metadata files from a pool of threads hides most of that latency.
+"""
+
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:  # Python < 3.5
+    from scandir import scandir
+
+import nucapt
+from nucapt.index import metadata_index
+from nucapt.metadata import MetadataHolder
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Get the thread pool for this process
+
+    :return: ThreadPool, or `None` if scanning in parallel is disabled"""
+    global _pool, _pool_pid
+
+    workers = nucapt.app.config.get('SCAN_WORKERS', 8)
+    if workers <= 1:
+        return None
+    with _pool_lock:
+        # Threads do not survive a fork, so make a new pool in each worker process
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPool(workers)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _capture(args):
+    """Run a function, catching any exception it raises
+
+    :param args: tuple, (function, item)
+    :return: tuple, (result, exception)"""
+    fn, item = args
+    try:
+        return fn(item), None
+    except Exception as exc:
+        return None, exc
+
+
+def parallel_map(fn, items):
+    """Apply a function to many items at once
+
+    Functions run on the scanning pool must not use the pool themselves, as that could exhaust its threads.
+
+    :param fn: function to apply
+    :param items: list of items
+    :return: list of tuples, (result, exception) for each item, in the same order as `items`.
+        Exactly one of the two is `None`"""
+
+    items = list(items)
+    pool = _get_pool()
+    if pool is None or len(items) <= 1:
+        return [_capture((fn, item)) for item in items]
+    return pool.map(_capture, [(fn, item) for item in items])
+
+
+def _list_subdirectories(path):
+    """List the directories inside a directory, skipping hidden ones
+
+    :param path: str, path to directory
+    :return: list of str, paths to the subdirectories"""
+    try:
+        return [entry.path for entry in scandir(path) if not entry.name.startswith('.') and entry.is_dir()]
+    except OSError:
+        return []
+
+
+def list_subdirectories(path, marker):
+    """List the directories inside a directory that contain a certain file
+
+    :param path: str, path to the parent directory
+    :param marker: str, name of the file
+    :return: list of str, sorted paths to the directories"""
+
+    candidates = _list_subdirectories(path)
+    found = parallel_map(lambda p: os.path.isfile(os.path.join(p, marker)), candidates)
+    return sorted(p for p, (is_file, _) in zip(candidates, found) if is_file)
+
+
+def prefetch_metadata(paths, metadata_files):
+    """Read the metadata files of many directories into the metadata index
+
+    Files that are missing or invalid are skipped. They raise the usual errors when read later.
+
+    :param paths: list of str, paths to directories
+    :param metadata_files: list of str, names of the metadata files in each directory"""
+
+    files = [os.path.join(p, name) for p in paths for name in metadata_files]
+    parallel_map(lambda f: os.path.isfile(f) and metadata_index.load(MetadataHolder, f), files)
+
+
+def scan_tree(path, levels):
+    """Find all of the data directories below a certain directory, one level of the hierarchy at a time
+
+    :param path: str, path to the top directory
+    :param levels: list of str, name of the file marking the directories at each level (e.g., datasets, then samples)
+    :return: list of lists, sorted paths of the directories found at each level"""
+
+    output = []
+    parents = [path]
+    for marker in levels:
+        candidates = [p for children, _ in parallel_map(_list_subdirectories, parents) for p in children or []]
+        found = parallel_map(lambda p: os.path.isfile(os.path.join(p, marker)), candidates)
+        parents = sorted(p for p, (is_file, _) in zip(candidates, found) if is_file)
+        output.append(parents)
+    return output
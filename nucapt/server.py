@@ -0,0 +1,81 @@
+"""Running the service with gunicorn, a multi-process production server
+
+Two kinds of server can be run from the same configuration. The "web" server handles
+ordinary page requests. The "upload" server is meant for the long-running chunked-upload requests
+(paths ending in ``/uploads/...``). It has a longer timeout and more threads per worker, so that
+slow uploads cannot occupy the workers that serve pages. Route upload paths to it from the front-end proxy.
+
+gunicorn is an optional dependency (``pip install -e .[server]``), and does not run on Windows.
+"""
+
+import multiprocessing
+
+import nucapt
+
+_defaults = {
+    'web': {'BIND': '0.0.0.0:5000', 'WORKERS': None, 'THREADS': 4, 'WORKER_CLASS': 'gthread', 'TIMEOUT': 120},
+    'upload': {'BIND': '0.0.0.0:5001', 'WORKERS': 2, 'THREADS': 32, 'WORKER_CLASS': 'gthread', 'TIMEOUT': 3600},
+}
+"""Default settings for each kind of server, overridden by `SERVER_*` and `UPLOAD_SERVER_*` settings"""
+
+
+def get_server_options(role='web', config=None):
+    """Get the gunicorn settings for a server
+
+    :param role: str, kind of server: 'web' or 'upload'
+    :param config: dict, NUCAPT configuration. Defaults to that of the app
+    :return: dict, gunicorn settings"""
+
+    if role not in _defaults:
+        raise ValueError('No such server role: ' + role)
+    if config is None:
+        config = nucapt.app.config
+    prefix = 'SERVER_' if role == 'web' else 'UPLOAD_SERVER_'
+
+    def get(name):
+        value = config.get(prefix + name)
+        return _defaults[role][name] if value is None else value
+
+    options = {
+        'bind': get('BIND'),
+        'workers': get('WORKERS') or multiprocessing.cpu_count() * 2 + 1,
+        'threads': get('THREADS'),
+        'worker_class': get('WORKER_CLASS'),
+        'timeout': get('TIMEOUT'),
+        'preload_app': True,  # Load the app once, before forking the workers
+    }
+    for name in ['certfile', 'keyfile']:
+        value = config.get('SERVER_' + name.upper())
+        if value:
+            options[name] = value
+    return options
+
+
+def run_server(role='web', **overrides):
+    """Run the service until interrupted
+
+    :param role: str, kind of server: 'web' or 'upload'
+    :param overrides: settings that replace those from the configuration (e.g., workers=4)"""
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise ImportError('The production server requires gunicorn. Install it with: pip install -e .[server]')
+
+    class NucaptApplication(BaseApplication):
+        """gunicorn application that serves the NUCAPT app with settings from its configuration"""
+
+        def __init__(self, options):
+            self.options = options
+            super(NucaptApplication, self).__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return nucapt.app
+
+    options = get_server_options(role)
+    options.update((k, v) for k, v in overrides.items() if v is not None)
+    NucaptApplication(options).run()
@@ -0,0 +1,141 @@
+"""Computing and caching the mass spectrum of a reconstruction"""
+
+import os
+
+import numpy as np
+
+from nucapt.exceptions import DatasetParseException
+from nucapt.locking import atomic_write
+from nucapt.pos import POSFile
+from nucapt.state import get_state_path
+
+sidecar_name = '.MassSpectrum.npz'
+"""Name of the file holding the mass spectrum of each reconstruction (see `nucapt.state`)"""
+
+
+class MassSpectrum:
+    """Histogram of the mass-to-charge ratios of the atoms in a POS file
+
+    Bin ``i`` holds the number of atoms with m/z in ``[i * bin_width, (i + 1) * bin_width)``.
+    Atoms with a negative or non-finite m/z are not counted. Atoms with an m/z of at least ``max_mz``
+    are not binned, and only their number is recorded (``out_of_range``).
+    """
+
+    def __init__(self, bin_width, counts, max_mz=500, out_of_range=0, pos_size=None, pos_mtime=None):
+        """
+        :param bin_width: float, width of each bin (Da)
+        :param counts: ndarray, number of atoms in each bin
+        :param max_mz: float, largest m/z that is binned (Da)
+        :param out_of_range: int, number of atoms with an m/z above `max_mz`
+        :param pos_size: int, size of the POS file used to compute the spectrum
+        :param pos_mtime: float, modification time of that POS file
+        """
+        self.bin_width = bin_width
+        self.counts = counts
+        self.max_mz = max_mz
+        self.out_of_range = out_of_range
+        self.pos_size = pos_size
+        self.pos_mtime = pos_mtime
+
+    @classmethod
+    def compute(cls, pos, bin_width=0.05, max_mz=500, chunk_size=1048576):
+        """Compute the mass spectrum in a single pass through a POS file
+
+        :param pos: POSFile, file to be read
+        :param bin_width: float, width of each bin (Da)
+        :param max_mz: float, largest m/z that is binned (Da), which limits the number of bins
+        :param chunk_size: int, number of atoms read at a time
+        :return: MassSpectrum"""
+
+        counts = np.zeros((0,), dtype=np.int64)
+        out_of_range = 0
+        for chunk in pos.iter_chunks(chunk_size):
+            mz = chunk['mz']
+            finite = np.isfinite(mz) & (mz >= 0)
+            in_range = finite & (mz < max_mz)
+            out_of_range += int(np.count_nonzero(finite)) - int(np.count_nonzero(in_range))
+            bins = np.floor(mz[in_range] / bin_width).astype(np.int64)
+            chunk_counts = np.bincount(bins, minlength=len(counts))
+            chunk_counts[:len(counts)] += counts
+            counts = chunk_counts
+
+        stat = os.stat(pos.path)
+        return cls(bin_width, counts, max_mz=max_mz, out_of_range=out_of_range,
+                   pos_size=stat.st_size, pos_mtime=stat.st_mtime)
+
+    def is_current(self, pos_path, bin_width, max_mz):
+        """Check whether this spectrum was computed from the current version of a POS file
+
+        :param pos_path: str, path to the POS file
+        :param bin_width: float, desired bin width
+        :param max_mz: float, desired largest m/z
+        :return: bool"""
+        stat = os.stat(pos_path)
+        return (self.pos_size, self.pos_mtime, self.bin_width, self.max_mz) == \
+            (stat.st_size, stat.st_mtime, bin_width, max_mz)
+
+    @classmethod
+    def load(cls, path):
+        """Read a spectrum from disk
+
+        :param path: str, path to the file
+        :return: MassSpectrum"""
+        try:
+            with np.load(path) as data:
+                return cls(float(data['bin_width']), data['counts'], max_mz=float(data['max_mz']),
+                           out_of_range=int(data['out_of_range']),
+                           pos_size=int(data['pos_size']), pos_mtime=float(data['pos_mtime']))
+        except (IOError, ValueError, KeyError) as exc:
+            raise DatasetParseException('Could not read mass spectrum: %s' % exc)
+
+    def save(self, path):
+        """Write the spectrum to disk
+
+        The file is written under a temporary name and then renamed, so readers never see a partial file
+
+        :param path: str, path to the file"""
+
+        with atomic_write(path, 'wb') as fp:
+            np.savez_compressed(fp, bin_width=self.bin_width, counts=self.counts, max_mz=self.max_mz,
+                                out_of_range=self.out_of_range, pos_size=self.pos_size, pos_mtime=self.pos_mtime)
+
+    def to_json(self):
+        """:return: dict, spectrum in a form that can be serialized to JSON"""
+        return {'bin_width': self.bin_width, 'counts': self.counts.tolist(), 'atom_count': int(self.counts.sum()),
+                'max_mz': self.max_mz, 'out_of_range': self.out_of_range}
+
+
+def load_mass_spectrum(pos_path, bin_width=0.05, max_mz=500):
+    """Get the mass spectrum of a POS file, if one has been computed for its current version
+
+    :param pos_path: str, path to the POS file
+    :param bin_width: float, width of each bin (Da)
+    :param max_mz: float, largest m/z that is binned (Da)
+    :return: MassSpectrum, or `None` if not yet available"""
+
+    sidecar_path = get_state_path(os.path.dirname(pos_path), sidecar_name)
+    if not os.path.isfile(sidecar_path):
+        return None
+    try:
+        spectrum = MassSpectrum.load(sidecar_path)
+    except DatasetParseException:
+        return None
+    return spectrum if spectrum.is_current(pos_path, bin_width, max_mz) else None
+
+
+def get_mass_spectrum(pos_path, bin_width=0.05, max_mz=500):
+    """Get the mass spectrum of a POS file, computing and storing it if it is not up to date
+
+    Reads the whole POS file if the spectrum must be computed, so call from a background thread
+    (see `nucapt.preview.PreviewGenerator`)
+
+    :param pos_path: str, path to the POS file
+    :param bin_width: float, width of each bin (Da)
+    :param max_mz: float, largest m/z that is binned (Da)
+    :return: MassSpectrum"""
+
+    spectrum = load_mass_spectrum(pos_path, bin_width, max_mz)
+    if spectrum is None:
+        spectrum = MassSpectrum.compute(POSFile(pos_path), bin_width, max_mz)
+        spectrum.save(get_state_path(os.path.dirname(pos_path), sidecar_name))
+    return spectrum
@@ -0,0 +1,61 @@
+"""Where the service keeps its own records about data directories: locks, caches, and partial uploads
+
+These records are kept outside of the data directories, so that they are not published with the data
+or listed in the manifest of a dataset. The records about a directory in the working data are kept in the
+directory with the same relative path in the `STATE_PATH` directory.
+"""
+
+import errno
+import hashlib
+import os
+import shutil
+
+import nucapt
+
+
+def get_state_root():
+    """:return: str, directory holding the records. Default: a hidden directory in the working data"""
+    return os.path.abspath(nucapt.app.config.get('STATE_PATH') or
+                           os.path.join(nucapt.app.config['WORKING_PATH'], '.state'))
+
+
+def get_state_directory(path):
+    """Get the directory holding the records about a data directory
+
+    Directories outside of the working data are kept under a hash of their path
+
+    :param path: str, path to the data directory
+    :return: str, path to the directory holding its records, which might not exist"""
+
+    path = os.path.abspath(path)
+    working_path = os.path.abspath(nucapt.app.config['WORKING_PATH'])
+    relative = os.path.relpath(path, working_path)
+    if relative == '.':
+        return os.path.join(get_state_root(), '_root')
+    if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        return os.path.join(get_state_root(), '_external', hashlib.sha1(path.encode('utf-8')).hexdigest())
+    return os.path.join(get_state_root(), 'data', relative)
+
+
+def get_state_path(path, name):
+    """Get the path of a record about a data directory, making the directory that holds it if needed
+
+    :param path: str, path to the data directory
+    :param name: str, name of the record (e.g., '.Usage.yaml'). Names start with a period, so they
+        cannot clash with the records of the directories inside it
+    :return: str, path to the record"""
+
+    directory = get_state_directory(path)
+    try:
+        os.makedirs(directory)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+    return os.path.join(directory, name)
+
+
+def remove_state(path):
+    """Delete the records about a data directory, and about all of the directories inside it
+
+    :param path: str, path to the data directory"""
+    shutil.rmtree(get_state_directory(path), ignore_errors=True)
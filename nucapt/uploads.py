@@ -0,0 +1,296 @@
+"""Uploading large files in pieces, directly into a data directory"""
+
+import hashlib
+import os
+import time
+import uuid
+
+from werkzeug.utils import secure_filename
+
+import nucapt
+from nucapt.exceptions import DatasetParseException
+from nucapt.locking import file_lock
+from nucapt.metadata import MetadataHolder
+from nucapt.placement import place_file, undo_placement, is_within
+from nucapt.state import get_state_directory, get_state_path, get_state_root
+
+_block_size = 1024 * 1024
+
+
+class ChunkedUpload:
+    """File being uploaded in pieces
+
+    The pieces are written to a file kept with the other records about the destination directory
+    (see `nucapt.state`), which is moved into the directory once the upload is complete. The progress of the
+    upload is stored in another file next to it, so that uploads can be resumed by any server process.
+    Pieces of each upload are written one at a time, under a lock held only for that upload.
+    """
+
+    def __init__(self, directory, upload_id, **state):
+        """Please use `start` or `load` instead
+
+        :param directory: DataDirectory, directory receiving the file
+        :param upload_id: str, ID of the upload
+        :param state: dict, keys filename, size, and received (bytes written so far)"""
+        self.directory = directory
+        self.upload_id = upload_id
+        self.state = state
+
+    @staticmethod
+    def _check_extension(directory, filename):
+        """Make sure that a file is allowed in a directory
+
+        :param directory: DataDirectory, directory receiving the file
+        :param filename: str, name of file"""
+
+        extension = os.path.splitext(filename)[1][1:].lower()
+        if extension not in directory.upload_extensions:
+            raise DatasetParseException('File must have extension: ' +
+                                        ', '.join(e.upper() for e in directory.upload_extensions))
+        if directory._find_file(extension, allow_none=True) is not None:
+            raise DatasetParseException('A %s file is already present' % extension.upper())
+
+    @classmethod
+    def start(cls, directory, filename, size):
+        """Start a new upload
+
+        :param directory: DataDirectory, directory receiving the file
+        :param filename: str, name of the file
+        :param size: int, size of the file in bytes
+        :return: ChunkedUpload"""
+
+        filename = secure_filename(filename)
+        cls._check_extension(directory, filename)
+        if size < 0:
+            raise DatasetParseException('File size must be positive')
+
+        remove_abandoned_uploads(directory.path)
+        upload = cls(directory, uuid.uuid4().hex, filename=filename, size=size, received=0)
+        open(upload._get_data_path(), 'wb').close()
+        upload._save()
+        return upload
+
+    @classmethod
+    def load(cls, directory, upload_id):
+        """Load an upload in progress
+
+        :param directory: DataDirectory, directory receiving the file
+        :param upload_id: str, ID of the upload
+        :return: ChunkedUpload"""
+
+        if not upload_id.isalnum():
+            raise DatasetParseException('No such upload: ' + upload_id)
+        upload = cls(directory, upload_id)
+        upload._reload()
+        return upload
+
+    def _reload(self):
+        """Read the progress of the upload from disk"""
+        if not os.path.isfile(self._get_state_path()):
+            raise DatasetParseException('No such upload: ' + self.upload_id)
+        self.state = MetadataHolder.from_yaml(self._get_state_path()).metadata
+
+    def _get_data_path(self):
+        return get_state_path(self.directory.path, '.upload-%s.part' % self.upload_id)
+
+    def _get_state_path(self):
+        return get_state_path(self.directory.path, '.upload-%s.yaml' % self.upload_id)
+
+    def _get_lock_path(self):
+        return get_state_path(self.directory.path, '.upload-%s.lock' % self.upload_id)
+
+    def _save(self):
+        MetadataHolder(**self.state).to_yaml(self._get_state_path())
+
+    def write_chunk(self, offset, stream, checksum=None, length=None):
+        """Write the next piece of the file
+
+        :param offset: int, position of the piece in the file. Must equal the number of bytes received so far
+        :param stream: file-like object, source of the data
+        :param checksum: str, SHA-256 hash of the piece (hex). If it does not match, the piece is discarded
+        :param length: int, size of the piece in bytes, if known before reading it
+        :return: int, number of bytes received so far"""
+
+        with file_lock(self._get_lock_path()):
+            self._reload()  # Another request may have written a piece since this upload was loaded
+            return self._write_chunk(offset, stream, checksum, length)
+
+    def _write_chunk(self, offset, stream, checksum, length):
+        if offset != self.state['received']:
+            raise DatasetParseException('Expected piece starting at byte %d' % self.state['received'])
+        remaining = self.state['size'] - offset
+        too_long = DatasetParseException('More data than the declared size of %d bytes' % self.state['size'])
+        if length is not None and length > remaining:
+            raise too_long
+
+        # Stream the data into the file, reading no more than the rest of the file
+        hasher = hashlib.sha256()
+        with open(self._get_data_path(), 'r+b') as fp:
+            fp.seek(offset)
+            try:
+                while remaining > 0:
+                    block = stream.read(min(_block_size, remaining))
+                    if not block:
+                        break
+                    hasher.update(block)
+                    fp.write(block)
+                    remaining -= len(block)
+                if remaining == 0 and stream.read(1):
+                    raise too_long
+                if checksum is not None and checksum.lower() != hasher.hexdigest():
+                    raise DatasetParseException('Checksum does not match. Resend the piece starting at byte %d'
+                                                % offset)
+            except:
+                fp.truncate(offset)
+                raise
+            fp.truncate()
+
+        self.state['received'] = self.state['size'] - remaining
+        self._save()
+        return self.state['received']
+
+    def finalize(self):
+        """Move the completed file into place
+
+        :return: str, path to the file"""
+
+        with file_lock(self._get_lock_path()), self.directory.lock():
+            self._reload()
+            if self.state['received'] != self.state['size']:
+                raise DatasetParseException('Upload incomplete. Received %d of %d bytes' %
+                                            (self.state['received'], self.state['size']))
+            self._check_extension(self.directory, self.state['filename'])
+
+            path = os.path.join(self.directory.path, self.state['filename'])
+            if place_file(self._get_data_path(), path, ['move', 'copy']) != 'move':
+                os.unlink(self._get_data_path())  # The records are on another file system
+            os.unlink(self._get_state_path())
+        _remove_file(self._get_lock_path())
+        self.directory.record_changes()
+        return path
+
+    def abort(self):
+        """Discard the upload"""
+        with file_lock(self._get_lock_path()):
+            _remove_file(self._get_data_path())
+            _remove_file(self._get_state_path())
+        _remove_file(self._get_lock_path())
+
+
+def remove_abandoned_uploads(path=None, max_age=None):
+    """Delete the uploads that have not received any data for a while
+
+    :param path: str, path to the directory receiving the uploads. Default: all directories
+    :param max_age: float, time since the last piece was received (seconds). Default: the UPLOAD_EXPIRY setting
+    :return: int, number of uploads removed"""
+
+    if max_age is None:
+        max_age = nucapt.app.config.get('UPLOAD_EXPIRY', 7 * 24 * 3600)
+    if path is None:
+        directories = [root for root, _, _ in os.walk(get_state_root())]
+    else:
+        directories = [get_state_directory(path)]
+
+    removed = 0
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        uploads = set(name[len('.upload-'):].rsplit('.', 1)[0] for name in os.listdir(directory)
+                      if name.startswith('.upload-'))
+        for upload_id in uploads:
+            files = [os.path.join(directory, '.upload-%s.%s' % (upload_id, ext)) for ext in ['part', 'yaml', 'lock']]
+            if not _is_abandoned(files, max_age):
+                continue
+            with file_lock(files[2]):
+                if not _is_abandoned(files, max_age):
+                    continue  # A piece arrived while waiting for the lock
+                _remove_file(files[0])
+                _remove_file(files[1])
+            _remove_file(files[2])
+            removed += 1
+    return removed
+
+
+def _is_abandoned(paths, max_age):
+    """:return: bool, whether the data and progress files of an upload have not changed within `max_age` seconds"""
+    changed = 0
+    for path in paths[:2]:
+        try:
+            changed = max(changed, os.path.getmtime(path))
+        except OSError:
+            pass  # Not made yet, or already removed
+    return time.time() - changed > max_age
+
+
+def _remove_file(path):
+    """Delete a file, if it still exists"""
+    try:
+        os.unlink(path)
+    except OSError:
+        if os.path.exists(path):
+            raise
+
+
+def find_staged_file(path, extension=None):
+    """Find a file in the staging area on the server
+
+    :param path: str, path to the file. Relative paths are relative to the first of the STAGING_PATHS
+    :param extension: str, extension the file must have (e.g., 'pos')
+    :return: str, absolute path to the file"""
+
+    staging_paths = nucapt.app.config.get('STAGING_PATHS') or []
+    if len(staging_paths) == 0:
+        raise DatasetParseException('Attaching files from the server is not enabled')
+    path = os.path.abspath(os.path.join(staging_paths[0], path))
+    if not any(is_within(path, p) for p in staging_paths):
+        raise DatasetParseException('Files can only be attached from the staging area: ' + path)
+    if not os.path.isfile(path):
+        raise DatasetParseException('No such file in the staging area: ' + path)
+    if extension is not None and not path.lower().endswith('.' + extension):
+        raise DatasetParseException('%s file must have the extension ".%s"' % (extension.upper(), extension))
+    return path
+
+
+def attach_staged_file(directory, path):
+    """Put a file from the staging area on the server into a data directory, instead of uploading it
+
+    The file is linked, cloned, moved, or copied into place following the STAGING_PLACEMENT_METHODS setting
+
+    :param directory: DataDirectory, directory receiving the file
+    :param path: str, path to the file. Relative paths are relative to the first of the STAGING_PATHS
+    :return: str, path to the file in the data directory"""
+    return attach_staged_files(directory, [path])[0]
+
+
+def attach_staged_files(directory, paths):
+    """Put several files from the staging area into a data directory, either all of them or none
+
+    Every file is checked before any is placed. If one cannot be placed, those already placed are taken back:
+    moved files are returned to the staging area, and linked or copied files are deleted
+
+    :param directory: DataDirectory, directory receiving the files
+    :param paths: list of str, paths to the files. Relative paths are relative to the first of the STAGING_PATHS
+    :return: list of str, paths to the files in the data directory"""
+
+    sources = [find_staged_file(path) for path in paths]
+    filenames = [secure_filename(os.path.basename(path)) for path in sources]
+    extensions = [os.path.splitext(filename)[1].lower() for filename in filenames]
+    if len(set(extensions)) < len(extensions):
+        raise DatasetParseException('Only one file of each type can be attached')
+
+    destinations = [os.path.join(directory.path, filename) for filename in filenames]
+    with directory.lock():
+        for filename in filenames:
+            ChunkedUpload._check_extension(directory, filename)
+
+        placed = []
+        try:
+            for source, destination in zip(sources, destinations):
+                method = place_file(source, destination, nucapt.app.config.get('STAGING_PLACEMENT_METHODS'))
+                placed.append((source, destination, method))
+        except DatasetParseException:
+            for placement in reversed(placed):
+                undo_placement(*placement)
+            raise
+    directory.record_changes()
+    return destinations
@@ -0,0 +1,142 @@
+"""Recording the disk space used by each data directory
+
+Each data directory holds a record of the files it holds itself (``own``), the total usage of
+each data directory within it (``children``), and the sum of the two (``total``). When the
+files in a directory change, only that directory is measured again. The directories above it
+then update their totals from the records of their children, so keeping the records current
+never requires walking the whole tree.
+"""
+
+import os
+import time
+
+from nucapt.exceptions import DatasetParseException
+from nucapt.index import metadata_index
+from nucapt.locking import directory_lock
+from nucapt.metadata import MetadataHolder
+from nucapt.scanner import list_subdirectories, scandir
+from nucapt.state import get_state_path
+
+usage_name = '.Usage.yaml'
+"""Name of the file holding the usage record of each data directory (see `nucapt.state`)"""
+
+
+def measure_files(path, child_marker=None):
+    """Add up the files in a directory and its subdirectories, except for data directories inside it
+
+    :param path: str, path to the directory
+    :param child_marker: str, name of the file that marks a subdirectory as a data directory, which is not counted
+    :return: dict, 'size' (bytes) and number of 'files'"""
+
+    output = {'size': 0, 'files': 0}
+    to_scan = [(path, True)]
+    while len(to_scan) > 0:
+        directory, is_top = to_scan.pop()
+        for entry in scandir(directory):
+            if entry.is_dir(follow_symlinks=False):
+                if is_top and child_marker is not None and os.path.isfile(os.path.join(entry.path, child_marker)):
+                    continue
+                to_scan.append((entry.path, False))
+            elif entry.is_file(follow_symlinks=False):
+                output['size'] += entry.stat(follow_symlinks=False).st_size
+                output['files'] += 1
+    return output
+
+
+def load_usage(path, request_scope=True):
+    """Read the usage record of a directory
+
+    :param path: str, path to the directory
+    :param request_scope: bool, whether to keep the record in memory for the rest of the current request
+    :return: dict, with keys 'own', 'children', 'total', and 'updated'. `None` if not recorded"""
+
+    record_path = get_state_path(path, usage_name)
+    if not os.path.isfile(record_path):
+        return None
+    try:
+        return metadata_index.load(MetadataHolder, record_path, request_scope=request_scope).metadata
+    except DatasetParseException:
+        return None
+
+
+def _write_usage(path, own, children):
+    """Save the usage record of a directory
+
+    :param path: str, path to the directory
+    :param own: dict, size and number of files held by the directory itself
+    :param children: dict, total usage of each data directory inside it, keyed by name
+    :return: dict, usage record"""
+
+    total = dict(own)
+    for child in children.values():
+        total['size'] += child['size']
+        total['files'] += child['files']
+    usage = {'own': own, 'children': children, 'total': total, 'updated': time.time()}
+    MetadataHolder(**usage).to_yaml(get_state_path(path, usage_name))
+    return usage
+
+
+def compute_usage(path, child_markers):
+    """Measure a directory and every directory below it, recording the usage of each
+
+    Reads every file in the tree, so use only when records are missing or out of date
+
+    :param path: str, path to the directory
+    :param child_markers: list of str, names of the files marking data directories at each level below this one
+    :return: dict, usage record of the directory"""
+
+    children = dict()
+    if len(child_markers) > 0:
+        for child in list_subdirectories(path, child_markers[0]):
+            children[os.path.basename(child)] = compute_usage(child, child_markers[1:])['total']
+    with directory_lock(path):
+        return _write_usage(path, measure_files(path, child_markers[0] if child_markers else None), children)
+
+
+def _get_child_totals(path, child_markers):
+    """Get the total usage of each data directory inside a directory, measuring any without a record
+
+    :param path: str, path to the directory
+    :param child_markers: list of str, names of the files marking data directories at each level below this one
+    :return: dict, total usage of each data directory, keyed by name"""
+
+    children = dict()
+    if len(child_markers) > 0:
+        for child in list_subdirectories(path, child_markers[0]):
+            usage = load_usage(child) or compute_usage(child, child_markers[1:])
+            children[os.path.basename(child)] = usage['total']
+    return children
+
+
+def update_usage(path, markers, level):
+    """Measure a directory again after its files change, then update the totals of the directories above it
+
+    :param path: str, path to the directory. If it no longer exists, it is removed from the totals above it
+    :param markers: list of str, names of the files marking data directories at each level of the hierarchy,
+        starting from the top (datasets)
+    :param level: int, level of this directory in the hierarchy (0 for datasets)"""
+
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        with directory_lock(path):
+            child_markers = markers[level + 1:]
+            usage = load_usage(path)
+            children = usage['children'] if usage is not None else _get_child_totals(path, child_markers)
+            _write_usage(path, measure_files(path, child_markers[0] if child_markers else None), children)
+
+    # Update the records above this directory, using the record just written
+    for parent_level in range(level - 1, -1, -1):
+        name = os.path.basename(path)
+        child = load_usage(path) if os.path.isdir(path) else None
+        path = os.path.dirname(path)
+        with directory_lock(path):
+            usage = load_usage(path)
+            if usage is None:
+                child_markers = markers[parent_level + 1:]
+                _write_usage(path, measure_files(path, child_markers[0]), _get_child_totals(path, child_markers))
+                continue
+            if child is None:
+                usage['children'].pop(name, None)
+            else:
+                usage['children'][name] = child['total']
+            _write_usage(path, usage['own'], usage['children'])
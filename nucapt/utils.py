@@ -1,9 +1,10 @@
+import time
+
 from flask import request, session
 
-import globus_sdk
-from globus_sdk.authorizers.refresh_token import RefreshTokenAuthorizer
+from globus_sdk.exc import GlobusError
 
-from globus_nexus_client import NexusClient
+from nucapt.clients import client_pool
 
 try:
     from urllib.parse import urlparse, urljoin
@@ -14,11 +15,8 @@ from flask import current_app
 
 
 def load_portal_client():
-    """Create an AuthClient for the portal"""
-    return globus_sdk.ConfidentialAppAuthClient(
-        current_app.config['PORTAL_CLIENT_ID'],
-        current_app.config['PORTAL_CLIENT_SECRET']
-    )
+    """Get the AuthClient for the portal, which is shared between requests"""
+    return client_pool.get_portal_client()
 
 
 def is_safe_redirect_url(target):
@@ -43,10 +41,47 @@ def get_safe_redirect():
     return '/'
 
 
-def is_group_member():
-    """Check whether authenticated user is a member of the NUCAPT group"""
-    nexus_client = NexusClient(authorizer=RefreshTokenAuthorizer(session["tokens"]["nexus.api.globus.org"]
-                                                                 ["refresh_token"], load_portal_client()))
+def is_group_member(refresh=False):
+    """Check whether authenticated user is a member of the NUCAPT group
+
+    The answer is cached in the user's session for `GROUP_CACHE_TTL` seconds if they are a member,
+    and `GROUP_CACHE_NEGATIVE_TTL` seconds if not. If Globus cannot be reached, a user last known to be
+    a member is still allowed in for up to `GROUP_CACHE_GRACE` seconds after that answer expires, then denied.
+
+    :param refresh: bool, whether to ignore the cached answer
+    :return: bool, whether the user is an active member"""
+
+    # Check the cache
+    cached = session.get('group_membership')
+    if cached is not None and cached.get('identity') != session.get('primary_identity'):
+        cached = None
+    if cached is not None and not refresh:
+        ttl = current_app.config.get('GROUP_CACHE_TTL' if cached['is_member'] else 'GROUP_CACHE_NEGATIVE_TTL', 0)
+        if time.time() - cached['checked'] < ttl:
+            return cached['is_member']
+
+    try:
+        is_member = _query_group_membership()
+    except GlobusError:
+        if cached is None:
+            raise
+        age = time.time() - cached['checked']
+        limit = current_app.config.get('GROUP_CACHE_TTL', 0) + current_app.config.get('GROUP_CACHE_GRACE', 0)
+        return cached['is_member'] and age < limit
+
+    session['group_membership'] = {
+        'identity': session.get('primary_identity'),
+        'is_member': is_member,
+        'checked': time.time()
+    }
+    return is_member
+
+
+def _query_group_membership():
+    """Ask Globus whether the authenticated user is a member of the NUCAPT group
+
+    :return: bool, whether the user is an active member"""
+    nexus_client = client_pool.get_client('nexus')
     reply = nexus_client.list_groups(for_all_identities='true', my_roles=['admin', 'manager', 'member'])
 
     for group in reply.data:
@@ -1,20 +1,26 @@
 import os
 import shutil
 
-from flask import render_template, request, redirect, url_for, flash, session
-from globus_sdk.authorizers.refresh_token import RefreshTokenAuthorizer
-from globus_sdk.transfer.client import TransferClient
-from mdf_toolbox.toolbox import DataPublicationClient
+from flask import render_template, request, redirect, url_for, flash, session, jsonify, Response, \
+    stream_with_context
 from werkzeug.utils import secure_filename
-from mdf_toolbox import toolbox
 
 from nucapt import app
+from nucapt.clients import client_pool
+from nucapt.context import load_directory
 from nucapt.exceptions import DatasetParseException
+from nucapt.export import iter_json_lines, parse_time
+from nucapt.importer import BulkImport, parse_samples
 from nucapt.forms import DatasetForm, APTSampleForm, APTCollectionMethodForm, APTSampleDescriptionForm, \
     AddAPTReconstructionForm, APTSamplePreparationForm, PublicationForm, AnalysisForm
 from nucapt.manager import APTDataDirectory, APTSampleDirectory, APTReconstruction, APTAnalysisDirectory
 from nucapt.decorators import authenticated, check_if_published
-from nucapt.utils import load_portal_client, is_group_member
+from nucapt.preview import preview_generator
+from nucapt.publication import publication_runner, get_job
+from nucapt.state import remove_state
+from nucapt.uploads import ChunkedUpload, attach_staged_file, attach_staged_files, find_staged_file
+from nucapt.usage import load_usage
+from nucapt.utils import load_portal_client, is_group_member, get_safe_redirect
 
 
 @app.route("/")
@@ -49,7 +55,7 @@ def authcallback():
     # Set up our Globus Auth/OAuth2 state
     redirect_uri = url_for('authcallback', _external=True)
 
-    client = load_portal_client()
+    client = client_pool.create_portal_client()
     client.oauth2_start_flow(redirect_uri,
                              refresh_tokens=True,
                              requested_scopes=app.config['SCOPES'])
@@ -84,6 +90,16 @@ def authcallback():
         return redirect(url_for('index'))
 
 
+@app.route('/groups/refresh', methods=['GET'])
+def refresh_group_membership():
+    """Check again whether the user has joined the NUCAPT group, ignoring the cached answer"""
+    if not session.get('is_authenticated'):
+        return redirect(url_for('login', next=request.url))
+    if not app.config['DEBUG_SKIP_AUTH'] and not is_group_member(refresh=True):
+        return render_template('groups.html')
+    return redirect(get_safe_redirect())
+
+
 @authenticated
 @app.route('/logout', methods=['GET'])
 def logout():
@@ -107,6 +123,7 @@ def logout():
             token, additional_params={'token_type_hint': token_type})
 
     # Destroy the session state
+    client_pool.forget_user()
     session.clear()
 
     redirect_uri = url_for('index', _external=True)
@@ -147,7 +164,7 @@ def edit_dataset(dataset_name):
     navbar = [(dataset_name, '/dataset/%s' % dataset_name), ('Edit', '#')]
 
     try:
-        dataset = APTDataDirectory.load_dataset_by_name(dataset_name)
+        dataset = load_directory(APTDataDirectory, dataset_name)
     except (ValueError, AttributeError, DatasetParseException):
         return redirect("/dataset/" + dataset_name)
 
@@ -170,7 +187,7 @@ def display_dataset(dataset_name):
     """Display metadata about a certain dataset"""
     errors = []
     try:
-        dataset = APTDataDirectory.load_dataset_by_name(dataset_name)
+        dataset = load_directory(APTDataDirectory, dataset_name)
     except DatasetParseException as exc:
         dataset = None
         errors = exc.errors
@@ -180,7 +197,8 @@ def display_dataset(dataset_name):
     errors.extend(sample_errors)
     metadata = dataset.get_metadata()
     return render_template('dataset.html', name=dataset_name, dataset=dataset, samples=samples, errors=errors,
-                           metadata=metadata, navbar=[(dataset_name, '/dataset/%s' % dataset_name)])
+                           metadata=metadata, job=get_job(dataset),
+                           navbar=[(dataset_name, '/dataset/%s' % dataset_name)])
 
 
 @app.route("/dataset/<dataset_name>/publish", methods=['GET', 'POST'])
@@ -193,7 +211,7 @@ def publish_dataset(dataset_name):
 
     # Check that this is a good dataset
     try:
-        data = APTDataDirectory.load_dataset_by_name(dataset_name)
+        data = load_directory(APTDataDirectory, dataset_name)
     except (ValueError, AttributeError, DatasetParseException):
         return redirect("/dataset/" + dataset_name)
 
@@ -209,50 +227,9 @@ def publish_dataset(dataset_name):
             data.mark_as_published('DEBUG')
             return redirect('/dataset/' + dataset_name)
 
-        # Create the PublicationClient
-        globus_publish_client = DataPublicationClient(authorizer=
-        RefreshTokenAuthorizer(
-            session["tokens"]["publish.api.globus.org"]
-            ["refresh_token"], load_portal_client()))
-
-        # Create the transfer client
-        mdf_transfer_client = TransferClient(authorizer=
-                                             RefreshTokenAuthorizer(session["tokens"]["transfer.api.globus.org"]
-                                                                    ["refresh_token"], load_portal_client()))
-
-        # Create the publication entry
-        try:
-            md_result = globus_publish_client.push_metadata(app.config.get("PUBLISH_COLLECTION"),
-                                                            form.convert_to_globus_publication())
-            pub_endpoint = md_result['globus.shared_endpoint.name']
-            pub_path = os.path.join(md_result['globus.shared_endpoint.path'], "data") + "/"
-            submission_id = md_result["id"]
-        except Exception as e:
-            # TODO: Update status - not Published due to bad metadata
-            raise e
-
-        # Transfer data
-        try:
-            # '/' of the Globus endpoint for the working data is the working data path
-            data_path = '/%s/' % (os.path.relpath(data.path, app.config['WORKING_PATH']))
-            toolbox.quick_transfer(mdf_transfer_client, app.config["WORKING_DATA_ENDPOINT"],
-                                   pub_endpoint, [(data_path, pub_path)], timeout=0)
-        except Exception as e:
-            # TODO: Update status - not Published due to failed Transfer
-            raise e
-
-        # Send submission in for review
-        try:
-            globus_publish_client.complete_submission(submission_id)
-        except Exception as e:
-            # TODO: Raise exception - not Published due to Publish error
-            raise e
-
-        # Mark dataset as complete.
-        data.mark_as_published(submission_id)
-
-        # Redirect to Globus Publish webpage
-        return redirect("/dataset/" + dataset_name)
+        # Push the metadata, transfer the data, and complete the submission in the background
+        publication_runner.submit(data, form.convert_to_globus_publication(), session['tokens'])
+        return redirect("/dataset/%s/publish/status" % dataset_name)
     else:
         default_values = data.get_metadata().metadata
         default_values['contact_person'] = session.get('name')
@@ -262,15 +239,133 @@ def publish_dataset(dataset_name):
         return render_template("dataset_publish.html", data=data, form=form, navbar=navbar)
 
 
+@app.route("/dataset/<dataset_name>/publish/status")
+@authenticated
+def publication_status(dataset_name):
+    """Display the progress of publishing a dataset"""
+
+    navbar = [(dataset_name, '/dataset/%s' % dataset_name), ('Publication Status', '#')]
+
+    try:
+        data = load_directory(APTDataDirectory, dataset_name)
+    except DatasetParseException:
+        return redirect("/dataset/" + dataset_name)
+
+    return render_template("dataset_publish_status.html", data=data, job=get_job(data), navbar=navbar)
+
+
+@app.route("/dataset/<dataset_name>/publish/status.json")
+@authenticated
+def publication_status_json(dataset_name):
+    """Get the progress of publishing a dataset in JSON format"""
+
+    try:
+        data = load_directory(APTDataDirectory, dataset_name)
+    except DatasetParseException as exc:
+        return jsonify(errors=exc.errors), 404
+
+    job = get_job(data)
+    return jsonify(dataset=dataset_name, published=data.is_published(),
+                   job=job.state if job is not None else None)
+
+
 @app.route("/datasets")
 @authenticated
 def list_datasets():
-    """List all datasets currently stored at default data path"""
+    """List datasets currently stored at default data path
+
+    Query parameters:
+        - sort: str, field to sort by ('name', 'title', or 'created')
+        - order: str, 'asc' or 'desc'
+        - author: str, text found in the name of an author
+        - title: str, text found in the title
+        - published: str, 'yes' or 'no' to show only published or unpublished datasets
+        - page: int, page number
+        - per_page: int, number of datasets per page"""
+
+    # Parse the query
+    query = {
+        'sort': request.args.get('sort', 'name'),
+        'order': request.args.get('order', 'asc'),
+        'author': request.args.get('author', ''),
+        'title': request.args.get('title', ''),
+        'published': request.args.get('published', ''),
+        'per_page': request.args.get('per_page', app.config.get('DATASETS_PER_PAGE', 25), type=int)
+    }
+    if query['sort'] not in ['name', 'title', 'created']:
+        query['sort'] = 'name'
+    query['per_page'] = min(max(query['per_page'], 1), 500)
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    datasets, total = APTDataDirectory.query_datasets(sort=query['sort'], descending=query['order'] == 'desc',
+                                                      author=query['author'], title=query['title'],
+                                                      published={'yes': True, 'no': False}.get(query['published']),
+                                                      page=page, per_page=query['per_page'])
+    n_pages = max((total + query['per_page'] - 1) // query['per_page'], 1)
+    for info in datasets:
+        info['usage'] = load_usage(info['path'])
+    return render_template("dataset_list.html", datasets=datasets, total=total, page=page, n_pages=n_pages,
+                           query=query, navbar=[('List Datasets', '#')])
+
+
+@app.route("/usage.json")
+@authenticated
+def usage_json():
+    """Get the disk space used by each dataset, and by all datasets, in JSON format
 
-    dir_info = APTDataDirectory.get_all_datasets(app.config['WORKING_PATH'])
-    dir_valid = dict([(dir, isinstance(info, APTDataDirectory)) for dir, info in dir_info.items()])
-    return render_template("dataset_list.html", dir_info=dir_info, dir_valid=dir_valid,
-                           navbar=[('List Datasets', '#')])
+    Datasets whose usage has not been measured (see `nucapt rebuild-usage`) are listed with a usage of null"""
+
+    datasets = APTDataDirectory.get_all_usage()
+    total = {'size': 0, 'files': 0}
+    for usage in datasets.values():
+        if usage is not None:
+            total['size'] += usage['total']['size']
+            total['files'] += usage['total']['files']
+    return jsonify(datasets=datasets, total=total, unmeasured=sorted(k for k, v in datasets.items() if v is None))
+
+
+@app.route("/dataset/<dataset_name>/usage.json", defaults={'sample_name': None, 'recon_name': None})
+@app.route("/dataset/<dataset_name>/sample/<sample_name>/usage.json", defaults={'recon_name': None})
+@app.route("/dataset/<dataset_name>/sample/<sample_name>/recon/<recon_name>/usage.json")
+@authenticated
+def directory_usage_json(dataset_name, sample_name, recon_name):
+    """Get the disk space used by a dataset, sample, or reconstruction, and by each directory inside it"""
+
+    try:
+        if sample_name is None:
+            directory = load_directory(APTDataDirectory, dataset_name)
+        elif recon_name is None:
+            directory = load_directory(APTSampleDirectory, dataset_name, sample_name)
+        else:
+            directory = load_directory(APTReconstruction, dataset_name, sample_name, recon_name)
+    except DatasetParseException as exc:
+        return jsonify(errors=exc.errors), 404
+    usage = directory.get_usage()
+    if usage is None:
+        return jsonify(errors=['Disk usage has not been measured']), 404
+    return jsonify(usage)
+
+
+@app.route("/export")
+@authenticated
+def export():
+    """Stream the metadata of every dataset, sample, reconstruction, and analysis as JSON Lines
+
+    Query parameters:
+        - dataset: only export this dataset
+        - modified_since: only export directories changed after this time (UNIX timestamp or ISO 8601, in UTC)"""
+
+    modified_since = request.args.get('modified_since')
+    if modified_since is not None:
+        try:
+            modified_since = parse_time(modified_since)
+        except ValueError as exc:
+            return jsonify(errors=[str(exc)]), 400
+    try:
+        lines = iter_json_lines(request.args.get('dataset') or None, modified_since)
+    except DatasetParseException as exc:
+        return jsonify(errors=exc.errors), 404
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
 
 
 @app.route("/dataset/<dataset_name>/sample/create", methods=['GET', 'POST'])
@@ -283,7 +378,7 @@ def create_sample(dataset_name):
 
     # Load in the dataset
     try:
-        dataset = APTDataDirectory.load_dataset_by_name(dataset_name)
+        dataset = load_directory(APTDataDirectory, dataset_name)
     except DatasetParseException as exc:
         return redirect('/dataset/' + dataset_name)
 
@@ -291,16 +386,13 @@ def create_sample(dataset_name):
     if request.method == 'POST':
         form = APTSampleForm(request.form)
     else:
-        samples, errors = dataset.list_samples()
-
-        # Make a new name
-        new_metadata = {'sample_name': 'Sample%d' % (len(samples) + 1)}
-
-        if len(samples) > 0:
-            # Copy data from another sample
-            last_sample = sorted(samples, key=lambda x: x.name)[-1]
+        # Make a new name, which only requires counting the samples
+        n_samples = dataset.count_samples()
+        new_metadata = {'sample_name': 'Sample%d' % (n_samples + 1)}
 
-            # Loop over each subfield
+        last_sample = dataset.get_recent_sample()
+        if last_sample is not None:
+            # Copy each subfield from the most recently changed sample
             for n, m in zip(['sample_form', 'collection_form', 'preparation_form'],
                             [last_sample.load_sample_information(), last_sample.load_collection_metadata(),
                              last_sample.load_preparation_metadata()]):
@@ -312,25 +404,37 @@ def create_sample(dataset_name):
     if request.method == 'POST' and form.validate():
         # attempt to validate the metadata
         try:
+            if form.rhit_path.data:
+                find_staged_file(form.rhit_path.data, 'rhit')
             sample_name = APTSampleDirectory.create_sample(dataset_name, form)
         except DatasetParseException as err:
             return render_template('sample_create.html', form=form, name=dataset_name, errors=err.errors, navbar=navbar)
 
         # Crate the sample
-        sample = APTSampleDirectory.load_dataset_by_name(dataset_name, sample_name)
+        sample = load_directory(APTSampleDirectory, dataset_name, sample_name)
 
-        # If present, upload file
+        # If present, upload file or attach it from the staging area
         rhit_file = request.files.get('rhit_file', None)
-        if 'rhit_file' not in request.files or rhit_file.filename == "":
+        errors = []
+        if form.rhit_path.data:
+            try:
+                attach_staged_file(sample, form.rhit_path.data)
+            except DatasetParseException as err:
+                errors = err.errors
+        elif 'rhit_file' not in request.files or rhit_file.filename == "":
             pass  # Do nothing
         elif rhit_file.filename.lower().endswith('.rhit'):
             rhit_file.save(os.path.join(sample.path, secure_filename(rhit_file.filename)))
+            sample.record_changes()
         else:
+            errors = ['File must have extension RHIT']
+
+        if len(errors) > 0:
             # Clear the old sample
             shutil.rmtree(sample.path)
-            return render_template('sample_create.html', form=form, name=dataset_name,
-                                   errors=['File must have extension RHIT'],
-                                   navbar=navbar)
+            sample.record_changes()
+            remove_state(sample.path)
+            return render_template('sample_create.html', form=form, name=dataset_name, errors=errors, navbar=navbar)
 
         return redirect("/dataset/%s/sample/%s" % (dataset_name, sample_name))
 
@@ -347,13 +451,13 @@ def view_sample(dataset_name, sample_name):
 
     # Load in the sample by name
     try:
-        sample = APTSampleDirectory.load_dataset_by_name(dataset_name, sample_name)
+        sample = load_directory(APTSampleDirectory, dataset_name, sample_name)
     except DatasetParseException as exc:
         return render_template('sample.html', dataset_name=dataset_name, sample=sample, errors=exc.errors,
                                navbar=navbar)
 
     # Load in the dataset
-    is_published = APTDataDirectory.load_dataset_by_name(dataset_name).is_published()
+    is_published = load_directory(APTDataDirectory, dataset_name).is_published()
 
     # Load in the sample information
     sample_metadata = None
@@ -383,7 +487,7 @@ def edit_sample_information(dataset_name, sample_name):
 
     # Load in the sample by name
     try:
-        sample = APTSampleDirectory.load_dataset_by_name(dataset_name, sample_name)
+        sample = load_directory(APTSampleDirectory, dataset_name, sample_name)
     except DatasetParseException as exc:
         return redirect("/dataset/%s/sample/%s" % (dataset_name, sample_name))
 
@@ -404,7 +508,7 @@ def edit_collection_information(dataset_name, sample_name):
 
     # Load in the sample by name
     try:
-        sample = APTSampleDirectory.load_dataset_by_name(dataset_name, sample_name)
+        sample = load_directory(APTSampleDirectory, dataset_name, sample_name)
     except DatasetParseException as exc:
         return redirect("/dataset/%s/sample/%s" % (dataset_name, sample_name))
 
@@ -425,7 +529,7 @@ def edit_sample_preparation(dataset_name, sample_name):
 
     # Load in the sample by name
     try:
-        sample = APTSampleDirectory.load_dataset_by_name(dataset_name, sample_name)
+        sample = load_directory(APTSampleDirectory, dataset_name, sample_name)
     except DatasetParseException as exc:
         return redirect("/dataset/%s/sample/%s" % (dataset_name, sample_name))
 
@@ -496,7 +600,7 @@ def create_reconstruction(dataset_name, sample_name):
 
     # Make sure this sample exists
     try:
-        sample = APTSampleDirectory.load_dataset_by_name(dataset_name, sample_name)
+        sample = load_directory(APTSampleDirectory, dataset_name, sample_name)
     except DatasetParseException as exc:
         return redirect("/dataset/%s/sample/%s" % (dataset_name, sample_name))
 
@@ -504,25 +608,16 @@ def create_reconstruction(dataset_name, sample_name):
     if request.method == 'POST':
         form = AddAPTReconstructionForm(request.form)
     else:
-        # Load the existing reconstructions
-        recons, _, _ = sample.list_reconstructions()
+        # Count the existing reconstructions
+        n_recons = sample.count_reconstructions()
 
         # Populate the metadata
-        new_metadata = dict(name='Reconstruction%d'%(len(recons) + 1))
-
-        if len(recons) == 0:
-            # Try to find another sample
-            samples, _ = APTDataDirectory.load_dataset_by_name(dataset_name).list_samples()
-            for sample in sorted(samples, key=lambda x: x.name)[::-1]:
-                my_recons, _, _ = sample.list_reconstructions()
-                if len(my_recons) > 0:
-                    recons = my_recons
-                    break
-
-        # If you can find a reconstruction, prepopulate the form
-        if len(recons) > 0:
-            old_metadata = sorted(recons, key=lambda x: x.name)[-1].load_metadata()
-            new_metadata.update(old_metadata.metadata)
+        new_metadata = dict(name='Reconstruction%d'%(n_recons + 1))
+
+        # If there is a reconstruction in this dataset, prepopulate the form with the most recent one
+        last_recon = load_directory(APTDataDirectory, dataset_name).get_recent_reconstruction()
+        if last_recon is not None:
+            new_metadata.update(last_recon.load_metadata().metadata)
 
         # Create the form
         form = AddAPTReconstructionForm(**new_metadata)
@@ -532,14 +627,29 @@ def create_reconstruction(dataset_name, sample_name):
         try:
             errors = []
 
-            # check the files
-            pos_file = request.files['pos_file']
-            if not pos_file.filename.lower().endswith('.pos'):
-                errors.append('POS File must have the extension ".pos"')
-
-            rrng_file = request.files['rrng_file']
-            if not rrng_file.filename.lower().endswith('.rrng'):
-                errors.append('RRNG File must have extension ".rrng"')
+            # check the files, unless they will be sent later through the chunked upload API
+            #  or are attached from the staging area
+            chunked_upload = bool(request.form.get('chunked_upload'))
+            if not chunked_upload:
+                if form.pos_path.data:
+                    try:
+                        find_staged_file(form.pos_path.data, 'pos')
+                    except DatasetParseException as err:
+                        errors.extend(err.errors)
+                else:
+                    pos_file = request.files['pos_file']
+                    if not pos_file.filename.lower().endswith('.pos'):
+                        errors.append('POS File must have the extension ".pos"')
+
+                if form.rrng_path.data:
+                    try:
+                        find_staged_file(form.rrng_path.data, 'rrng')
+                    except DatasetParseException as err:
+                        errors.extend(err.errors)
+                else:
+                    rrng_file = request.files['rrng_file']
+                    if not rrng_file.filename.lower().endswith('.rrng'):
+                        errors.append('RRNG File must have extension ".rrng"')
 
             # Find if there is a tip image
             tip_image_path = None
@@ -557,13 +667,32 @@ def create_reconstruction(dataset_name, sample_name):
             return render_template('reconstruction_create.html', form=form, dataset_name=dataset_name,
                                    sample_name=sample_name, errors=errors + err.errors, navbar=navbar)
 
-        # If valid, upload the data
-        recon = APTReconstruction.load_dataset_by_name(dataset_name, sample_name, recon_name)
-        pos_file.save(os.path.join(recon.path, secure_filename(pos_file.filename)))
-        rrng_file.save(os.path.join(recon.path, secure_filename(rrng_file.filename)))
+        # If valid, upload the data or attach it from the staging area
+        recon = load_directory(APTReconstruction, dataset_name, sample_name, recon_name)
+        if not chunked_upload:
+            try:
+                # Attach the staged files first, which leaves none of them in place if any cannot be
+                staged = [p for p in [form.pos_path.data, form.rrng_path.data] if p]
+                staged = dict(zip(staged, attach_staged_files(recon, staged)))
+                if form.pos_path.data:
+                    pos_path = staged[form.pos_path.data]
+                else:
+                    pos_path = os.path.join(recon.path, secure_filename(pos_file.filename))
+                    pos_file.save(pos_path)
+                if not form.rrng_path.data:
+                    rrng_file.save(os.path.join(recon.path, secure_filename(rrng_file.filename)))
+            except DatasetParseException as err:
+                # Clear the new reconstruction, which now holds only files made by this request
+                shutil.rmtree(recon.path)
+                recon.record_changes()
+                remove_state(recon.path)
+                return render_template('reconstruction_create.html', form=form, dataset_name=dataset_name,
+                                       sample_name=sample_name, errors=err.errors, navbar=navbar)
+            preview_generator.request(pos_path)
         if 'tip_image' in request.files:
             tip_image = request.files['tip_image']
             tip_image.save(os.path.join(recon.path, 'tip_image.%s' % (tip_image.filename.split(".")[-1])))
+        recon.record_changes()
 
         return redirect("/dataset/%s/sample/%s/recon/%s" % (dataset_name, sample_name, recon_name))
 
@@ -571,6 +700,106 @@ def create_reconstruction(dataset_name, sample_name):
                            sample_name=sample_name, navbar=navbar)
 
 
+def _load_upload_target(dataset_name, sample_name, recon_name):
+    """Get the sample or reconstruction receiving an upload
+
+    :return: APTSampleDirectory or APTReconstruction"""
+    if recon_name is None:
+        return load_directory(APTSampleDirectory, dataset_name, sample_name)
+    return load_directory(APTReconstruction, dataset_name, sample_name, recon_name)
+
+
+@app.route("/dataset/<dataset_name>/sample/<sample_name>/uploads", methods=['POST'],
+           defaults={'recon_name': None})
+@app.route("/dataset/<dataset_name>/sample/<sample_name>/recon/<recon_name>/uploads", methods=['POST'])
+@authenticated
+@check_if_published
+def start_upload(dataset_name, sample_name, recon_name):
+    """Start uploading a RHIT (to a sample) or POS/RRNG file (to a reconstruction) in pieces
+
+    Expects a JSON object with the name ("filename") and size in bytes ("size") of the file.
+    Returns the ID of the upload, which is used to send the pieces"""
+
+    try:
+        target = _load_upload_target(dataset_name, sample_name, recon_name)
+        info = request.get_json(force=True)
+        upload = ChunkedUpload.start(target, info['filename'], int(info['size']))
+    except (KeyError, ValueError, TypeError):
+        return jsonify(errors=['Request must contain "filename" and "size"']), 400
+    except DatasetParseException as exc:
+        return jsonify(errors=exc.errors), 400
+    return jsonify(upload_id=upload.upload_id, **upload.state), 201
+
+
+@app.route("/dataset/<dataset_name>/sample/<sample_name>/uploads/<upload_id>",
+           methods=['GET', 'PUT', 'DELETE'], defaults={'recon_name': None})
+@app.route("/dataset/<dataset_name>/sample/<sample_name>/recon/<recon_name>/uploads/<upload_id>",
+           methods=['GET', 'PUT', 'DELETE'])
+@authenticated
+@check_if_published
+def continue_upload(dataset_name, sample_name, recon_name, upload_id):
+    """Get the progress of (GET), send the next piece of (PUT), or cancel (DELETE) an upload
+
+    Pieces are sent as the raw body of the PUT request, with their position in the file as the
+    "offset" query parameter and optionally their SHA-256 hash in the "X-Checksum-SHA256" header"""
+
+    try:
+        upload = ChunkedUpload.load(_load_upload_target(dataset_name, sample_name, recon_name), upload_id)
+        if request.method == 'PUT':
+            upload.write_chunk(request.args.get('offset', -1, type=int), request.stream,
+                               request.headers.get('X-Checksum-SHA256'), request.content_length)
+        elif request.method == 'DELETE':
+            upload.abort()
+    except DatasetParseException as exc:
+        return jsonify(errors=exc.errors), 400
+    return jsonify(upload_id=upload_id, **upload.state)
+
+
+@app.route("/dataset/<dataset_name>/sample/<sample_name>/uploads/<upload_id>/finalize", methods=['POST'],
+           defaults={'recon_name': None})
+@app.route("/dataset/<dataset_name>/sample/<sample_name>/recon/<recon_name>/uploads/<upload_id>/finalize",
+           methods=['POST'])
+@authenticated
+@check_if_published
+def finalize_upload(dataset_name, sample_name, recon_name, upload_id):
+    """Move a completely-uploaded file into place"""
+
+    try:
+        upload = ChunkedUpload.load(_load_upload_target(dataset_name, sample_name, recon_name), upload_id)
+        path = upload.finalize()
+    except DatasetParseException as exc:
+        return jsonify(errors=exc.errors), 400
+
+    # Start making the preview of new POS files
+    if path.lower().endswith('.pos'):
+        preview_generator.request(path)
+    return jsonify(path=path)
+
+
+@app.route("/dataset/<dataset_name>/import", methods=['POST'])
+@authenticated
+@check_if_published
+def import_samples(dataset_name):
+    """Create many samples and reconstructions from data files in the staging area
+
+    Expects a JSON object with the list of "samples" to import (see `nucapt.importer`), and optionally
+    "dry_run" to only check the import. Paths to data files are relative to the first staging path.
+    Returns a report of what was (or would be) created"""
+
+    staging_paths = app.config.get('STAGING_PATHS') or []
+    if len(staging_paths) == 0:
+        return jsonify(errors=['Importing from the server is not enabled']), 403
+    try:
+        info = request.get_json(force=True)
+        samples = parse_samples(info.get('samples'), staging_paths[0])
+        report = BulkImport(dataset_name, samples, allowed_paths=staging_paths).run(bool(info.get('dry_run')))
+    except (AttributeError, TypeError, ValueError):
+        return jsonify(errors=['Request must be a JSON object with a list of "samples"']), 400
+    except DatasetParseException as exc:
+        return jsonify(errors=exc.errors), 400
+    return jsonify(report)
+
+
 @app.route("/dataset/<dataset_name>/sample/<sample_name>/recon/<recon_name>")
 @authenticated
 def view_reconstruction(dataset_name, sample_name, recon_name):
@@ -581,13 +810,13 @@ def view_reconstruction(dataset_name, sample_name, recon_name):
     errors = []
     try:
         # Load in the recon
-        recon = APTReconstruction.load_dataset_by_name(dataset_name, sample_name, recon_name)
+        recon = load_directory(APTReconstruction, dataset_name, sample_name, recon_name)
         recon_metadata = recon.load_metadata()
     except DatasetParseException as exc:
         errors = exc.errors
 
     # Determine whether the dataset has been published
-    is_published = APTDataDirectory.load_dataset_by_name(dataset_name).is_published()
+    is_published = load_directory(APTDataDirectory, dataset_name).is_published()
 
     pos_path = None
     rrng_path = None
@@ -600,9 +829,87 @@ def view_reconstruction(dataset_name, sample_name, recon_name):
         errors.extend(exc.errors)
     except:
         raise
+
+    # Get the number of atoms, which only requires the size of the POS file
+    pos_info = None
+    if pos_path is not None:
+        try:
+            pos_info = {'atom_count': recon.load_pos_file().atom_count}
+        except DatasetParseException as exc:
+            pos_info = {'errors': exc.errors}
+        else:
+            # Start making the preview, if it has not been made already
+            pos_info['preview'] = preview_generator.request(pos_path)
     return render_template('reconstruction.html', dataset_name=dataset_name, sample_name=sample_name,
                            recon_name=recon_name, recon=recon, recon_metadata=recon_metadata, errors=errors,
-                           pos_path=pos_path, rrng_path=rrng_path, navbar=navbar, is_published=is_published)
+                           pos_path=pos_path, rrng_path=rrng_path, pos_info=pos_info, navbar=navbar,
+                           is_published=is_published)
+
+
+@app.route("/dataset/<dataset_name>/sample/<sample_name>/recon/<recon_name>/mass_spectrum.json")
+@authenticated
+def reconstruction_mass_spectrum(dataset_name, sample_name, recon_name):
+    """Get the mass spectrum of a reconstruction
+
+    The spectrum is computed in the background. Until it is ready, returns a 202 status and a JSON object
+    describing its status"""
+
+    try:
+        recon = load_directory(APTReconstruction, dataset_name, sample_name, recon_name)
+        pos_path = recon.get_pos_file()
+        status = preview_generator.request(pos_path, 'spectrum')
+    except DatasetParseException as exc:
+        return jsonify(errors=exc.errors), 400
+    if status == 'failed':
+        return jsonify(status=status, errors=[preview_generator.get_error(pos_path, 'spectrum')]), 400
+    if status == 'pending':
+        return jsonify(status=status), 202
+    return jsonify(recon.get_mass_spectrum().to_json())
+
+
+@app.route("/dataset/<dataset_name>/sample/<sample_name>/recon/<recon_name>/preview.bin")
+@authenticated
+def reconstruction_preview(dataset_name, sample_name, recon_name):
+    """Get a random sample of the atoms in a reconstruction
+
+    Returns the x, y, z, and m/z of each atom as little-endian float32 values. If the preview is not yet ready,
+    returns a 202 status and a JSON object describing its status"""
+
+    try:
+        recon = load_directory(APTReconstruction, dataset_name, sample_name, recon_name)
+        pos_path = recon.get_pos_file()
+        status = preview_generator.request(pos_path)
+    except DatasetParseException as exc:
+        return jsonify(errors=exc.errors), 400
+    if status == 'failed':
+        return jsonify(status=status, errors=[preview_generator.get_error(pos_path)]), 400
+    if status == 'pending':
+        return jsonify(status=status), 202
+
+    preview = recon.get_preview()
+    return Response(preview.to_bytes(), mimetype='application/octet-stream',
+                    headers={'X-Atom-Count': str(preview.atom_count)})
+
+
+@app.route("/dataset/<dataset_name>/sample/<sample_name>/recon/<recon_name>/composition.json")
+@authenticated
+def reconstruction_composition(dataset_name, sample_name, recon_name):
+    """Get the number of atoms of each ion and element in a reconstruction
+
+    The composition is computed in the background. Until it is ready, returns a 202 status and a JSON object
+    describing its status"""
+
+    try:
+        recon = load_directory(APTReconstruction, dataset_name, sample_name, recon_name)
+        pos_path = recon.get_pos_file()
+        status = preview_generator.request(pos_path, 'composition', recon.get_rrng_file())
+    except DatasetParseException as exc:
+        return jsonify(errors=exc.errors), 400
+    if status == 'failed':
+        return jsonify(status=status, errors=[preview_generator.get_error(pos_path, 'composition')]), 400
+    if status == 'pending':
+        return jsonify(status=status), 202
+    return jsonify(recon.get_composition())
 
 
 @app.route("/dataset/<dataset_name>/sample/<sample_name>/recon/<recon_name>/analysis/create",
@@ -618,7 +925,7 @@ def add_analysis_data(dataset_name, sample_name, recon_name):
     errors = []
     try:
         # Upload the data
-        recon = APTReconstruction.load_dataset_by_name(dataset_name, sample_name, recon_name)
+        recon = load_directory(APTReconstruction, dataset_name, sample_name, recon_name)
     except DatasetParseException as exc:
         flash('No such reconstruction!')
         return redirect('/dataset/%s/sample/%s' % (dataset_name, sample_name))
@@ -633,14 +940,16 @@ def add_analysis_data(dataset_name, sample_name, recon_name):
             analysis_name = APTAnalysisDirectory.create_analysis_directory(form, dataset_name, sample_name, recon_name)
 
             # Upload the data
-            analysis_name = APTAnalysisDirectory.load_dataset_by_name(dataset_name, sample_name, recon_name,
-                                                                      analysis_name)
-            files = request.files.getlist('files')
+            analysis_name = load_directory(APTAnalysisDirectory, dataset_name, sample_name, recon_name,
+                                           analysis_name)
+            files = [f for f in request.files.getlist('files') if f.filename]  # Browsers send empty inputs
             if len(files) > 0:
                 flash('Uploaded %d files:' % len(files) + " ".join([os.path.basename(x.filename) for x in files]),
                       category='success')
             for file in files:
                 file.save(os.path.join(analysis_name.path, secure_filename(file.filename)))
+            analysis_name.record_changes()
+            load_directory(APTDataDirectory, dataset_name).update_manifest(analysis_name)
 
             return redirect("/dataset/%s/sample/%s/recon/%s" % (dataset_name, sample_name, recon_name))
 
@@ -665,7 +974,7 @@ def edit_analysis_metadata(dataset_name, sample_name, recon_name, analysis_name)
     errors = []
     try:
         # Upload the data
-        analysis = APTAnalysisDirectory.load_dataset_by_name(dataset_name, sample_name, recon_name, analysis_name)
+        analysis = load_directory(APTAnalysisDirectory, dataset_name, sample_name, recon_name, analysis_name)
     except DatasetParseException as exc:
         flash('No such analysis!')
         return redirect('/dataset/%s/sample/%s/recon/%s' % (dataset_name, sample_name, recon_name))
@@ -686,12 +995,15 @@ def edit_analysis_metadata(dataset_name, sample_name, recon_name, analysis_name)
             analysis.update_metadata(form)
 
             # Upload new files
-            files = request.files.getlist('files')
+            files = [f for f in request.files.getlist('files') if f.filename]  # Browsers send empty inputs
             if len(files) > 0:
                 flash('Uploaded %d files:' % len(files) + " ".join([os.path.basename(x.filename) for x in files]),
                       category='success')
             for file in files:
                 file.save(os.path.join(analysis.path, secure_filename(file.filename)))
+            analysis.record_changes()
+            if len(files) > 0:
+                load_directory(APTDataDirectory, dataset_name).update_manifest(analysis)
 
             return redirect("/dataset/%s/sample/%s/recon/%s" % (dataset_name, sample_name, recon_name))
 
@@ -705,6 +1017,14 @@ def edit_analysis_metadata(dataset_name, sample_name, recon_name, analysis_name)
 @app.route("/dataset/<dataset_name>/sample/<sample_name>/recon/<recon_name>/analysis/<analysis_name>")
 @authenticated
 def view_analysis(dataset_name, sample_name, recon_name, analysis_name):
+    """View the metadata and files of an analysis
+
+    Query parameters:
+        - sort: str, field to sort the files by ('name', 'size', or 'modified')
+        - order: str, 'asc' or 'desc'
+        - page: int, page number of the file list
+        - per_page: int, number of files per page"""
+
     navbar = [(dataset_name, '/dataset/%s' % dataset_name),
               (sample_name, '/dataset/%s/sample/%s' % (dataset_name, sample_name)),
               (recon_name, '/dataset/%s/sample/%s/recon/%s' % (dataset_name, sample_name, recon_name)),
@@ -713,17 +1033,32 @@ def view_analysis(dataset_name, sample_name, recon_name, analysis_name):
     errors = []
     try:
         # Upload the data
-        analysis = APTAnalysisDirectory.load_dataset_by_name(dataset_name, sample_name, recon_name, analysis_name)
+        analysis = load_directory(APTAnalysisDirectory, dataset_name, sample_name, recon_name, analysis_name)
     except DatasetParseException as exc:
         flash('No such analysis!')
         return redirect('/dataset/%s/sample/%s/recon/%s' % (dataset_name, sample_name, recon_name))
 
     # Determine whether the dataset has been published
-    is_published = APTDataDirectory.load_dataset_by_name(dataset_name).is_published()
+    is_published = load_directory(APTDataDirectory, dataset_name).is_published()
 
     # Get the metadata
     analysis_metadata = analysis.load_metadata()
 
+    # Get the requested page of files
+    query = {
+        'sort': request.args.get('sort', 'name'),
+        'order': request.args.get('order', 'asc'),
+        'per_page': request.args.get('per_page', app.config.get('ANALYSIS_FILES_PER_PAGE', 100), type=int)
+    }
+    if query['sort'] not in ['name', 'size', 'modified']:
+        query['sort'] = 'name'
+    query['per_page'] = min(max(query['per_page'], 1), 1000)
+    page = max(request.args.get('page', 1, type=int), 1)
+    files, total = analysis.list_files(sort=query['sort'], descending=query['order'] == 'desc',
+                                       page=page, per_page=query['per_page'])
+    n_pages = max((total + query['per_page'] - 1) // query['per_page'], 1)
+
     return render_template('analysis.html', dataset_name=dataset_name, sample_name=sample_name,
                            recon_name=recon_name, analysis_name=analysis_name, analysis=analysis, errors=errors,
-                           analysis_metadata=analysis_metadata, navbar=navbar, is_published=is_published)
+                           analysis_metadata=analysis_metadata, navbar=navbar, is_published=is_published,
+                           files=files, total=total, page=page, n_pages=n_pages, query=query)
@@ -0,0 +1,5 @@
+"""WSGI entry point, for use with any WSGI server (e.g., ``gunicorn nucapt.wsgi``)"""
+
+from nucapt import app
+
+application = app
@@ -15,6 +15,14 @@ setup(
         'mdf_toolbox==0.1.2',
         'pyopenssl==17.5.0',
         'globus_nexus_client==0.2.6',
-        'flask_sslify==0.1.5'
+        'flask_sslify==0.1.5',
+        'numpy>=1.13',
+        'scandir==1.6;python_version<"3.5"'
     ],
+    extras_require={
+        'server': ['gunicorn==19.7.1']
+    },
+    entry_points={
+        'console_scripts': ['nucapt = nucapt.cli:main']
+    },
 )
@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import nucapt
+from nucapt import manager
+from nucapt.preview import preview_generator
+
+
+class WorkingDataTestCase(unittest.TestCase):
+    """Test case run in an empty working data directory, with the settings restored afterwards"""
+
+    def setUp(self):
+        self.config = dict(nucapt.app.config)
+        self.old_data_path = manager.data_path
+        manager.data_path = tempfile.mkdtemp()
+        nucapt.app.config['WORKING_PATH'] = manager.data_path
+
+    def tearDown(self):
+        # Previews are made in the background, and may still be reading the data files
+        preview_generator.join()
+        shutil.rmtree(manager.data_path)
+        manager.data_path = self.old_data_path
+        nucapt.app.config.update(self.config)
+
+    def write_file(self, path, content):
+        """Write a file in the working data directory, making any directories above it
+
+        :param path: str, path relative to the working data directory
+        :param content: str, contents of the file
+        :return: str, full path to the file"""
+        path = os.path.join(manager.data_path, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(content)
+        return path
@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+
+import nucapt
+from nucapt import manager
+from nucapt.catalog import get_catalog
+from nucapt.manager import APTDataDirectory, APTSampleDirectory
+from tests import test_website
+
+
+class TestWebsiteWithCatalog(test_website.TestWebsite):
+    """Run the website tests with the catalog enabled"""
+
+    def setUp(self):
+        super(TestWebsiteWithCatalog, self).setUp()
+        self.catalog_dir = tempfile.mkdtemp()
+        nucapt.app.config['CATALOG_PATH'] = os.path.join(self.catalog_dir, 'catalog.db')
+
+    def tearDown(self):
+        super(TestWebsiteWithCatalog, self).tearDown()
+        nucapt.app.config['CATALOG_PATH'] = None
+        shutil.rmtree(self.catalog_dir)
+
+    def test_catalog(self):
+        # Make a dataset with a sample and reconstruction
+        _, _, dataset_name = self.create_dataset()
+        self.create_sample(dataset_name)
+        self.create_reconstruction(dataset_name, 'Sample1')
+
+        catalog = get_catalog()
+        dataset = APTDataDirectory.load_dataset_by_name(dataset_name)
+        sample = APTSampleDirectory.load_dataset_by_name(dataset_name, 'Sample1')
+        self.assertEqual([sample.path], [s.path for s in dataset.list_samples()[0]])
+        self.assertIn('EXAMPLE.RHIT', [f[0] for f in catalog.list_files(sample.path)])
+
+        # Directories not made through the service are invisible until the catalog is rebuilt
+        os.mkdir(os.path.join(sample.path, 'Recon2'))
+        shutil.copy(os.path.join(sample.path, 'Recon1', 'ReconstructionMetadata.yaml'),
+                    os.path.join(sample.path, 'Recon2'))
+        self.assertEqual(1, len(sample.list_reconstructions()[0]))
+
+        self.assertEqual(4, manager.rebuild_catalog())
+        recons, metadata, errors = sample.list_reconstructions()
+        self.assertEqual(['Recon1', 'Recon2'], [r.recon_name for r in recons])
+        self.assertEqual('Example reconstruction', metadata[1]['title'])
+        self.assertEqual([], errors)
+
+        # Removing a directory removes everything below it
+        shutil.rmtree(sample.path)
+        sample.record_changes()
+        self.assertEqual([], catalog.list_children(sample.path, 'reconstruction'))
+        self.assertEqual([], dataset.list_samples()[0])
@@ -0,0 +1,39 @@
+import os
+import unittest
+
+import nucapt
+from nucapt import manager
+from nucapt.context import load_directory
+from nucapt.exceptions import DatasetParseException
+from nucapt.manager import APTDataDirectory, APTSampleDirectory
+from tests.helpers import WorkingDataTestCase
+
+
+class TestContext(WorkingDataTestCase):
+    def setUp(self):
+        super(TestContext, self).setUp()
+        os.makedirs(os.path.join(manager.data_path, 'dataset', 'sample'))
+
+    def test_load_directory(self):
+        # Each directory is loaded once per request
+        with nucapt.app.test_request_context():
+            dataset = load_directory(APTDataDirectory, 'dataset')
+            self.assertIs(dataset, load_directory(APTDataDirectory, 'dataset'))
+            sample = load_directory(APTSampleDirectory, 'dataset', 'sample')
+            self.assertEqual('sample', sample.sample_name)
+            self.assertIs(sample, load_directory(APTSampleDirectory, 'dataset', 'sample'))
+
+            # Failures are not stored
+            with self.assertRaises(DatasetParseException):
+                load_directory(APTDataDirectory, 'new')
+            os.mkdir(os.path.join(manager.data_path, 'new'))
+            self.assertEqual('new', load_directory(APTDataDirectory, 'new').name)
+
+        # Other requests, and code outside of requests, get new copies
+        with nucapt.app.test_request_context():
+            self.assertIsNot(dataset, load_directory(APTDataDirectory, 'dataset'))
+        self.assertIsNot(load_directory(APTDataDirectory, 'dataset'), load_directory(APTDataDirectory, 'dataset'))
+
+
+if __name__ == '__main__':
+    unittest.main()
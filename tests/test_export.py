@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+import time
+import unittest
+
+import nucapt
+from nucapt import manager
+from nucapt.exceptions import DatasetParseException
+from nucapt.export import iter_records, iter_json_lines, parse_time, format_time
+from nucapt.state import get_state_path
+from tests.helpers import WorkingDataTestCase
+
+
+class TestExport(WorkingDataTestCase):
+    def setUp(self):
+        super(TestExport, self).setUp()
+        self.write_file(os.path.join('dataset', 'GeneralMetadata.yaml'), 'title: Test\n')
+        self.write_file(os.path.join('dataset', 'Sample1', 'SampleInformation.yaml'), 'sample_name: Sample1\n')
+        self.write_file(os.path.join('dataset', 'Sample1', 'Recon1', 'ReconstructionMetadata.yaml'), 'title: R\n')
+        self.write_file(os.path.join('dataset', 'Sample1', 'Recon1', 'data.pos'), 'x' * 16)
+        self.write_file(os.path.join('dataset', 'Sample1', 'Recon1', 'analysis', 'AnalysisMetadata.yaml'),
+                        'name: Analysis\n')
+        self.write_file(os.path.join('dataset', 'Sample2', 'SampleInformation.yaml'), ': - bad yaml')
+        self.write_file(os.path.join('other', 'GeneralMetadata.yaml'), 'title: Other\n')
+
+    def set_mtime(self, path, mtime):
+        for root, dirs, files in os.walk(os.path.join(manager.data_path, path)):
+            for name in files + ['.']:
+                os.utime(os.path.join(root, name), (mtime, mtime))
+
+    def test_times(self):
+        self.assertEqual(1514764800, parse_time('1514764800'))
+        self.assertEqual(1514764800, parse_time('2018-01-01'))
+        self.assertEqual(1514808000.5, parse_time('2018-01-01T12:00:00.5Z'))
+        self.assertEqual(1514808000.5, parse_time(format_time(1514808000.5)))
+        with self.assertRaises(ValueError):
+            parse_time('yesterday')
+
+    def test_records(self):
+        records = list(iter_records())
+        self.assertEqual(['dataset', 'dataset/Sample1', 'dataset/Sample1/Recon1', 'dataset/Sample1/Recon1/analysis',
+                          'dataset/Sample2', 'other'], [r['path'] for r in records])
+        self.assertEqual(['dataset', 'sample', 'reconstruction', 'analysis', 'sample', 'dataset'],
+                         [r['kind'] for r in records])
+
+        # Records hold names, metadata, and files
+        recon = records[2]
+        self.assertEqual(('dataset', 'Sample1', 'Recon1'), (recon['dataset'], recon['sample'], recon['reconstruction']))
+        self.assertEqual({'ReconstructionMetadata.yaml': {'title': 'R'}}, recon['metadata'])
+        self.assertEqual(['ReconstructionMetadata.yaml', 'data.pos'], [f['name'] for f in recon['files']])
+        self.assertEqual(16, recon['files'][1]['size'])
+        self.assertEqual('analysis', records[3]['analysis'])
+
+        # Problems with the metadata are reported, rather than stopping the export
+        self.assertIsNone(records[4]['metadata']['SampleInformation.yaml'])
+        self.assertGreater(len(records[4]['errors']), 0)
+
+        # Export only one dataset
+        self.assertEqual(['other'], [r['path'] for r in iter_records('other')])
+        for name in ['missing', '..', os.path.join('dataset', 'Sample1')]:
+            with self.assertRaises(DatasetParseException):
+                iter_records(name)
+
+    def test_modified_since(self):
+        self.set_mtime('', time.time() - 3600)
+        since = time.time() - 60
+        self.assertEqual([], list(iter_records(modified_since=since)))
+
+        # Changes to the records kept by the service do not count
+        with open(get_state_path(os.path.join(manager.data_path, 'dataset'), '.Usage.yaml'), 'w') as fp:
+            fp.write('total: {}\n')
+        self.assertEqual([], list(iter_records(modified_since=since)))
+
+        # Directories inside an unchanged directory are still exported
+        self.write_file(os.path.join('dataset', 'Sample1', 'Recon1', 'data.rrng'), 'range')
+        self.assertEqual(['dataset/Sample1/Recon1'], [r['path'] for r in iter_records(modified_since=since)])
+
+        # Deleting files or directories counts as a change
+        self.set_mtime('', time.time() - 3600)
+        os.unlink(os.path.join(manager.data_path, 'dataset', 'Sample1', 'Recon1', 'data.pos'))
+        self.assertEqual(['dataset/Sample1/Recon1'], [r['path'] for r in iter_records(modified_since=since)])
+        shutil.rmtree(os.path.join(manager.data_path, 'dataset', 'Sample1', 'Recon1', 'analysis'))
+        self.assertEqual(['dataset/Sample1/Recon1'], [r['path'] for r in iter_records(modified_since=since)])
+
+    def test_json_lines(self):
+        lines = list(iter_json_lines('dataset'))
+        self.assertEqual(5, len(lines))
+        self.assertTrue(all(line.endswith('\n') for line in lines))
+        self.assertEqual('dataset', json.loads(lines[0])['path'])
+
+    def test_endpoint(self):
+        nucapt.app.testing = True
+        nucapt.app.config['DEBUG_SKIP_AUTH'] = True
+        app = nucapt.app.test_client()
+        with app.session_transaction() as sess:
+            sess['is_authenticated'] = True
+
+        rv = app.get('/export?dataset=dataset')
+        self.assertEqual(200, rv.status_code)
+        self.assertEqual('application/x-ndjson', rv.mimetype)
+        records = [json.loads(line) for line in rv.data.decode().splitlines()]
+        self.assertEqual(5, len(records))
+
+        rv = app.get('/export?modified_since=%f' % (time.time() + 60))
+        self.assertEqual(b'', rv.data)
+        self.assertEqual(400, app.get('/export?modified_since=never').status_code)
+        self.assertEqual(404, app.get('/export?dataset=missing').status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import yaml
+
+import nucapt
+from nucapt import manager
+from nucapt.exceptions import DatasetParseException
+from nucapt.importer import BulkImport, load_import_manifest, import_samples
+from nucapt.manager import APTSampleDirectory, APTReconstruction
+from nucapt.placement import place_file
+from tests.helpers import WorkingDataTestCase
+
+
+class TestImport(WorkingDataTestCase):
+    def setUp(self):
+        super(TestImport, self).setUp()
+        self.write_file(os.path.join('dataset', 'GeneralMetadata.yaml'), 'title: Test\n')
+
+        # Make the instrument output
+        self.source = tempfile.mkdtemp()
+        for name in ['Tip1.RHIT', 'Tip1_R1.pos', 'Tip1_R2.pos', 'Tip2_R1.pos', 'ranges.rrng']:
+            with open(os.path.join(self.source, name), 'wb') as fp:
+                fp.write(b'\x00' * 32)
+
+    def tearDown(self):
+        super(TestImport, self).tearDown()
+        shutil.rmtree(self.source)
+
+    def write_manifest(self, name, content):
+        path = os.path.join(self.source, name)
+        with open(path, 'w') as fp:
+            fp.write(content)
+        return path
+
+    def make_yaml(self, samples):
+        return self.write_manifest('manifest.yaml', yaml.safe_dump({'samples': samples}))
+
+    def get_samples(self):
+        return [
+            {'sample_name': 'Tip1', 'rhit_file': 'Tip1.RHIT',
+             'sample_form': {'sample_title': 'Steel'},
+             'collection_form': {'leap_model': '4000X', 'evaporation_mode': 'laser', 'temperature': 50},
+             'preparation_form': {'preparation_method': 'fib_lift_out'},
+             'reconstructions': [
+                 {'name': 'Recon1', 'title': 'First', 'pos_file': 'Tip1_R1.pos', 'rrng_file': 'ranges.rrng',
+                  'shank_angle': 10},
+                 {'name': 'Recon2', 'pos_file': 'Tip1_R2.pos', 'rrng_file': 'ranges.rrng'}]},
+            {'sample_name': 'Tip2',
+             'reconstructions': [{'name': 'Recon1', 'pos_file': 'Tip2_R1.pos', 'rrng_file': 'ranges.rrng'}]}
+        ]
+
+    def test_yaml(self):
+        path = self.make_yaml(self.get_samples())
+
+        # Data files must be in the staging area, unless any path is allowed
+        with self.assertRaises(DatasetParseException) as exc:
+            import_samples('dataset', path, dry_run=True)
+        self.assertEqual(7, len(exc.exception.errors))
+        self.assertEqual(7, len(import_samples('dataset', path, dry_run=True, allow_any_path=True)['files']))
+        nucapt.app.config['STAGING_PATHS'] = [self.source]
+
+        # Dry runs make no changes
+        report = import_samples('dataset', path, dry_run=True)
+        self.assertEqual(['Tip1', 'Tip2'], report['samples'])
+        self.assertEqual(['Tip1/Recon1', 'Tip1/Recon2', 'Tip2/Recon1'], report['reconstructions'])
+        self.assertEqual(os.path.join('Tip1', 'Tip1.RHIT'), report['files'][0]['destination'])
+        self.assertEqual(7, len(report['files']))
+        self.assertEqual(['GeneralMetadata.yaml'], os.listdir(os.path.join(manager.data_path, 'dataset')))
+
+        # Make the samples
+        report = import_samples('dataset', path)
+        self.assertEqual(7, len(report['files']))
+        self.assertTrue(all(f['method'] is not None for f in report['files']))
+        sample = APTSampleDirectory.load_dataset_by_name('dataset', 'Tip1')
+        self.assertEqual('Steel', sample.load_sample_information()['sample_title'])
+        self.assertEqual(50, sample.load_collection_metadata()['temperature'])
+        self.assertEqual('fib_lift_out', sample.load_preparation_metadata()['preparation_method'])
+        self.assertIsNotNone(sample.get_rhit_path())
+        recon = APTReconstruction.load_dataset_by_name('dataset', 'Tip1', 'Recon1')
+        self.assertEqual('First', recon.load_metadata()['title'])
+        self.assertEqual(10, recon.load_metadata()['shank_angle'])
+        self.assertTrue(os.path.isfile(recon.get_pos_file()))
+        self.assertEqual(32, os.path.getsize(recon.get_rrng_file()))
+
+        # Samples cannot be imported twice
+        with self.assertRaises(DatasetParseException) as exc:
+            import_samples('dataset', path)
+        self.assertIn('Sample Tip1 already exists for dataset dataset', exc.exception.errors)
+
+    def test_csv(self):
+        path = self.write_manifest('manifest.csv', '\n'.join([
+            'sample_name,rhit_file,sample_form-sample_title,recon-name,recon-pos_file,recon-rrng_file,recon-title',
+            'Tip1,Tip1.RHIT,Steel,Recon1,Tip1_R1.pos,ranges.rrng,First',
+            'Tip1,,,Recon2,Tip1_R2.pos,ranges.rrng,',
+            'Tip2,,Other,,,,',
+        ]))
+        samples = load_import_manifest(path)
+        self.assertEqual(2, len(samples))
+        self.assertEqual('Steel', samples[0]['fields']['sample_form-sample_title'])
+        self.assertEqual(os.path.join(self.source, 'Tip1.RHIT'), samples[0]['rhit_file'])
+        self.assertEqual(['Recon1', 'Recon2'], [r['fields']['name'] for r in samples[0]['reconstructions']])
+        self.assertEqual([], samples[1]['reconstructions'])
+
+        report = BulkImport('dataset', samples).run()
+        self.assertEqual(['Tip1/Recon1', 'Tip1/Recon2'], report['reconstructions'])
+        self.assertEqual('Other',
+                         APTSampleDirectory.load_dataset_by_name('dataset', 'Tip2').load_sample_information()[
+                             'sample_title'])
+
+    def test_validation(self):
+        samples = self.get_samples()
+        samples[0]['collection_form']['evaporation_mode'] = 'magic'
+        samples[0]['reconstructions'][0]['pos_file'] = 'missing.pos'
+        del samples[0]['reconstructions'][1]['rrng_file']
+        samples[1]['sample_name'] = 'Tip 2'
+        samples.append({'sample_name': 'Tip1'})
+        errors = BulkImport('dataset', load_import_manifest(self.make_yaml(samples))).validate()
+        self.assertEqual(5, len(errors))
+        self.assertTrue(any(e.startswith('Tip1: collection_form-evaporation_mode') for e in errors))
+        self.assertIn('Tip1/Recon2: rrng_file is required', errors)
+        self.assertIn('Sample Tip1 is listed more than once', errors)
+
+        # Files must be in the allowed directories
+        samples = load_import_manifest(self.make_yaml(self.get_samples()))
+        errors = BulkImport('dataset', samples, allowed_paths=[manager.data_path]).validate()
+        self.assertEqual(7, len(errors))
+        self.assertEqual([], BulkImport('dataset', samples, allowed_paths=[self.source]).validate())
+        self.assertEqual(['No such path: %s' % os.path.join(manager.data_path, 'missing')],
+                         BulkImport('missing', samples).validate())
+
+    def test_rollback(self):
+        # Fail to place any of the files
+        importer = BulkImport('dataset', load_import_manifest(self.make_yaml(self.get_samples())))
+        methods = nucapt.app.config['FILE_PLACEMENT_METHODS']
+        nucapt.app.config['FILE_PLACEMENT_METHODS'] = []
+        try:
+            with self.assertRaises(DatasetParseException) as exc:
+                importer.run()
+        finally:
+            nucapt.app.config['FILE_PLACEMENT_METHODS'] = methods
+        self.assertEqual(7, len([e for e in exc.exception.errors if e.startswith('Could not place')]))
+
+        # Nothing is left behind
+        self.assertEqual(['GeneralMetadata.yaml'],
+                         [f for f in os.listdir(os.path.join(manager.data_path, 'dataset')) if not f.startswith('.')])
+
+    def test_place_file(self):
+        source = os.path.join(self.source, 'Tip1.RHIT')
+        target = os.path.join(manager.data_path, 'copy.RHIT')
+        self.assertIn(place_file(source, target), ['reflink', 'copy'])
+        self.assertNotEqual(os.stat(source).st_ino, os.stat(target).st_ino)  # Not hard linked unless requested
+        with self.assertRaises(DatasetParseException):
+            place_file(source, target)
+        self.assertEqual('copy', place_file(source, os.path.join(manager.data_path, 'other.RHIT'), ['copy']))
+        self.assertEqual(32, os.path.getsize(os.path.join(manager.data_path, 'other.RHIT')))
+
+    def test_endpoint(self):
+        nucapt.app.testing = True
+        nucapt.app.config['DEBUG_SKIP_AUTH'] = True
+        app = nucapt.app.test_client()
+        with app.session_transaction() as sess:
+            sess['is_authenticated'] = True
+
+        body = {'samples': self.get_samples(), 'dry_run': True}
+        self.assertEqual(403, app.post('/dataset/dataset/import', json=body).status_code)
+        nucapt.app.config['STAGING_PATHS'] = [self.source]
+        try:
+            rv = app.post('/dataset/dataset/import', json=body)
+            self.assertEqual(200, rv.status_code)
+            self.assertTrue(rv.get_json()['dry_run'])
+            rv = app.post('/dataset/dataset/import', json={'samples': 'Tip1'})
+            self.assertEqual(400, rv.status_code)
+        finally:
+            nucapt.app.config['STAGING_PATHS'] = []
+
+
+if __name__ == '__main__':
+    unittest.main()
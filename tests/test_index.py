@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import nucapt
+from nucapt.index import MetadataIndex
+from nucapt.metadata import GeneralMetadata
+
+
+class TestMetadataIndex(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.index = MetadataIndex(max_size=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_metadata(self, name, title):
+        path = os.path.join(self.path, name)
+        GeneralMetadata(title=title).to_yaml(path)
+        return path
+
+    def test_load(self):
+        path = self.write_metadata('a.yaml', 'First')
+
+        # Second read should come from memory
+        self.assertEqual('First', self.index.load(GeneralMetadata, path)['title'])
+        self.assertEqual('First', self.index.load(GeneralMetadata, path)['title'])
+        self.assertEqual((1, 1), (self.index.misses, self.index.hits))
+
+        # Changes to the returned object must not leak into the index
+        self.index.load(GeneralMetadata, path)['title'] = 'Changed'
+        self.assertEqual('First', self.index.load(GeneralMetadata, path)['title'])
+
+        # Changing the file (size and mtime) should force a re-read
+        with open(path, 'w') as fp:
+            fp.write('title: A longer title\n')
+        os.utime(path, (0, 0))
+        self.assertEqual('A longer title', self.index.load(GeneralMetadata, path)['title'])
+        self.assertEqual(2, self.index.misses)
+
+    def test_eviction(self):
+        paths = [self.write_metadata('%d.yaml' % i, str(i)) for i in range(3)]
+        for path in paths:
+            self.index.load(GeneralMetadata, path)
+        self.assertEqual(2, len(self.index))
+
+        # Oldest entry should have been evicted
+        self.index.load(GeneralMetadata, paths[0])
+        self.assertEqual(4, self.index.misses)
+
+    def test_request_scope(self):
+        path = self.write_metadata('a.yaml', 'First')
+
+        # Within a request, the file is only checked once
+        with nucapt.app.test_request_context():
+            self.assertEqual('First', self.index.load(GeneralMetadata, path)['title'])
+            with open(path, 'w') as fp:
+                fp.write('title: A longer title\n')
+            self.assertEqual('First', self.index.load(GeneralMetadata, path)['title'])
+
+            # Invalidating the file, as writes through the metadata classes do, makes it be read again
+            GeneralMetadata(title='Second').to_yaml(path)
+            self.index.invalidate(path)
+            self.assertEqual('Second', self.index.load(GeneralMetadata, path)['title'])
+
+        # Other requests check the file again
+        with open(path, 'w') as fp:
+            fp.write('title: A longer title\n')
+        with nucapt.app.test_request_context():
+            self.assertEqual('A longer title', self.index.load(GeneralMetadata, path)['title'])
+
+
+if __name__ == '__main__':
+    unittest.main()
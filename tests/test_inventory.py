@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from nucapt.inventory import FileInventory
+
+
+class TestFileInventory(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.inventory = FileInventory(max_size=2)
+        self.inventory.racy_period = -1  # Cache listings of directories modified just now
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_file(self, name, size):
+        with open(os.path.join(self.path, name), 'wb') as fp:
+            fp.write(b'0' * size)
+
+    def test_list_files(self):
+        self.write_file('b.csv', 10)
+        self.write_file('a.png', 5)
+        self.write_file('.lock', 0)
+        os.mkdir(os.path.join(self.path, 'subdir'))
+
+        # Hidden files and directories are skipped
+        files = self.inventory.list_files(self.path)
+        self.assertEqual([('a.png', 5), ('b.csv', 10)], [f[:2] for f in files])
+
+        # Second listing comes from memory
+        self.assertIs(files, self.inventory.list_files(self.path))
+        self.assertEqual((1, 1), (self.inventory.misses, self.inventory.hits))
+
+        # Adding a file changes the modification time of the directory
+        self.write_file('c.dat', 1)
+        os.utime(self.path, (0, 0))
+        self.assertEqual(['a.png', 'b.csv', 'c.dat'], [f[0] for f in self.inventory.list_files(self.path)])
+
+        # Rewriting a file in place requires invalidating the directory
+        self.write_file('c.dat', 3)
+        self.assertEqual(1, self.inventory.list_files(self.path)[2][1])
+        self.inventory.invalidate(self.path)
+        self.assertEqual(3, self.inventory.list_files(self.path)[2][1])
+
+    def test_racy_directory(self):
+        self.inventory.racy_period = 60
+        self.write_file('a.png', 5)
+        self.inventory.list_files(self.path)
+        self.assertEqual(0, len(self.inventory))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+from nucapt import locking, manager
+from nucapt.locking import atomic_write, directory_lock, fcntl, lock_name
+from nucapt.state import get_state_path
+from tests.helpers import WorkingDataTestCase
+
+
+class TestLocking(WorkingDataTestCase):
+    def setUp(self):
+        super(TestLocking, self).setUp()
+        self.path = manager.data_path
+
+    def test_atomic_write(self):
+        path = os.path.join(self.path, 'file.yaml')
+        with atomic_write(path) as fp:
+            fp.write('first')
+
+        # A failed write leaves the old contents, and no temporary files
+        with self.assertRaises(ValueError):
+            with atomic_write(path) as fp:
+                fp.write('second')
+                raise ValueError()
+        with open(path) as fp:
+            self.assertEqual('first', fp.read())
+        self.assertEqual(['file.yaml'], os.listdir(self.path))
+
+        # The temporary file is hidden, and not named like the destination
+        with atomic_write(os.path.join(self.path, 'data.pos'), 'wb') as fp:
+            temp_names = [name for name in os.listdir(self.path) if name != 'file.yaml']
+            self.assertEqual(1, len(temp_names))
+            self.assertTrue(temp_names[0].startswith('.'))
+            self.assertNotIn('.pos', temp_names[0])
+
+        with atomic_write(path, 'wb') as fp:
+            fp.write(b'third')
+        with open(path) as fp:
+            self.assertEqual('third', fp.read())
+
+    def test_threads(self):
+        path = os.path.join(self.path, 'count')
+        with open(path, 'w') as fp:
+            fp.write('0')
+
+        # Read-modify-write cycles from many threads should not lose updates
+        def increment():
+            for _ in range(5):
+                with directory_lock(self.path):
+                    with directory_lock(self.path):  # Re-entering is allowed
+                        with open(path) as fp:
+                            count = int(fp.read())
+                    time.sleep(0.001)
+                    with atomic_write(path) as fp:
+                        fp.write(str(count + 1))
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with open(path) as fp:
+            self.assertEqual('20', fp.read())
+
+    def test_locks_released(self):
+        for name in ['a', 'b', 'c']:
+            with directory_lock(os.path.join(self.path, name)):
+                self.assertIn(get_state_path(os.path.join(self.path, name), lock_name), locking._process_locks)
+        self.assertEqual(0, len(locking._process_locks))  # Not kept once no thread needs them
+
+    @unittest.skipIf(fcntl is None, 'Locks between processes are not supported on this platform')
+    def test_processes(self):
+        code = 'import fcntl, sys; fp = open(sys.argv[1], "a"); fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)'
+        lock_path = get_state_path(self.path, lock_name)
+        with directory_lock(self.path):
+            self.assertNotEqual(0, subprocess.call([sys.executable, '-c', code, lock_path], stderr=subprocess.PIPE))
+        self.assertEqual(0, subprocess.call([sys.executable, '-c', code, lock_path]))
+
+
+if __name__ == '__main__':
+    unittest.main()
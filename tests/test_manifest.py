@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from nucapt.manifest import hash_file, load_manifest, manifest_name, update_manifest
+
+_empty_hash = 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.path, *name.split('/'))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as fp:
+            fp.write(content)
+        return path
+
+    def test_hash(self):
+        self.assertEqual(_empty_hash, hash_file(self.write_file('empty', b'')))
+        path = self.write_file('data', b'0123456789')
+        self.assertEqual(hash_file(path), hash_file(path, block_size=3))
+
+    def test_update(self):
+        self.write_file('GeneralMetadata.yaml', b'title: x')
+        self.write_file('Sample1/data.rhit', b'rhit')
+        self.write_file('Sample1/Recon1/data.pos', b'')
+        self.write_file('Sample1/Recon1/.Preview.npz', b'cache')
+
+        manifest = update_manifest(self.path, workers=2)
+        self.assertEqual(['GeneralMetadata.yaml', 'Sample1/Recon1/data.pos', 'Sample1/data.rhit'], sorted(manifest))
+        self.assertEqual(_empty_hash, manifest['Sample1/Recon1/data.pos']['sha256'])
+        self.assertEqual(4, manifest['Sample1/data.rhit']['size'])
+        self.assertEqual(manifest, load_manifest(self.path))
+
+        # Unchanged files are not re-hashed
+        manifest_path = os.path.join(self.path, manifest_name)
+        os.utime(manifest_path, (0, 0))
+        self.assertEqual(manifest, update_manifest(self.path))
+        self.assertEqual(0, os.path.getmtime(manifest_path))
+
+        # Changed files are, and deleted files are removed
+        path = self.write_file('Sample1/data.rhit', b'new rhit')
+        os.utime(path, (1, 1))
+        os.unlink(os.path.join(self.path, 'GeneralMetadata.yaml'))
+        manifest = update_manifest(self.path)
+        self.assertEqual(hash_file(path), manifest['Sample1/data.rhit']['sha256'])
+        self.assertNotIn('GeneralMetadata.yaml', manifest)
+        self.assertEqual(manifest, load_manifest(self.path))
+
+        # Checking one directory leaves the entries of the other files alone
+        self.write_file('GeneralMetadata.yaml', b'title: y')
+        self.write_file('Sample1/Recon1/new.dat', b'new')
+        os.unlink(os.path.join(self.path, 'Sample1', 'data.rhit'))
+        manifest = update_manifest(self.path, subpath=os.path.join('Sample1', 'Recon1'))
+        self.assertEqual(['Sample1/Recon1/data.pos', 'Sample1/Recon1/new.dat', 'Sample1/data.rhit'], sorted(manifest))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import unittest
+from datetime import date
+
+import nucapt
+from nucapt import manager
+from nucapt.exceptions import DatasetParseException
+from nucapt.metadata import MetadataHolder, update_sidecar
+from nucapt.state import get_state_path
+from tests.helpers import WorkingDataTestCase
+
+
+class TestMetadataSerialization(WorkingDataTestCase):
+    def setUp(self):
+        super(TestMetadataSerialization, self).setUp()
+        self.path = manager.data_path
+
+    def test_safe_load(self):
+        path = os.path.join(self.path, 'unsafe.yaml')
+        with open(path, 'w') as fp:
+            fp.write('x: !!python/object/apply:os.getcwd []')
+        with self.assertRaises(DatasetParseException):
+            MetadataHolder.from_yaml(path)
+
+    def test_sidecar(self):
+        nucapt.app.config['METADATA_SIDECAR'] = 'json'
+        path = os.path.join(self.path, 'Metadata.yaml')
+        sidecar = get_state_path(self.path, '.Metadata.yaml.json')
+
+        # Writing the metadata makes the sidecar
+        MetadataHolder(title='Title', authors=[{'name': 'Logan'}]).to_yaml(path)
+        self.assertTrue(os.path.isfile(sidecar))
+        self.assertEqual('Title', MetadataHolder.from_yaml(path)['title'])
+
+        # Sidecar is used while the YAML file is unchanged
+        with open(sidecar) as fp:
+            content = fp.read()
+        with open(sidecar, 'w') as fp:
+            fp.write(content.replace('"Title"', '"From sidecar"'))
+        self.assertEqual('From sidecar', MetadataHolder.from_yaml(path)['title'])
+
+        # ... and ignored once it changes. Reading does not write a new one
+        with open(path, 'w') as fp:
+            fp.write('title: Edited by hand\n')
+        mtime = os.path.getmtime(sidecar)
+        self.assertEqual('Edited by hand', MetadataHolder.from_yaml(path)['title'])
+        self.assertEqual(mtime, os.path.getmtime(sidecar))
+
+        # The copy can be brought up to date explicitly
+        self.assertTrue(update_sidecar(path))
+        with open(sidecar) as fp:
+            self.assertIn('Edited by hand', fp.read())
+        self.assertFalse(update_sidecar(path))
+
+        # Metadata that JSON cannot hold is only stored as YAML
+        MetadataHolder(title='Title', creation_date=date(2017, 1, 1)).to_yaml(path)
+        self.assertFalse(os.path.isfile(sidecar))
+        self.assertEqual(date(2017, 1, 1), MetadataHolder.from_yaml(path)['creation_date'])
+
+        # Disabled by default
+        nucapt.app.config['METADATA_SIDECAR'] = None
+        os.unlink(path)
+        MetadataHolder(title='Title').to_yaml(path)
+        self.assertFalse(os.path.isfile(sidecar))
+
+
+if __name__ == '__main__':
+    unittest.main()
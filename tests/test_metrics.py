@@ -0,0 +1,85 @@
+import json
+import os
+import unittest
+
+import nucapt
+from nucapt.metrics import Histogram, registry, timed
+from nucapt import manager
+from tests.helpers import WorkingDataTestCase
+
+
+class TestMetrics(WorkingDataTestCase):
+    def setUp(self):
+        super(TestMetrics, self).setUp()
+        nucapt.app.config['DEBUG_SKIP_AUTH'] = True
+        nucapt.app.testing = True
+        registry.clear()
+        registry.enabled = True
+        nucapt.app.config['METRICS_TOKEN'] = 'secret'
+        self.headers = {'Authorization': 'Bearer secret'}
+        self.app = nucapt.app.test_client()
+        with self.app.session_transaction() as sess:
+            sess['is_authenticated'] = True
+
+    def tearDown(self):
+        registry.enabled = False
+        registry.path = None
+        registry.clear()
+        super(TestMetrics, self).tearDown()
+
+    def test_histogram(self):
+        histogram = Histogram('test', buckets=[1, 2])
+        for value in [0.5, 1, 1.5, 3]:
+            histogram.observe(value, (('a', 'x'),))
+        self.assertEqual(([2, 3, 4], 6, 4), histogram.get_series((('a', 'x'),)))
+        self.assertIsNone(histogram.get_series())
+        self.assertIn('test_bucket{a="x",le="+Inf"} 4', histogram.to_prometheus())
+
+    def test_disabled(self):
+        registry.enabled = False
+        with timed('nucapt_test_seconds'):
+            pass
+        self.assertEqual(404, self.app.get('/metrics', headers=self.headers).status_code)
+        registry.enabled = True
+        self.assertNotIn('nucapt_test_seconds', registry.to_prometheus())
+
+    def test_endpoint(self):
+        rv = self.app.get('/datasets')
+        self.assertEqual(200, rv.status_code)
+
+        rv = self.app.get('/metrics', headers=self.headers)
+        self.assertEqual(200, rv.status_code)
+        text = rv.data.decode()
+        self.assertIn('# TYPE nucapt_request_seconds histogram', text)
+        self.assertIn('nucapt_request_seconds_count{method="GET",route="/datasets",status="200"', text)
+        self.assertIn('nucapt_scan_seconds_count{kind="dataset"', text)
+        self.assertIn('nucapt_template_seconds_count{template="dataset_list.html"', text)
+
+        self.assertIn('pid="%d"' % os.getpid(), text)
+
+        # Only clients with the token can read the measurements, even from the same machine
+        self.assertEqual(404, self.app.get('/metrics').status_code)
+        rv = self.app.get('/metrics', headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(404, rv.status_code)
+        nucapt.app.config['METRICS_TOKEN'] = None
+        self.assertEqual(404, self.app.get('/metrics', headers={'Authorization': 'Bearer '}).status_code)
+
+    def test_processes(self):
+        registry.path = os.path.join(manager.data_path, 'metrics')
+        registry.observe('nucapt_scan_seconds', 0.5, kind='dataset')
+        registry.save()
+
+        # Measurements saved by another process are added to those of this one
+        with open(os.path.join(registry.path, '%d.json' % os.getpid())) as fp:
+            data = json.load(fp)
+        with open(os.path.join(registry.path, '1.json'), 'w') as fp:
+            json.dump(data, fp)
+        registry.observe('nucapt_scan_seconds', 20, kind='dataset')
+        text = registry.to_prometheus()
+        self.assertIn('nucapt_scan_seconds_count{kind="dataset"} 3', text)
+        self.assertIn('nucapt_scan_seconds_bucket{kind="dataset",le="30"} 3', text)
+        self.assertIn('nucapt_scan_seconds_bucket{kind="dataset",le="10"} 2', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
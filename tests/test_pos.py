@@ -0,0 +1,90 @@
+import os
+import unittest
+
+import numpy as np
+
+from nucapt import manager
+from nucapt.exceptions import DatasetParseException
+from nucapt.pos import POSFile, pos_dtype
+from nucapt.spectrum import MassSpectrum, get_mass_spectrum, load_mass_spectrum, sidecar_name
+from nucapt.state import get_state_path
+from tests.helpers import WorkingDataTestCase
+
+
+class TestPOSFile(WorkingDataTestCase):
+    def setUp(self):
+        super(TestPOSFile, self).setUp()
+        self.path = manager.data_path
+
+    def write_pos(self, atoms, name='test.pos'):
+        path = os.path.join(self.path, name)
+        np.array(atoms, dtype=pos_dtype).tofile(path)
+        return path
+
+    def test_read(self):
+        atoms = [(0, 1, 2, 27), (-1, 5, 3, 13.5), (2, -3, 1, 1)]
+        pos = POSFile(self.write_pos(atoms))
+        self.assertEqual(3, pos.atom_count)
+        self.assertIsInstance(pos.atoms, np.memmap)
+
+        # Make sure the data is read as big-endian
+        with open(pos.path, 'rb') as fp:
+            self.assertEqual(b'\x00\x00\x00\x00\x3f\x80\x00\x00', fp.read(8))
+        self.assertEqual(27, pos[0]['mz'])
+        self.assertEqual([5, -3], list(pos[1:]['y']))
+
+        # Test the summaries, with blocks that do not evenly divide the file
+        self.assertEqual({'x': (-1, 2), 'y': (-3, 5), 'z': (1, 3)}, pos.get_bounding_box(chunk_size=2))
+        self.assertEqual((1, 27), pos.get_mz_range(chunk_size=2))
+        self.assertEqual([2, 1], [len(c) for c in pos.iter_chunks(2)])
+        self.assertEqual({'atom_count': 3, 'bounding_box': {'x': (-1, 2), 'y': (-3, 5), 'z': (1, 3)},
+                          'mz_range': (1, 27)}, pos.summarize())
+
+    def test_empty(self):
+        pos = POSFile(self.write_pos([]))
+        self.assertEqual(0, len(pos))
+        self.assertIsNone(pos.get_mz_range())
+        self.assertEqual([], list(pos.iter_chunks()))
+
+    def test_corrupt(self):
+        path = os.path.join(self.path, 'bad.pos')
+        with open(path, 'wb') as fp:
+            fp.write(b'Contents')
+        with self.assertRaises(DatasetParseException):
+            POSFile(path)
+
+
+    def test_mass_spectrum(self):
+        path = self.write_pos([(0, 0, 0, mz) for mz in [0.01, 0.5, 0.55, 2.99, -1, np.nan]])
+
+        # Compute it in small pieces
+        spectrum = MassSpectrum.compute(POSFile(path), bin_width=0.5, chunk_size=4)
+        self.assertEqual([1, 2, 0, 0, 0, 1], spectrum.counts.tolist())
+        self.assertEqual(4, spectrum.to_json()['atom_count'])
+
+        # Make sure it is stored, and re-used
+        spectrum = get_mass_spectrum(path, 0.5)
+        sidecar = get_state_path(self.path, sidecar_name)
+        self.assertTrue(os.path.isfile(sidecar))
+        self.assertEqual([1, 2, 0, 0, 0, 1], MassSpectrum.load(sidecar).counts.tolist())
+        mtime = os.path.getmtime(sidecar)
+        os.utime(sidecar, (mtime - 100, mtime - 100))
+        get_mass_spectrum(path, 0.5)
+        self.assertEqual(mtime - 100, os.path.getmtime(sidecar))
+
+        # Recomputed if the bin size or the POS file change
+        self.assertEqual(3, len(get_mass_spectrum(path, 1).counts))
+        self.write_pos([(0, 0, 0, 1.2)])
+        self.assertEqual([0, 1], get_mass_spectrum(path, 1).counts.tolist())
+
+        # Atoms above the largest m/z are only counted, so they do not make huge arrays
+        path = self.write_pos([(0, 0, 0, mz) for mz in [1.2, 2e8, 1e30, np.inf]])
+        spectrum = get_mass_spectrum(path, 1, max_mz=10)
+        self.assertEqual([0, 1], spectrum.counts.tolist())
+        self.assertEqual(2, spectrum.out_of_range)
+        self.assertEqual(2, MassSpectrum.load(sidecar).out_of_range)
+        self.assertIsNone(load_mass_spectrum(path, 1, max_mz=20))
+
+
+if __name__ == '__main__':
+    unittest.main()
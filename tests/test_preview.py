@@ -0,0 +1,101 @@
+import os
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from nucapt import manager
+from nucapt.pos import POSFile, pos_dtype
+from nucapt.preview import Preview, PreviewGenerator, load_preview, sample_atoms
+from tests.helpers import WorkingDataTestCase
+
+
+class TestPreview(WorkingDataTestCase):
+    def setUp(self):
+        super(TestPreview, self).setUp()
+        self.path = manager.data_path
+
+    def write_pos(self, n, name='test.pos'):
+        path = os.path.join(self.path, name)
+        atoms = np.zeros((n,), dtype=pos_dtype)
+        atoms['x'] = np.arange(n)
+        atoms['mz'] = 1
+        atoms.tofile(path)
+        return path
+
+    def test_sample(self):
+        pos = POSFile(self.write_pos(1000))
+
+        # Sample spanning several blocks
+        sample = sample_atoms(pos, 100, chunk_size=64)
+        self.assertEqual((100, 4), sample.shape)
+        x = sample[:, 0]
+        self.assertEqual(100, len(set(x)))
+        self.assertTrue((np.diff(x) > 0).all())  # In file order
+        self.assertTrue((sample[:, 3] == 1).all())
+
+        # Atoms should be drawn from across the whole file
+        self.assertLess(x.min(), 100)
+        self.assertGreater(x.max(), 900)
+
+        # Block size should not change which atoms are selected
+        self.assertEqual(x.tolist(), sample_atoms(pos, 100, chunk_size=1000)[:, 0].tolist())
+
+        # Small files are included whole
+        self.assertEqual(1000, len(sample_atoms(pos, 5000, chunk_size=64)))
+
+    def test_generator(self):
+        generator = PreviewGenerator(size=10)
+
+        # Make a preview
+        path = self.write_pos(100)
+        self.assertIsNone(load_preview(path))
+        self.assertEqual('pending', generator.request(path))
+        generator.join()
+        self.assertEqual('ready', generator.request(path))
+        preview = load_preview(path)
+        self.assertEqual(100, preview.atom_count)
+        self.assertEqual(10 * 16, len(preview.to_bytes()))
+
+        # Readiness is checked without reading the preview, and follows changes to the POS file
+        with patch.object(Preview, 'load', side_effect=AssertionError('Preview was read')):
+            self.assertEqual('ready', generator.request(path))
+        os.utime(path, (0, 0))
+        self.assertEqual('pending', generator.request(path))
+        generator.join()
+        self.assertEqual('ready', generator.request(path))
+
+        # The mass spectrum is made along with it
+        self.assertEqual('ready', generator.request(path, 'spectrum'))
+        self.assertEqual(100, generator.load(path, 'spectrum').to_json()['atom_count'])
+
+        # The composition is made once the RRNG file is given
+        rrng_path = os.path.join(self.path, 'test.rrng')
+        with open(rrng_path, 'w') as fp:
+            fp.write('[Ions]\nNumber=1\nIon1=Al\n\n[Ranges]\nNumber=1\nRange1=0.5 1.5 Vol:0.01661 Al:1\n')
+        self.assertEqual('pending', generator.request(path, 'composition', rrng_path))
+        generator.join()
+        self.assertEqual('ready', generator.request(path, 'composition', rrng_path))
+        self.assertEqual({'Al': 100}, generator.load(path, 'composition', rrng_path)['elements'])
+
+        # Failures are reported, and not retried until the file changes
+        bad_path = os.path.join(self.path, 'bad', 'bad.pos')
+        os.mkdir(os.path.dirname(bad_path))
+        with open(bad_path, 'wb') as fp:
+            fp.write(b'Contents')
+        generator.request(bad_path)
+        generator.join()
+        self.assertEqual('failed', generator.request(bad_path))
+        self.assertIn('not a multiple', generator.get_error(bad_path))
+        self.assertEqual('failed', generator.request(bad_path, 'spectrum'))
+        self.assertIn('not a multiple', generator.get_error(bad_path, 'spectrum'))
+
+        # Files removed after a failure are reported as failed, not as a server error
+        os.unlink(bad_path)
+        generator.request(bad_path)
+        generator.join()
+        self.assertEqual('failed', generator.request(bad_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
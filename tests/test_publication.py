@@ -0,0 +1,128 @@
+import json
+import os
+import unittest
+
+import nucapt
+from nucapt import manager, publication
+from nucapt.manager import APTDataDirectory
+from nucapt.metadata import GeneralMetadata, MetadataHolder
+from nucapt.publication import PublicationJob, run_job
+from tests.helpers import WorkingDataTestCase
+
+
+class TestPublication(WorkingDataTestCase):
+    def setUp(self):
+        super(TestPublication, self).setUp()
+        nucapt.app.config['PUBLISH_RETRY_DELAY'] = 0
+        nucapt.app.config['DEBUG_SKIP_AUTH'] = True
+
+        # Make a dataset
+        os.mkdir(os.path.join(manager.data_path, 'dataset'))
+        GeneralMetadata(title='Dataset', authors=[], dates={'creation_date': '01Jan18'}).to_yaml(
+            os.path.join(manager.data_path, 'dataset', 'GeneralMetadata.yaml'))
+        self.dataset = APTDataDirectory.load_dataset_by_name('dataset')
+
+        # Replace the stages with ones that fail a certain number of times
+        self.failures = {'write_manifest': 0, 'push_metadata': 1, 'transfer': 0, 'complete_submission': 0}
+        self.calls = []
+        self.original_stages = publication.STAGES
+        publication.STAGES = [(name, self.make_stage(name)) for name, _ in self.original_stages]
+
+    def tearDown(self):
+        publication.STAGES = self.original_stages
+        super(TestPublication, self).tearDown()
+
+    def make_stage(self, name):
+        def stage(job, metadata, tokens):
+            self.calls.append(name)
+            if self.failures[name] > 0:
+                self.failures[name] -= 1
+                raise ValueError('%s failed' % name)
+            if name == 'push_metadata':
+                job.update(submission_id='submission')
+        return stage
+
+    def test_retries(self):
+        nucapt.app.config['PUBLISH_MAX_ATTEMPTS'] = 2
+
+        # First stage succeeds on second attempt, second stage never does
+        self.failures['transfer'] = 2
+        job = PublicationJob.create(self.dataset)
+        self.assertTrue(job.is_active())
+        run_job(job, {}, {})
+        job = PublicationJob.load(self.dataset)
+        self.assertEqual('failed', job['status'])
+        self.assertEqual(['write_manifest', 'push_metadata'], job['completed'])
+        self.assertEqual('transfer failed', job['error'])
+        self.assertFalse(self.dataset.is_published())
+
+        # Resubmitting only runs the remaining stages
+        self.calls = []
+        run_job(PublicationJob.create(self.dataset), {}, {})
+        job = PublicationJob.load(self.dataset)
+        self.assertEqual('complete', job['status'])
+        self.assertEqual(['transfer', 'complete_submission'], self.calls)
+        self.assertTrue(self.dataset.is_published())
+
+    def test_changed_metadata(self):
+        self.failures.update(push_metadata=0, transfer=1)
+        nucapt.app.config['PUBLISH_MAX_ATTEMPTS'] = 1
+        run_job(PublicationJob.create(self.dataset, {'title': 'Old'}), {'title': 'Old'}, {})
+        self.assertEqual(['write_manifest', 'push_metadata'], PublicationJob.load(self.dataset)['completed'])
+
+        # Resubmitting with corrected metadata runs every stage again
+        self.calls = []
+        job = PublicationJob.create(self.dataset, {'title': 'New'})
+        self.assertEqual([], job['completed'])
+        self.assertIsNone(job['submission_id'])
+        run_job(job, {'title': 'New'}, {})
+        self.assertEqual(['write_manifest', 'push_metadata', 'transfer', 'complete_submission'], self.calls)
+
+    def test_status(self):
+        # Status is kept outside of the dataset, so it is not published
+        job = PublicationJob.create(self.dataset)
+        self.assertEqual([], [f for f in os.listdir(self.dataset.path) if 'Publication' in f])
+        self.assertEqual('queued', publication.get_job(self.dataset)['status'])
+
+        # Jobs are interrupted once their heartbeat stops
+        job.state['heartbeat'] -= nucapt.app.config['PUBLISH_HEARTBEAT_TIMEOUT'] + 1
+        MetadataHolder(**job.state).to_yaml(job._get_path(self.dataset))
+        job = publication.get_job(self.dataset)
+        self.assertEqual('interrupted', job['status'])
+        self.assertFalse(job.is_active())
+
+    def test_website(self):
+        nucapt.app.config['DEBUG_SKIP_PUB'] = False
+        client = nucapt.app.test_client()
+        with client.session_transaction() as sess:
+            sess.update({'is_authenticated': True, 'tokens': {}})
+
+        # Submit the dataset, which should run in the background
+        form = {
+            'title': 'Sample dataset',
+            'abstract': 'Dataset for unittest',
+            'authors-0-first_name': 'Logan',
+            'authors-0-last_name': 'Ward',
+            'authors-0-affiliation': 'UChicago',
+            'contact_email': 'test@test.edu',
+            'contact_person': 'Test user',
+            'accept_license': True
+        }
+        rv = client.post('/dataset/dataset/publish', data=form)
+        self.assertEqual(302, rv.status_code)
+        self.assertTrue(rv.location.endswith('/dataset/dataset/publish/status'))
+        publication.publication_runner.join()
+
+        # Check the status
+        rv = client.get('/dataset/dataset/publish/status')
+        self.assertEqual(200, rv.status_code)
+        self.assertIn(b'complete', rv.data)
+
+        rv = client.get('/dataset/dataset/publish/status.json')
+        status = json.loads(rv.data.decode())
+        self.assertTrue(status['published'])
+        self.assertEqual('submission', status['job']['submission_id'])
+
+
+if __name__ == '__main__':
+    unittest.main()
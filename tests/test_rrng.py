@@ -0,0 +1,76 @@
+import os
+import unittest
+
+import numpy as np
+
+from nucapt import manager
+from nucapt.exceptions import DatasetParseException
+from nucapt.pos import POSFile, pos_dtype
+from nucapt.rrng import RangeFile, get_composition, composition_name
+from nucapt.state import get_state_path
+from tests.helpers import WorkingDataTestCase
+
+_example_rrng = """[Ions]
+Number=2
+Ion1=Al
+Ion2=O
+
+[Ranges]
+Number=4
+Range1=26.9000 27.1000 Vol:0.01661 Al:1 Color:33FFFF
+Range2=13.4000 13.6000 Vol:0.01661 Al:1 Color:33FFFF
+Range3=15.9000 16.1000 Vol:0.01410 O:1 Color:0000FF
+Range4=42.9000 43.1000 Vol:0.03071 Al:1 O:1 Color:FF00FF
+"""
+
+
+class TestRangeFile(WorkingDataTestCase):
+    def setUp(self):
+        super(TestRangeFile, self).setUp()
+        self.path = manager.data_path
+
+    def write_rrng(self, content, name='test.rrng'):
+        path = os.path.join(self.path, name)
+        with open(path, 'w') as fp:
+            fp.write(content)
+        return path
+
+    def test_parse(self):
+        ranges = RangeFile.from_rrng(self.write_rrng(_example_rrng))
+        self.assertEqual(['Al', 'O', 'AlO'], ranges.species)
+        self.assertEqual([13.4, 15.9, 26.9, 42.9], ranges.lows.tolist())
+
+        # Label atoms, including ones on the edges of and between ranges
+        labels = ranges.label([27, 13.4, 13.6, 13.7, 1, 16, 43, 100])
+        self.assertEqual(['Al', 'Al', 'Al', None, None, 'O', 'AlO', None],
+                         [ranges.species[l] if l >= 0 else None for l in labels])
+
+        # Test errors
+        with self.assertRaises(DatasetParseException):
+            RangeFile.from_rrng(self.write_rrng('[Ranges]\nRange1=1.0 0.5 Al:1\nRange2=a b'))
+        with self.assertRaises(DatasetParseException):
+            RangeFile.from_rrng(self.write_rrng('[Ranges]\nRange1=1.0 2.0 Al:1\nRange2=1.5 3.0 O:1'))
+        with self.assertRaises(DatasetParseException):
+            RangeFile.from_rrng(self.write_rrng('Contents'))
+
+    def test_composition(self):
+        rrng_path = self.write_rrng(_example_rrng)
+        pos_path = os.path.join(self.path, 'test.pos')
+        np.array([(0, 0, 0, mz) for mz in [27, 13.5, 16, 43, 43, 50]], dtype=pos_dtype).tofile(pos_path)
+        pos = POSFile(pos_path)
+
+        composition = RangeFile.from_rrng(rrng_path).compute_composition(pos, chunk_size=4)
+        self.assertEqual({'Al': 2, 'O': 1, 'AlO': 2}, composition['ions'])
+        self.assertEqual({'Al': 4, 'O': 3}, composition['elements'])
+        self.assertEqual((5, 1), (composition['ranged'], composition['unranged']))
+
+        # Make sure it is stored and updated when the range file changes
+        self.assertEqual(composition, get_composition(pos, rrng_path))
+        self.assertTrue(os.path.isfile(get_state_path(self.path, composition_name)))
+        self.assertEqual(composition, get_composition(pos, rrng_path))
+        self.write_rrng('[Ranges]\nRange1=26.9000 27.1000 Al:1\n')
+        self.assertEqual({'Al': 1}, get_composition(pos, rrng_path)['elements'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import nucapt
+from nucapt import scanner
+from nucapt.exceptions import DatasetParseException
+from nucapt.index import metadata_index
+from nucapt.metadata import GeneralMetadata
+
+
+class TestScanner(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.config = dict(nucapt.app.config)
+
+    def tearDown(self):
+        nucapt.app.config.update(self.config)
+        shutil.rmtree(self.path)
+
+    def make_directory(self, name, marker=None):
+        path = os.path.join(self.path, *name.split('/'))
+        os.makedirs(path)
+        if marker is not None:
+            GeneralMetadata(title=name).to_yaml(os.path.join(path, marker))
+        return path
+
+    def test_map(self):
+        def fn(x):
+            if x % 3 == 0:
+                raise DatasetParseException('bad %d' % x)
+            return x * 2
+
+        for workers in [1, 4]:
+            nucapt.app.config['SCAN_WORKERS'] = workers
+            results = scanner.parallel_map(fn, range(10))
+            self.assertEqual([None if x % 3 == 0 else 2 * x for x in range(10)], [r for r, _ in results])
+            self.assertEqual(['bad 0', 'bad 3', 'bad 6', 'bad 9'], [e.errors[0] for _, e in results if e is not None])
+
+    def test_scan(self):
+        for name in ['b', 'a', 'c', 'c/s2', 'c/s1', 'a/s3']:
+            self.make_directory(name, 'Marker.yaml')
+        self.make_directory('.hidden', 'Marker.yaml')
+        self.make_directory('unmarked')
+        with open(os.path.join(self.path, 'file'), 'w') as fp:
+            fp.write('not a directory')
+
+        self.assertEqual([os.path.join(self.path, x) for x in ['a', 'b', 'c']],
+                         scanner.list_subdirectories(self.path, 'Marker.yaml'))
+        self.assertEqual([[os.path.join(self.path, x) for x in ['a', 'b', 'c']],
+                          [os.path.join(self.path, *x.split('/')) for x in ['a/s3', 'c/s1', 'c/s2']]],
+                         scanner.scan_tree(self.path, ['Marker.yaml', 'Marker.yaml']))
+
+        # Make sure prefetching fills the index, and skips invalid files
+        metadata_index.clear()
+        with open(os.path.join(self.path, 'b', 'Marker.yaml'), 'w') as fp:
+            fp.write('{')
+        scanner.prefetch_metadata([os.path.join(self.path, x) for x in ['a', 'b', 'unmarked']], ['Marker.yaml'])
+        self.assertEqual(1, len(metadata_index))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import unittest
+
+import requests
+
+import nucapt
+from nucapt.server import get_server_options
+
+try:
+    import gunicorn
+except ImportError:
+    gunicorn = None
+
+
+class TestServer(unittest.TestCase):
+    def test_options(self):
+        config = {'SERVER_WORKERS': 3, 'SERVER_CERTFILE': 'ssl/cert.pem', 'UPLOAD_SERVER_TIMEOUT': 60}
+
+        options = get_server_options('web', config)
+        self.assertEqual(3, options['workers'])
+        self.assertEqual(120, options['timeout'])
+        self.assertEqual('ssl/cert.pem', options['certfile'])
+        self.assertNotIn('keyfile', options)
+        self.assertTrue(options['preload_app'])
+
+        options = get_server_options('upload', config)
+        self.assertEqual(2, options['workers'])
+        self.assertEqual(60, options['timeout'])
+
+        # Workers default to the number of cores
+        self.assertGreaterEqual(get_server_options('web', {})['workers'], 3)
+        self.assertEqual(nucapt.app.config['SERVER_BIND'], get_server_options()['bind'])
+
+        with self.assertRaises(ValueError):
+            get_server_options('other')
+
+    @unittest.skipIf(gunicorn is None or os.name != 'posix', 'gunicorn is not available')
+    def test_serve(self):
+        # Find a free port
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        proc = subprocess.Popen([sys.executable, '-m', 'nucapt.cli', 'serve', '--bind', '127.0.0.1:%d' % port,
+                                 '--workers', '2', '--threads', '2'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        try:
+            for _ in range(100):
+                try:
+                    rv = requests.get('http://127.0.0.1:%d/' % port, allow_redirects=False)
+                    break
+                except requests.ConnectionError:
+                    time.sleep(0.1)
+            else:
+                self.fail('Server did not start')
+            self.assertIn(rv.status_code, [200, 301, 302])
+        finally:
+            proc.send_signal(signal.SIGINT)  # Quick shutdown
+            proc.communicate()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import unittest
+
+from nucapt import manager
+from nucapt.state import get_state_path
+from nucapt.usage import measure_files, load_usage, update_usage, compute_usage, usage_name
+from tests.helpers import WorkingDataTestCase
+
+markers = ['GeneralMetadata.yaml', 'SampleInformation.yaml', 'ReconstructionMetadata.yaml']
+
+
+class TestUsage(WorkingDataTestCase):
+    def setUp(self):
+        super(TestUsage, self).setUp()
+        self.path = manager.data_path
+
+    def write_file(self, path, size):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as fp:
+            fp.write(b'0' * size)
+
+    def make_tree(self):
+        """Make a dataset with two samples, one of which has a reconstruction
+
+        :return: str, path to the dataset"""
+        dataset = os.path.join(self.path, 'dataset')
+        self.write_file(os.path.join(dataset, 'GeneralMetadata.yaml'), 10)
+        for sample in ['Sample1', 'Sample2']:
+            self.write_file(os.path.join(dataset, sample, 'SampleInformation.yaml'), 20)
+        self.write_file(os.path.join(dataset, 'Sample1', 'Recon1', 'ReconstructionMetadata.yaml'), 30)
+        self.write_file(os.path.join(dataset, 'Sample1', 'Recon1', 'data.pos'), 1600)
+        return dataset
+
+    def test_measure(self):
+        dataset = self.make_tree()
+
+        # Data directories inside are not counted, but other subdirectories are
+        self.write_file(os.path.join(dataset, 'extra', 'notes.txt'), 5)
+        self.assertEqual({'size': 15, 'files': 2}, measure_files(dataset, 'SampleInformation.yaml'))
+        self.assertEqual({'size': 1685, 'files': 6}, measure_files(dataset))
+
+    def test_compute(self):
+        dataset = self.make_tree()
+        usage = compute_usage(dataset, markers[1:])
+        self.assertEqual({'size': 1680, 'files': 5}, usage['total'])
+        self.assertEqual({'size': 10, 'files': 1}, usage['own'])
+        self.assertEqual({'size': 1650, 'files': 3}, usage['children']['Sample1'])
+
+        # Records are made for every level
+        self.assertEqual({'size': 1630, 'files': 2},
+                         load_usage(os.path.join(dataset, 'Sample1', 'Recon1'))['total'])
+        self.assertTrue(os.path.isfile(get_state_path(os.path.join(dataset, 'Sample2'), usage_name)))
+
+    def test_update(self):
+        dataset = self.make_tree()
+        compute_usage(dataset, markers[1:])
+
+        # Adding a file to a reconstruction updates the totals above it
+        recon = os.path.join(dataset, 'Sample1', 'Recon1')
+        self.write_file(os.path.join(recon, 'data.rrng'), 100)
+        update_usage(recon, markers, 2)
+        self.assertEqual({'size': 1730, 'files': 3}, load_usage(recon)['total'])
+        self.assertEqual({'size': 1750, 'files': 4}, load_usage(os.path.join(dataset, 'Sample1'))['total'])
+        self.assertEqual({'size': 1780, 'files': 6}, load_usage(dataset)['total'])
+
+        # Only the changed directory is measured again
+        self.write_file(os.path.join(dataset, 'Sample2', 'untracked.dat'), 1000)
+        update_usage(recon, markers, 2)
+        self.assertEqual({'size': 1780, 'files': 6}, load_usage(dataset)['total'])
+
+        # A new sample is added to the dataset record
+        sample = os.path.join(dataset, 'Sample3')
+        self.write_file(os.path.join(sample, 'SampleInformation.yaml'), 20)
+        update_usage(sample, markers, 1)
+        self.assertEqual({'size': 20, 'files': 1}, load_usage(dataset)['children']['Sample3'])
+
+        # Deleted directories are removed
+        shutil.rmtree(recon)
+        update_usage(recon, markers, 2)
+        self.assertNotIn('Recon1', load_usage(os.path.join(dataset, 'Sample1'))['children'])
+        self.assertEqual({'size': 70, 'files': 4}, load_usage(dataset)['total'])
+
+    def test_missing_records(self):
+        dataset = self.make_tree()
+
+        # Directories without records are measured when something below them changes
+        update_usage(os.path.join(dataset, 'Sample2'), markers, 1)
+        self.assertEqual({'size': 1680, 'files': 5}, load_usage(dataset)['total'])
+        self.assertIsNone(load_usage(os.path.join(self.path, 'other')))
+
+
+if __name__ == '__main__':
+    unittest.main()
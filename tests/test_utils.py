@@ -0,0 +1,141 @@
+import json
+import threading
+import time
+import unittest
+
+from globus_sdk.exc import NetworkError
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+import nucapt
+from nucapt import utils
+from nucapt.clients import client_pool
+
+
+class FakeNexusHandler(BaseHTTPRequestHandler):
+    """Stand-in for Globus Nexus that reports the user is in the NUCAPT group"""
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def do_GET(self):
+        FakeNexusHandler.requests.append((self.path, self.headers.get('Authorization')))
+        body = json.dumps([{'id': nucapt.app.config['GROUP_ID'], 'my_status': 'active'}]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestGroupMembership(unittest.TestCase):
+    def setUp(self):
+        self.replies = []
+        self.original_query = utils._query_group_membership
+        utils._query_group_membership = self.fake_query
+
+    def tearDown(self):
+        utils._query_group_membership = self.original_query
+
+    def fake_query(self):
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def test_cache(self):
+        with nucapt.app.test_request_context():
+            utils.session['primary_identity'] = 'user'
+
+            # Positive answers are reused until the TTL expires
+            self.replies = [True, False]
+            self.assertTrue(utils.is_group_member())
+            self.assertTrue(utils.is_group_member())
+            self.assertEqual(1, len(self.replies))
+
+            # Refreshing skips the cache
+            self.assertFalse(utils.is_group_member(refresh=True))
+
+            # Negative answers expire sooner
+            utils.session['group_membership']['checked'] = time.time() - \
+                nucapt.app.config['GROUP_CACHE_NEGATIVE_TTL'] - 1
+            self.replies = [True]
+            self.assertTrue(utils.is_group_member())
+
+            # Last known answer is used if Globus is unavailable
+            self.replies = [NetworkError('down', Exception())]
+            self.assertTrue(utils.is_group_member(refresh=True))
+
+            # ... but only for a limited time after it expires
+            utils.session['group_membership']['checked'] = time.time() - nucapt.app.config['GROUP_CACHE_TTL'] - \
+                nucapt.app.config['GROUP_CACHE_GRACE'] - 1
+            self.replies = [NetworkError('down', Exception())]
+            self.assertFalse(utils.is_group_member())
+
+            # Answers are not shared between identities
+            utils.session['primary_identity'] = 'other user'
+            self.replies = [NetworkError('down', Exception())]
+            self.assertRaises(NetworkError, utils.is_group_member)
+
+
+class FakeNexusServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestClientPool(unittest.TestCase):
+    def setUp(self):
+        FakeNexusHandler.requests = []
+        self.server = FakeNexusServer(('127.0.0.1', 0), FakeNexusHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        nucapt.app.config['GLOBUS_BASE_URLS'] = {'nexus': 'http://127.0.0.1:%d/' % self.server.server_port}
+
+    def tearDown(self):
+        nucapt.app.config['GLOBUS_BASE_URLS'] = {}
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_reuse(self):
+        with nucapt.app.test_request_context():
+            utils.session['tokens'] = {'nexus.api.globus.org': {
+                'refresh_token': 'refresh', 'access_token': 'access', 'expires_at_seconds': time.time() + 3600
+            }}
+
+            # Clients are reused, and the access token from the session is used without refreshing it
+            client = client_pool.get_client('nexus')
+            self.assertIs(client, client_pool.get_client('nexus'))
+            self.assertTrue(utils._query_group_membership())
+            self.assertTrue(utils._query_group_membership())
+            self.assertEqual(2, len(FakeNexusHandler.requests))
+            self.assertEqual('Bearer access', FakeNexusHandler.requests[0][1])
+
+            # Logging out discards the clients
+            client_pool.forget_user()
+            self.assertIsNot(client, client_pool.get_client('nexus'))
+
+            # Portal client is shared
+            self.assertIs(utils.load_portal_client(), utils.load_portal_client())
+
+    def test_shared_session(self):
+        # The pool replaces a private attribute of the globus_sdk clients to share its HTTP session.
+        #  Make sure requests still go through it, which fails if a new version of globus_sdk changes how they are sent
+        sent = []
+        hook = lambda response, *args, **kwargs: sent.append(response.url)
+        client_pool.http_session.hooks['response'].append(hook)
+        try:
+            with nucapt.app.test_request_context():
+                utils.session['tokens'] = {'nexus.api.globus.org': {
+                    'refresh_token': 'shared', 'access_token': 'access', 'expires_at_seconds': time.time() + 3600
+                }}
+                self.assertTrue(utils._query_group_membership())
+        finally:
+            client_pool.http_session.hooks['response'].remove(hook)
+        self.assertEqual(1, len(sent))
+        self.assertEqual(1, len(FakeNexusHandler.requests))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,24 +1,31 @@
 from __future__ import print_function
 
+import hashlib
+import json
 import os
 import shutil
 import tempfile
+import threading
 import unittest
 from io import BytesIO
 from datetime import date
+from unittest.mock import patch
 
 from bs4 import BeautifulSoup
 
 import nucapt
-from nucapt import manager
-from nucapt.manager import APTSampleDirectory, APTReconstruction, APTAnalysisDirectory
+from nucapt import manager, placement
+from nucapt.exceptions import DatasetParseException
+from nucapt.manager import APTDataDirectory, APTSampleDirectory, APTReconstruction, APTAnalysisDirectory
+from nucapt.preview import preview_generator
+from nucapt.state import get_state_directory
+from nucapt.uploads import ChunkedUpload, attach_staged_files, remove_abandoned_uploads
+from tests.helpers import WorkingDataTestCase
 
 
-class TestWebsite(unittest.TestCase):
+class TestWebsite(WorkingDataTestCase):
     def setUp(self):
-        # Make a temporary directory
-        manager.data_path = tempfile.mkdtemp()
-        nucapt.app.config['WORKING_PATH'] = manager.data_path
+        super(TestWebsite, self).setUp()
 
         # Set us to testing mode
         nucapt.app.testing = True
@@ -34,9 +41,6 @@ class TestWebsite(unittest.TestCase):
                 'email': 'test@test.edu'
             })
 
-    def tearDown(self):
-        shutil.rmtree(manager.data_path)
-
     def test_home(self):
         rv = self.app.get('/')
         self.assertEquals(200, rv.status_code)
@@ -112,6 +116,42 @@ class TestWebsite(unittest.TestCase):
         rv = self.app.get('/datasets')
         self.assertEquals(200, rv.status_code)
 
+    def test_dataset_listing(self):
+        # Make three datasets with different titles and authors
+        data, _, first_name = self.create_dataset()
+        data['title'] = 'Another dataset'
+        self.app.post('/create', data=data)
+        data['authors-0-last_name'] = 'Blaiszik'
+        self.app.post('/create', data=data)
+
+        def listed_names(url):
+            soup = BeautifulSoup(self.app.get(url).data, 'html.parser')
+            return [row.find('td').text for row in soup.find_all('tr') if row.find('td') is not None]
+
+        # Test sorting
+        names = listed_names('/datasets')
+        self.assertEqual(sorted(names), names)
+        self.assertEqual(3, len(names))
+        self.assertEqual(names[::-1], listed_names('/datasets?sort=name&order=desc'))
+        self.assertEqual(first_name, listed_names('/datasets?sort=title&order=desc')[0])
+
+        # Test filtering
+        self.assertEqual(2, len(listed_names('/datasets?author=ward')))
+        self.assertEqual(2, len(listed_names('/datasets?title=another')))
+        self.assertEqual(0, len(listed_names('/datasets?published=yes')))
+
+        # Test pagination
+        self.assertEqual(names[:2], listed_names('/datasets?per_page=2'))
+        self.assertEqual(names[2:], listed_names('/datasets?per_page=2&page=2'))
+
+        # Datasets with invalid metadata are left out of the listing
+        dataset = APTDataDirectory.load_dataset_by_name(first_name)
+        with open(os.path.join(dataset.path, 'GeneralMetadata.yaml'), 'w') as fp:
+            fp.write('title: [not valid')
+        dataset.record_changes()
+        self.assertNotIn(first_name, listed_names('/datasets'))
+        self.assertEqual(2, len(listed_names('/datasets')))
+
     def test_sample_method(self):
 
         # Make an initial dataset
@@ -280,6 +320,12 @@ class TestWebsite(unittest.TestCase):
         self.assertNotIn('shank_angle', recon.load_metadata().metadata.keys())
         self.assertEquals(recon.load_metadata()['tip_image'], 'tip_image.jpg')
 
+        # Temporary files left by interrupted writes are not mistaken for the data files
+        for name in ['.tmp-EXAMPLE.pos-0123', 'EXAMPLE.pos.bak']:
+            with open(os.path.join(recon.path, name), 'wb') as fp:
+                fp.write(b'partial')
+        self.assertEquals('EXAMPLE.pos', os.path.basename(recon.get_pos_file()))
+
         # Make sure the webpages update
         rv = self.app.get('/dataset/%s/sample/%s/recon/%s'%(dataset_name, sample_name, 'Recon1'))
 
@@ -287,6 +333,17 @@ class TestWebsite(unittest.TestCase):
         self.assertIn(recon.get_rrng_file().encode('ascii'), rv.data)
         self.assertIn(recon.get_pos_file().encode('ascii'), rv.data)
 
+        # The composition is computed in the background
+        rv = self.app.get('/dataset/%s/sample/%s/recon/%s/composition.json' % (dataset_name, sample_name, 'Recon1'))
+        self.assertEquals(202, rv.status_code)
+
+        # The example POS file is not valid, so neither can be made once the background work finishes
+        preview_generator.join()
+        rv = self.app.get('/dataset/%s/sample/%s/recon/%s/mass_spectrum.json' % (dataset_name, sample_name, 'Recon1'))
+        self.assertEquals(400, rv.status_code)
+        rv = self.app.get('/dataset/%s/sample/%s/recon/%s/composition.json' % (dataset_name, sample_name, 'Recon1'))
+        self.assertEquals(400, rv.status_code)
+
         rv = self.app.get('/dataset/%s/sample/%s'%(dataset_name, sample_name))
 
         self.assertEquals(200, rv.status_code)
@@ -310,6 +367,215 @@ class TestWebsite(unittest.TestCase):
         field = soup.find('textarea', {'name': 'description'})
         self.assertEquals('Example reconstruction', field.contents[0])
 
+        # The forms are filled from the most recent sample and reconstruction recorded in the dataset
+        dataset = manager.APTDataDirectory.load_dataset_by_name(dataset_name)
+        recon_path = os.path.join(dataset.path, sample_name, 'Recon1')
+        self.assertEquals('Sample2', dataset.get_recent_sample().sample_name)
+        self.assertEquals(recon_path, dataset.get_recent_reconstruction().path)
+        self.assertEquals(1, APTSampleDirectory.load_dataset_by_name(dataset_name, sample_name).count_reconstructions())
+
+        # Without the record, they are found by scanning the dataset
+        os.unlink(os.path.join(dataset.path, '.Recent.yaml'))
+        self.assertEquals('Sample2', dataset.get_recent_sample().sample_name)
+        self.assertEquals(recon_path, dataset.get_recent_reconstruction().path)
+
+    def test_chunked_upload(self):
+        """Test uploading reconstruction files in pieces"""
+
+        _, _, dataset_name = self.create_dataset()
+        sample_data, _ = self.create_sample(dataset_name, no_rhit=True)
+        sample_name = sample_data['sample_name']
+
+        # Create the reconstruction without files
+        data, _ = self.create_reconstruction(dataset_name, sample_name)
+        base = '/dataset/%s/sample/%s/recon/Recon2/uploads' % (dataset_name, sample_name)
+        data.update({'name': 'Recon2', 'chunked_upload': 'y', 'tip_image': (BytesIO(b'<image>'), 'tip.jpg')})
+        del data['pos_file'], data['rrng_file']
+        rv = self.app.post('/dataset/%s/sample/%s/recon/create' % (dataset_name, sample_name), data=data)
+        self.assertEquals(302, rv.status_code)
+
+        # Only POS and RRNG files are allowed
+        rv = self.app.post(base, data=json.dumps({'filename': 'data.rhit', 'size': 10}))
+        self.assertEquals(400, rv.status_code)
+
+        # Send a POS file in two pieces
+        rv = self.app.post(base, data=json.dumps({'filename': 'data.pos', 'size': 10}))
+        self.assertEquals(201, rv.status_code)
+        upload_id = json.loads(rv.data.decode())['upload_id']
+        url = '%s/%s' % (base, upload_id)
+
+        rv = self.app.put(url + '?offset=0', data=b'0123',
+                          headers={'X-Checksum-SHA256': hashlib.sha256(b'0123').hexdigest()})
+        self.assertEquals(200, rv.status_code)
+        self.assertEquals(4, json.loads(rv.data.decode())['received'])
+
+        # Corrupted and out-of-order pieces are rejected
+        rv = self.app.put(url + '?offset=4', data=b'456789', headers={'X-Checksum-SHA256': '0' * 64})
+        self.assertEquals(400, rv.status_code)
+        rv = self.app.put(url + '?offset=2', data=b'456789')
+        self.assertEquals(400, rv.status_code)
+        self.assertEquals(4, json.loads(self.app.get(url).data.decode())['received'])
+
+        # So is more data than the file holds, whether or not its length is given
+        rv = self.app.put(url + '?offset=4', data=b'4567890123')
+        self.assertEquals(400, rv.status_code)
+        upload = ChunkedUpload.load(APTReconstruction.load_dataset_by_name(dataset_name, sample_name, 'Recon2'),
+                                    upload_id)
+        with self.assertRaises(DatasetParseException):
+            upload.write_chunk(4, BytesIO(b'4567890123'))
+        self.assertEquals(4, json.loads(self.app.get(url).data.decode())['received'])
+
+        # Other changes to the directory can be made while a piece is being received
+        def lock_directory():
+            with upload.directory.lock():
+                pass
+
+        class Stream:
+            def read(_, size):
+                thread = threading.Thread(target=lock_directory)
+                thread.start()
+                thread.join(10)
+                self.assertFalse(thread.is_alive())
+                return b''
+        self.assertEquals(4, upload.write_chunk(4, Stream()))
+
+        # Cannot finish early
+        rv = self.app.post(url + '/finalize')
+        self.assertEquals(400, rv.status_code)
+
+        rv = self.app.put(url + '?offset=4', data=b'456789')
+        self.assertEquals(10, json.loads(rv.data.decode())['received'])
+        rv = self.app.post(url + '/finalize')
+        self.assertEquals(200, rv.status_code)
+
+        recon = APTReconstruction.load_dataset_by_name(dataset_name, sample_name, 'Recon2')
+        with open(recon.get_pos_file(), 'rb') as fp:
+            self.assertEquals(b'0123456789', fp.read())
+        self.assertEquals(['ReconstructionMetadata.yaml', 'data.pos', 'tip_image.jpg'], sorted(os.listdir(recon.path)))
+        self.assertEquals([], [f for f in os.listdir(get_state_directory(recon.path)) if f.startswith('.upload-')])
+
+        # Uploads that stop receiving data are removed
+        rv = self.app.post(base, data=json.dumps({'filename': 'data.rrng', 'size': 10}))
+        url = '%s/%s' % (base, json.loads(rv.data.decode())['upload_id'])
+        self.assertEquals(200, self.app.put(url + '?offset=0', data=b'0123').status_code)
+        self.assertEquals(0, remove_abandoned_uploads(max_age=60))
+        for name in os.listdir(get_state_directory(recon.path)):
+            os.utime(os.path.join(get_state_directory(recon.path), name), (0, 0))
+        self.assertEquals(1, remove_abandoned_uploads(max_age=60))
+        self.assertEquals(400, self.app.get(url).status_code)
+        self.assertEquals([], [f for f in os.listdir(get_state_directory(recon.path)) if f.startswith('.upload-')])
+
+        # A second POS file is not allowed
+        rv = self.app.post(base, data=json.dumps({'filename': 'other.pos', 'size': 10}))
+        self.assertEquals(400, rv.status_code)
+
+        # RHIT files go to the sample, and can be cancelled
+        rv = self.app.post('/dataset/%s/sample/%s/uploads' % (dataset_name, sample_name),
+                           data=json.dumps({'filename': 'data.RHIT', 'size': 1}))
+        self.assertEquals(201, rv.status_code)
+        url = '/dataset/%s/sample/%s/uploads/%s' % (dataset_name, sample_name,
+                                                   json.loads(rv.data.decode())['upload_id'])
+        self.assertEquals(200, self.app.delete(url).status_code)
+        self.assertEquals(400, self.app.get(url).status_code)
+
+    def test_staged_files(self):
+        """Test attaching files from the staging area, instead of uploading them"""
+
+        staging = tempfile.mkdtemp()
+        for name in ['Tip.RHIT', 'Tip.pos', 'Tip.rrng']:
+            with open(os.path.join(staging, name), 'wb') as fp:
+                fp.write(b'Contents')
+        nucapt.app.config['STAGING_PATHS'] = [staging]
+        nucapt.app.config['STAGING_PLACEMENT_METHODS'] = ['move', 'copy']
+        try:
+            _, _, dataset_name = self.create_dataset()
+
+            # The form offers the option
+            rv = self.app.get('/dataset/%s/sample/create' % dataset_name)
+            self.assertIn(b'rhit_path', rv.data)
+
+            # Files outside of the staging area are not allowed, and the sample is not made
+            sample_data, _ = self.create_sample(dataset_name, no_rhit=True)
+            sample_data.update({'sample_name': 'Sample2', 'rhit_path': manager.data_path})
+            rv = self.app.post('/dataset/%s/sample/create' % dataset_name, data=sample_data)
+            self.assertIn(b'Files can only be attached from the staging area', rv.data)
+            self.assertFalse(os.path.exists(os.path.join(manager.data_path, dataset_name, 'Sample2')))
+
+            # Attach a RHIT file by its path in the staging area
+            sample_data['rhit_path'] = 'Tip.RHIT'
+            rv = self.app.post('/dataset/%s/sample/create' % dataset_name, data=sample_data)
+            self.assertEquals(302, rv.status_code)
+            sample = APTSampleDirectory.load_dataset_by_name(dataset_name, 'Sample2')
+            self.assertEquals('Tip.RHIT', os.path.basename(sample.get_rhit_path()))
+            self.assertFalse(os.path.exists(os.path.join(staging, 'Tip.RHIT')))  # It was moved
+            self.assertNotIn('rhit_path', sample.load_sample_information().metadata)
+
+            # Attach the reconstruction files, checking their types first
+            data, _ = self.create_reconstruction(dataset_name, 'Sample2')
+            data.update({'name': 'Recon2', 'pos_path': 'Tip.rrng', 'rrng_path': os.path.join(staging, 'Tip.rrng'),
+                         'tip_image': (BytesIO(b'<image>'), 'tip.jpg')})
+            del data['pos_file'], data['rrng_file']
+            rv = self.app.post('/dataset/%s/sample/Sample2/recon/create' % dataset_name, data=data)
+            self.assertIn(b'POS file must have the extension', rv.data)
+            self.assertFalse(os.path.exists(os.path.join(sample.path, 'Recon2')))
+
+            data.update({'pos_path': 'Tip.pos', 'tip_image': (BytesIO(b'<image>'), 'tip.jpg')})
+            rv = self.app.post('/dataset/%s/sample/Sample2/recon/create' % dataset_name, data=data)
+            self.assertEquals(302, rv.status_code)
+            recon = APTReconstruction.load_dataset_by_name(dataset_name, 'Sample2', 'Recon2')
+            self.assertEquals('Tip.pos', os.path.basename(recon.get_pos_file()))
+            self.assertEquals('Tip.rrng', os.path.basename(recon.get_rrng_file()))
+            self.assertNotIn('pos_path', recon.load_metadata().metadata)
+            self.assertEquals([], os.listdir(staging))
+        finally:
+            nucapt.app.config['STAGING_PATHS'] = []
+            nucapt.app.config['STAGING_PLACEMENT_METHODS'] = None
+            shutil.rmtree(staging)
+
+    def test_staged_files_failure(self):
+        """Test that files moved from the staging area are put back if a later one cannot be attached"""
+
+        staging = tempfile.mkdtemp()
+        for name in ['Tip.pos', 'Tip.rrng']:
+            with open(os.path.join(staging, name), 'wb') as fp:
+                fp.write(b'Contents')
+        nucapt.app.config['STAGING_PATHS'] = [staging]
+        nucapt.app.config['STAGING_PLACEMENT_METHODS'] = ['move']
+
+        def place_file(source, destination, methods=None):
+            if source.endswith('.rrng'):
+                raise DatasetParseException('Could not place ' + source)
+            return placement.place_file(source, destination, methods)
+
+        try:
+            _, _, dataset_name = self.create_dataset()
+            sample_data, _ = self.create_sample(dataset_name)
+            sample_name = sample_data['sample_name']
+
+            # The POS file is moved, then the RRNG file fails
+            data, _ = self.create_reconstruction(dataset_name, sample_name)
+            data.update({'name': 'Recon2', 'pos_path': 'Tip.pos', 'rrng_path': 'Tip.rrng',
+                         'tip_image': (BytesIO(b'<image>'), 'tip.jpg')})
+            del data['pos_file'], data['rrng_file']
+            with patch('nucapt.uploads.place_file', place_file):
+                rv = self.app.post('/dataset/%s/sample/%s/recon/create' % (dataset_name, sample_name), data=data)
+            self.assertIn(b'Could not place', rv.data)
+            self.assertFalse(os.path.exists(os.path.join(manager.data_path, dataset_name, sample_name, 'Recon2')))
+            for name in ['Tip.pos', 'Tip.rrng']:
+                with open(os.path.join(staging, name), 'rb') as fp:
+                    self.assertEquals(b'Contents', fp.read())
+
+            # Files are all checked before any is placed
+            recon = APTReconstruction.load_dataset_by_name(dataset_name, sample_name, 'Recon1')
+            os.unlink(recon.get_rrng_file())
+            with self.assertRaises(DatasetParseException):
+                attach_staged_files(recon, ['Tip.rrng', 'Missing.pos'])
+            self.assertTrue(os.path.isfile(os.path.join(staging, 'Tip.rrng')))
+            self.assertIsNone(recon._find_file('rrng', allow_none=True))
+        finally:
+            nucapt.app.config['STAGING_PATHS'] = []
+            nucapt.app.config['STAGING_PLACEMENT_METHODS'] = None
+            shutil.rmtree(staging)
 
     def test_add_analysis(self):
         """Test dealing with adding analysis data"""
@@ -370,6 +636,53 @@ class TestWebsite(unittest.TestCase):
         metadata = analysis.load_metadata()
         self.assertEquals(analysis_data['title'], metadata['title'])
 
+        # Only the files of the analysis are added to the manifest of the dataset
+        manifest = APTDataDirectory.load_dataset_by_name(dataset_name).get_manifest()
+        prefix = '/'.join([sample_name, recon_name, analysis_name]) + '/'
+        self.assertIn(prefix + 'new_data.dat', manifest)
+        self.assertTrue(all(name.startswith(prefix) for name in manifest))
+
+        # Edits that only change the metadata do not update it
+        del analysis_data['files']
+        analysis_data['title'] = 'newer title'
+        rv = self.app.post('/dataset/%s/sample/%s/recon/%s/analysis/%s/edit' % (dataset_name, sample_name,
+                                                                                recon_name, analysis_name),
+                           data=analysis_data)
+        self.assertEquals(302, rv.status_code)
+        self.assertEquals(manifest, APTDataDirectory.load_dataset_by_name(dataset_name).get_manifest())
+
+        # The new file is listed right away, and the file list can be sorted and split into pages
+        url = '/dataset/%s/sample/%s/recon/%s/analysis/%s' % (dataset_name, sample_name, recon_name, analysis_name)
+        rv = self.app.get(url + '?sort=name&order=desc&per_page=2')
+        self.assertEquals(200, rv.status_code)
+        soup = BeautifulSoup(rv.data, 'html.parser')
+        names = [row.find('td').text for row in soup.find_all('table')[1].find_all('tr')[1:]]
+        self.assertEquals(['new_data.dat', 'data.png'], names)
+        self.assertIn(b'Showing 2 of 3 files', rv.data)
+
+        rv = self.app.get(url + '?sort=name&order=desc&per_page=2&page=2')
+        soup = BeautifulSoup(rv.data, 'html.parser')
+        names = [row.find('td').text for row in soup.find_all('table')[1].find_all('tr')[1:]]
+        self.assertEquals(['data.dat'], names)
+
+        # The disk usage is kept up to date as files are added
+        rv = self.app.get('/dataset/%s/sample/%s/recon/%s/usage.json' % (dataset_name, sample_name, recon_name))
+        self.assertEquals(200, rv.status_code)
+        recon_usage = json.loads(rv.data.decode())
+        analysis_files = len(os.listdir(analysis.path))
+        self.assertEquals(analysis_files, recon_usage['children'][analysis_name]['files'])
+
+        rv = self.app.get('/usage.json')
+        usage = json.loads(rv.data.decode())
+        self.assertEquals([], usage['unmeasured'])
+        self.assertEquals(usage['total'], usage['datasets'][dataset_name]['total'])
+        self.assertGreater(usage['total']['size'], recon_usage['total']['size'])
+        self.assertIn(b'Disk Usage', self.app.get('/datasets').data)
+
+        # The records kept by the service are not in the dataset, so they are not published with it
+        dataset_path = os.path.join(manager.data_path, dataset_name)
+        self.assertEquals([], [name for _, _, files in os.walk(dataset_path) for name in files if name.startswith('.')])
+
     def test_publication(self):
         """Test dealing with reconstructions"""
 